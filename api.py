@@ -0,0 +1,359 @@
+"""Job-submission HTTP API that runs next to the Streamlit app.
+
+Usage:
+    python api.py [--host 0.0.0.0] [--port 8502]
+
+All endpoints except one-time export links use HTTP Basic auth against the
+users table. The API only queues jobs; they are processed by worker.py
+processes.
+
+    POST /jobs                      {"folder_url": ..., "mode": "analysis"|"basic"}
+                                    or {"jobs": [{"folder_url": ..., "mode": ...}, ...]}
+    GET  /jobs                      recent jobs for the user; ?ids=a,b,c to poll specific jobs
+    GET  /jobs/<job_id>             status and progress of one job; queued jobs report
+                                    their queue_position (basic jobs and users with
+                                    fewer running jobs go first)
+    GET  /jobs/<job_id>/artifacts/<pdf|xlsx>[/<part>]
+                                    download a finished report; large jobs are split
+                                    into numbered parts (default part 1). Reports are
+                                    rendered on the first download, so it can take longer
+    GET  /jobs/<job_id>/results[?format=json|csv|html]
+                                    the item results of a finished job, available at once;
+                                    html shows a page of them (&offset=&limit=)
+    GET  /reports                   the user's past runs and their report files
+    GET  /reports/export?runs=a,b[&results=csv|json]
+                                    stream a ZIP of the selected runs' reports and results
+    GET  /reports/export/<token>    stream an export prepared by the app (no auth, single use)
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from database import (
+    init_db, verify_user, get_password_hash, get_user_limits, create_job, get_job, get_user_jobs,
+    save_spans, prune_stage_spans, get_queue_positions
+)
+from storage import open_report, report_file_name, report_size
+from export import RESULT_FORMATS, export_file_name, redeem_export_link, stream_export, user_runs
+from chunked import ensure_report
+from results import RESULTS_VIEW_LIMIT, results_csv_blocks, results_json_blocks, results_html
+from telemetry import start_span_writer
+
+logger = logging.getLogger(__name__)
+
+MODES = ("analysis", "basic")
+MAX_JOBS_PER_REQUEST = 100
+MAX_POLL_IDS = 500
+ARTIFACT_TYPES = {
+    'pdf': ('pdf_path', "application/pdf"),
+    'xlsx': ('xlsx_path', "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+RESULT_VIEWS = {
+    'json': "application/json",
+    'csv': "text/csv; charset=utf-8",
+    'html': "text/html; charset=utf-8",
+}
+CHUNK_SIZE = 64 * 1024
+
+# bcrypt checks take a noticeable fraction of a second, so verified
+# credentials are remembered briefly to keep status polling cheap. Entries
+# are keyed by the stored password hash, which is read on every request, so
+# a password change or a deleted user takes effect at once.
+AUTH_CACHE_SECONDS = 300
+_auth_cache = {}
+_auth_lock = threading.Lock()
+
+def authenticate(header):
+    """Return the username for a valid Basic auth header, else None"""
+    if not header or not header.startswith("Basic "):
+        return None
+    try:
+        username, password = base64.b64decode(header[6:]).decode('utf-8').split(':', 1)
+    except Exception:
+        return None
+
+    stored = get_password_hash(username)
+    if not stored:
+        return None
+    key = hashlib.sha256(f"{stored}:{username}:{password}".encode('utf-8')).hexdigest()
+    now = time.time()
+    with _auth_lock:
+        cached = _auth_cache.get(key)
+        if cached and cached > now:
+            return username
+
+    if not verify_user(username, password):
+        return None
+
+    with _auth_lock:
+        _auth_cache[key] = now + AUTH_CACHE_SECONDS
+    return username
+
+def job_status(job, queue_positions=None):
+    """Public view of a job row; queued jobs include their place in the claim order"""
+    status = {
+        'job_id': job['job_id'],
+        'folder_url': job['folder_url'],
+        'mode': job['mode'],
+        'status': job['status'],
+        'total_images': job['total_images'],
+        'processed_images': job['processed_images'],
+        'progress': round(job['processed_images'] / job['total_images'], 3) if job['total_images'] else 0.0,
+        'error': job['error'],
+        'attempts': job['attempts'],
+        'worker': job['lease_owner'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'artifacts': {},
+    }
+    if job['status'] == 'queued':
+        positions = get_queue_positions() if queue_positions is None else queue_positions
+        status['queue_position'] = positions.get(job['job_id'])
+    if job['status'] == 'complete':
+        status['artifacts'] = {kind: f"/jobs/{job['job_id']}/artifacts/{kind}"
+                               for kind, (field, _) in ARTIFACT_TYPES.items() if job[field]}
+        status['results'] = f"/jobs/{job['job_id']}/results"
+        parts = report_parts(job)
+        if len(parts) > 1:
+            status['parts'] = [{kind: f"/jobs/{job['job_id']}/artifacts/{kind}/{number}" for kind in ARTIFACT_TYPES}
+                               for number in range(1, len(parts) + 1)]
+    return status
+
+def report_parts(job):
+    """Report paths of a finished job, one {'pdf': path, 'xlsx': path} dict per part"""
+    if job.get('report_parts'):
+        return [dict(zip(ARTIFACT_TYPES, part)) for part in json.loads(job['report_parts'])]
+    return [{kind: job[field] for kind, (field, _) in ARTIFACT_TYPES.items()}]
+
+def submit_job(username, folder_url, mode):
+    """Queue a job for the workers"""
+    job_id = uuid.uuid4().hex
+    if not create_job(job_id, username, folder_url, mode):
+        return None
+    return job_id
+
+class APIHandler(BaseHTTPRequestHandler):
+    server_version = "EstateGeniusAPI/1.0"
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def require_user(self):
+        username = authenticate(self.headers.get("Authorization"))
+        if not username:
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", 'Basic realm="EstateGenius AI"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        return username
+
+    def do_POST(self):
+        username = self.require_user()
+        if not username:
+            return
+
+        if urlparse(self.path).path.rstrip('/') != "/jobs":
+            self.send_json(404, {'error': "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            self.send_json(400, {'error': "Invalid JSON body"})
+            return
+
+        requested = payload.get('jobs') if isinstance(payload, dict) and 'jobs' in payload else [payload]
+        if not isinstance(requested, list) or not requested:
+            self.send_json(400, {'error': "Expected a job or a non-empty 'jobs' list"})
+            return
+        if len(requested) > MAX_JOBS_PER_REQUEST:
+            self.send_json(400, {'error': f"At most {MAX_JOBS_PER_REQUEST} jobs per request"})
+            return
+
+        for item in requested:
+            if not isinstance(item, dict) or not item.get('folder_url'):
+                self.send_json(400, {'error': "Each job needs a folder_url"})
+                return
+            if item.get('mode', 'analysis') not in MODES:
+                self.send_json(400, {'error': f"mode must be one of {', '.join(MODES)}"})
+                return
+
+        current_count, max_allowed = get_user_limits(username)
+        if current_count >= max_allowed:
+            self.send_json(403, {'error': f"Image limit reached: {current_count}/{max_allowed}"})
+            return
+
+        submitted = []
+        for item in requested:
+            job_id = submit_job(username, item['folder_url'], item.get('mode', 'analysis'))
+            if not job_id:
+                self.send_json(500, {'error': "Failed to queue job", 'jobs': submitted})
+                return
+            submitted.append({'job_id': job_id, 'status': 'queued', 'status_url': f"/jobs/{job_id}"})
+
+        self.send_json(202, {'jobs': submitted})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+
+        # Links handed out by the app carry their own one-time token instead of credentials
+        if len(parts) == 3 and parts[:2] == ["reports", "export"]:
+            link = redeem_export_link(parts[2])
+            if not link:
+                self.send_json(404, {'error': "Export link expired or already used"})
+                return
+            self.send_export(*link)
+            return
+
+        username = self.require_user()
+        if not username:
+            return
+
+        if parts == ["reports"]:
+            runs = [{'run': key, 'label': label, 'files': [report_file_name(row[2]) for row in rows]}
+                    for key, label, rows in user_runs(username)]
+            self.send_json(200, {'runs': runs})
+            return
+
+        if parts == ["reports", "export"]:
+            query = parse_qs(url.query)
+            run_keys = [key for value in query.get('runs', []) for key in value.split(',') if key]
+            results = query.get('results', [None])[0]
+            if not run_keys or (results and results not in RESULT_FORMATS):
+                self.send_json(400, {'error': "runs is required; results must be csv or json"})
+                return
+            self.send_export(username, run_keys, results)
+            return
+
+        if parts == ["jobs"]:
+            ids = [job_id for value in parse_qs(url.query).get('ids', [])
+                   for job_id in value.split(',') if job_id]
+            if len(ids) > MAX_POLL_IDS:
+                self.send_json(400, {'error': f"At most {MAX_POLL_IDS} ids per request"})
+                return
+            jobs = get_user_jobs(username, ids or None, limit=len(ids) if ids else 100)
+            positions = get_queue_positions() if any(job['status'] == 'queued' for job in jobs) else {}
+            self.send_json(200, {'jobs': [job_status(job, positions) for job in jobs]})
+            return
+
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = get_job(parts[1])
+            if not job or job['username'] != username:
+                self.send_json(404, {'error': "Job not found"})
+                return
+
+            if len(parts) == 2:
+                self.send_json(200, job_status(job))
+                return
+
+            if len(parts) in (4, 5) and parts[2] == "artifacts" and parts[3] in ARTIFACT_TYPES:
+                part = parts[4] if len(parts) == 5 else "1"
+                if not part.isdigit():
+                    self.send_json(404, {'error': "Not found"})
+                    return
+                self.send_artifact(job, parts[3], int(part))
+                return
+
+            if len(parts) == 3 and parts[2] == "results":
+                query = parse_qs(url.query)
+                view = query.get('format', ['json'])[0]
+                offset, limit = query.get('offset', ['0'])[0], query.get('limit', [str(RESULTS_VIEW_LIMIT)])[0]
+                if view not in RESULT_VIEWS or not offset.isdigit() or not limit.isdigit():
+                    self.send_json(400, {'error': "format must be json, csv or html; offset and limit are counts"})
+                    return
+                self.send_results(job, view, int(offset), int(limit))
+                return
+
+        self.send_json(404, {'error': "Not found"})
+
+    def send_artifact(self, job, kind, part=1):
+        _, mime_type = ARTIFACT_TYPES[kind]
+        parts = report_parts(job) if job['status'] == 'complete' else []
+        path = parts[part - 1][kind] if 1 <= part <= len(parts) else None
+        if path:
+            path = ensure_report(path, job['job_id'])
+        if not path:
+            self.send_json(404, {'error': "Artifact not available"})
+            return
+
+        # Old reports may have been compressed by storage maintenance; clients always get the original
+        self.send_response(200)
+        self.send_header("Content-Type", mime_type)
+        self.send_header("Content-Length", str(report_size(path)))
+        self.send_header("Content-Disposition", f'attachment; filename="{report_file_name(path)}"')
+        self.end_headers()
+        with open_report(path) as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def send_results(self, job, view, offset, limit):
+        if job['status'] != 'complete':
+            self.send_json(404, {'error': "Results not available"})
+            return
+        if view == 'html':
+            blocks = [results_html(job['job_id'], offset, limit).encode('utf-8')]
+        else:
+            blocks = results_csv_blocks(job['job_id']) if view == 'csv' else results_json_blocks(job['job_id'])
+        self.send_response(200)
+        self.send_header("Content-Type", RESULT_VIEWS[view])
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for block in blocks:
+            self.wfile.write(block)
+
+    def send_export(self, username, run_keys, results):
+        # The archive size is not known up front, so the response ends when the connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="{export_file_name()}"')
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for chunk in stream_export(username, run_keys, results):
+            self.wfile.write(chunk)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EstateGenius AI job API")
+    parser.add_argument("--host", default=os.getenv('API_HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.getenv('API_PORT', '8502')))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    prune_stage_spans()
+    start_span_writer(save_spans)
+
+    server = ThreadingHTTPServer((args.host, args.port), APIHandler)
+    logger.info(f"API listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
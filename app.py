@@ -1,39 +1,78 @@
 import streamlit as st
-import requests
-import json
 import os
-import re
-import anthropic
 import pandas as pd
-from PIL import Image
-from io import BytesIO
-from reportlab.platypus import Frame
 from datetime import datetime, timedelta
-import base64
 from dotenv import load_dotenv
 from auth_original import authenticated_layout
 from database import (
     init_db, get_user_limits, increment_image_count, delete_user, 
-    get_all_users, update_user_limit, is_admin, save_report, get_user_reports
+    get_all_users, update_user_limit, is_admin, save_report, get_user_reports,
+    save_spans, prune_stage_spans, get_stage_spans, save_run_usage, get_daily_usage,
+    get_run_usage, USAGE_COUNTERS, update_storage_quota, get_user_priorities, update_user_priority,
+    get_run_profiles
 )
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Image as PDFImage, Paragraph, Spacer
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-from reportlab.lib.units import mm
-from streamlit.components.v1 import html
+from pipeline import MAX_IMAGES_PER_RUN, extract_file_ids_from_folder, process_image
+from reports import PRICE_SUMMARY_HEADERS, new_report_base_name, reports_subdir
+from storage import (STORAGE_QUOTA_MB, enforce_quota, open_report, report_file_name, resolve_report_path,
+                     user_quota_bytes, user_storage_bytes)
+from prices import folder_summary_rows
+from export import (EXPORT_BASE_URL, EXPORT_INLINE_MAX_MB, create_export_link, export_archive, export_file_name,
+                    export_size, user_runs)
+from chunked import REPORT_PART_SIZE, ReportSpool, ensure_report, pipelined_chunks
+from results import RESULTS_VIEW_LIMIT, results_csv, results_html
+from telemetry import NORMAL_OUTCOMES, run_context, start_span_writer, submit_with_context
+from progress import ProgressChannel, ProgressTracker, run_item
+from appraisals import REUSE_PRIOR_APPRAISALS, search_past_appraisals
+from routing import run_routing_summary
+from lots import GROUP_VIEWS, group_lots
+from prefetch import PREFETCH_ENABLED, FolderPrefetch, is_folder_url
+from scheduler import admitted, lane_for_mode, scheduler_stats, tenant
+from visual_index import load_visual_index
+from profiling import PROFILE_FILES, profiled_run, profiling_setting, read_profile_file, set_profiling
+import re
 import time
-import openpyxl
 import random
-from openpyxl.drawing.image import Image as XLImage
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 st.set_page_config(page_title="EstateGenius AI", page_icon="🔍", layout="wide")
 
 load_dotenv()
 init_db()
 
-ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
-SEARCH_API_KEY = os.getenv('SEARCH_API_KEY')
+@st.cache_resource
+def start_telemetry():
+    """Persist pipeline stage spans; runs once per server process"""
+    prune_stage_spans()
+    return start_span_writer(save_spans)
+
+start_telemetry()
+
+@st.cache_resource
+def start_visual_index():
+    """Load the image hashes of past appraisals; runs once per server process"""
+    return load_visual_index()
+
+start_visual_index()
+
+# Images processed in parallel for an interactive run
+UI_IMAGE_CONCURRENCY = int(os.getenv('UI_IMAGE_CONCURRENCY', '4'))
+PROGRESS_REFRESH_SECONDS = 0.5
+# How long a click waits for a prefetch's folder listing before listing again
+PREFETCH_LISTING_WAIT_SECONDS = 30
+FUNNY_MESSAGE_SECONDS = 4
+
+STAGE_LABELS = {
+    'starting': "starting",
+    'download': "downloading",
+    'decode': "preparing",
+    'lens': "searching",
+    'llm': "appraising",
+    'queue_drive': "queued",
+    'queue_lens': "queued",
+    'queue_llm': "queued",
+}
 
 def get_funny_message():
     """Return a random funny message for processing state"""
@@ -65,305 +104,182 @@ def format_time(seconds):
         return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
     return "00:00:00"
 
-def create_pdf_report(results, output_file):
-    """Create PDF report with images and analyses - modified for two columns"""
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Image as PDFImage, Paragraph, Spacer
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.styles import getSampleStyleSheet
-    from reportlab.lib import colors
-    from reportlab.lib.units import mm
-    
-    class CustomDocTemplate(SimpleDocTemplate):
-        def __init__(self, filename, **kwargs):
-            super().__init__(filename, **kwargs)
-            self.topMargin = 15*mm
-            self.leftMargin = 25*mm
-    
-    doc = CustomDocTemplate(output_file, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Create custom style for analysis text with increased line spacing
-    analysis_style = styles['BodyText']
-    analysis_style.leading = 20  # Increase line spacing (default is usually around 12-14)
-    
-    # Create custom styles
-    header_style = styles['Title']
-    header_style.spaceAfter = 5
-    
-    contact_style = styles['Normal']
-    contact_style.fontSize = 9
-    contact_style.leading = 11
-    contact_style.textColor = colors.gray
-    
-    tagline_style = styles['Normal']
-    tagline_style.alignment = 1  # Center alignment
-    tagline_style.fontSize = 11
-    tagline_style.leading = 14
-    tagline_style.spaceAfter = 20
-    
-    # Create header table with title and contact info
-    header_style.textColor = colors.HexColor('#D97757')  # Set title color
-    header_style.alignment = 1  # Center alignment
-    
-    # Contact info in the right column
-    contact_info = [
-        [Paragraph("Email: maggie@estategeniusai.com", contact_style)],
-        [Paragraph("Mobile: (+1)469-659-7089", contact_style)],
-        [Paragraph("Website: www.estategeniusai.com", contact_style)]
-    ]
-    
-    # Title and taglines in the center column
-    title_content = [
-        [Paragraph("EstateGenius AI", header_style)],
-        [Paragraph("Your Pricing Partner", tagline_style)],
-        [Paragraph("Saves Hours of Internet Search", tagline_style)],
-        [Paragraph("We Customize AI According to Your Needs", tagline_style)]
-    ]
-    
-    # Create tables for each section
-    contact_table = Table(contact_info, colWidths=[200])
-    title_table = Table(title_content, colWidths=[300])
-    
-    # Style the tables
-    contact_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
-    
-    title_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
-    
-    # Create a table for the header layout
-    header_layout = Table([
-        ['', title_table, contact_table]
-    ], colWidths=[20, 300, 200])  # Added small left margin
-    
-    header_layout.setStyle(TableStyle([
-        ('ALIGN', (1, 0), (1, 0), 'CENTER'),  # Center title
-        ('ALIGN', (2, 0), (2, 0), 'RIGHT'),   # Right align contact
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
-    
-    elements.append(header_layout)
-    elements.append(Spacer(1, 20))
-
-    # Modified table with only two columns
-    data = [["Image", "Analysis"]]  # Changed headers
-    for result in results:
-        try:
-            img = PDFImage(result['temp_image_path'], width=150, height=150)
-            # Use only the analysis
-            row = [
-                img,
-                Paragraph(result['analysis'], analysis_style)
-            ]
-            data.append(row)
-        except Exception as e:
-            st.error(f"PDF error: {str(e)}")
-
-    # Adjusted column widths for two columns
-    table = Table(data, colWidths=[160, 420])  # Increased width for analysis column
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.grey),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('FONTSIZE', (0,0), (-1,0), 12),
-        ('BOTTOMPADDING', (0,0), (-1,0), 12),
-        ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('ALIGN', (1,1), (1,-1), 'LEFT'),  # Left align analysis text
-    ]))
-
-    elements.append(table)
-
-    try:
-        doc.build(elements)
-        return True
-    except Exception as e:
-        st.error(f"PDF creation failed: {str(e)}")
-        return False
-
-def create_excel_report(results, output_file):
-    """Create Excel report with images and analyses - modified for two columns"""
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    
-    # Add contact information (top left)
-    ws['A1'] = "Email: maggie@estategeniusai.com"
-    ws['A2'] = "Mobile: (+)469-659-7089"
-    ws['A3'] = "Website: www.estategeniusai.com"
-    
-    # Style contact info
-    for cell in [ws['A1'], ws['A2'], ws['A3']]:
-        cell.font = openpyxl.styles.Font(size=9, color="666666")  # Gray color
-        cell.alignment = openpyxl.styles.Alignment(vertical='center')
-    
-    # Add header and taglines (center aligned in column B with same width as analysis)
-    header_cell = ws['B1']
-    header_cell.value = "EstateGenius AI"
-    header_cell.font = openpyxl.styles.Font(size=16, bold=True)
-    header_cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
-    
-    # Add taglines
-    taglines = [
-        "Your Pricing Partner",
-        "Saves Hours of Internet Search",
-        "We Customize AI According to Your Needs"
-    ]
-    
-    for idx, tagline in enumerate(taglines, 2):
-        cell = ws[f'B{idx}']
-        cell.value = tagline
-        cell.font = openpyxl.styles.Font(size=11)
-        cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
-    
-    # Add some space before the table headers
-    start_row = 6  # Start the actual content from row 6
-    
-    # Modified headers for two columns
-    headers = ['Image', 'Analysis']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=start_row, column=col, value=header)
-        cell.font = openpyxl.styles.Font(bold=True)
-        cell.fill = openpyxl.styles.PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-        cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
-
-    # Add data with combined filename and analysis
-    for row_idx, result in enumerate(results, start_row + 1):
-        try:
-            if os.path.exists(result['temp_image_path']):
-                img = XLImage(result['temp_image_path'])
-                img.width = 200
-                img.height = 200
-                ws.add_image(img, f'A{row_idx}')
-            
-            # Use only the analysis in second column
-            analysis_cell = ws.cell(row=row_idx, column=2, value=result['analysis'])
-            analysis_cell.alignment = openpyxl.styles.Alignment(wrap_text=True, vertical='top')
-            
-            # Set row height based on content
-            ws.row_dimensions[row_idx].height = max(150, len(result['analysis'].split('\n')) * 15)
-            
-        except Exception as e:
-            st.error(f"Excel error: {str(e)}")
-
-    # Adjust column widths for two columns
-    ws.column_dimensions['A'].width = 30  # For images
-    ws.column_dimensions['B'].width = 70  # Wider column for combined analysis
-
-    # Set row heights for header section
-    for i in range(1, 5):  # Rows 1-4 (contact info and taglines)
-        ws.row_dimensions[i].height = 20
-    
-    # Add borders to content cells
-    content_range = f'A{start_row}:B{len(results) + start_row}'
-    for row in ws[content_range]:
-        for cell in row:
-            cell.border = openpyxl.styles.Border(
-                left=openpyxl.styles.Side(style='thin'),
-                right=openpyxl.styles.Side(style='thin'),
-                top=openpyxl.styles.Side(style='thin'),
-                bottom=openpyxl.styles.Side(style='thin')
-            )
-
-    try:
-        wb.save(output_file)
-        return True
-    except Exception as e:
-        st.error(f"Save error: {str(e)}")
-        return False
-    
-def create_basic_report(images):
-    """Create report data without API processing and analysis"""
-    results = []
-    temp_files = []
-    
-    for image in images:
-        try:
-            response = requests.get(image['url'])
-            if response.status_code != 200:
-                continue
-                
-            img_path = f"temp_{image['id']}.jpg"
-            with Image.open(BytesIO(response.content)) as img:
-                img.convert('RGB').save(img_path)
-            temp_files.append(img_path)
-
-            results.append({
-                'name': image['name'],
-                'temp_image_path': img_path,
-                'analysis': ''
-            })
-            
-        except Exception as e:
-            st.error(f"Basic processing error: {str(e)}")
-            
-    return results, temp_files
-
-def get_anthropic_analysis(json_data):
-    """Get analysis from Anthropic API"""
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-
-    prompt = f"""Analyze product search results and provide structured summary following these guidelines:
-    1. Name: If there are multiple listings with same name or almost similar name then the item must be exactly 
-    the same item as that in image. then assertively say the item: "Name", if the all the names in item listings  are mutually exclusive
-    then the first listing is likely the item similar to the image then say item: "likely- first listing item name"
-    2.opinion: tell succintly what you know about the item, its collector market and trends.
-    3. ebay prices: give the prices seen in the all the ebay listings seperated by commas, just the prices
-    4. etsy prices:give the prices seen in the all the etsy listings seperated by commas, just the prices
-    5. amazon,walmart,macys prices if available.
-    5. auctions houses:just say this item was or is listed in this action houses but dont say the prices in there.
-    6. give all the above bullet points for clear reading.
-    7. dont give any introduction like this:"Here's the structured summary:"
-    
-
-    Data: {json.dumps(json_data, indent=2)}"""
-
-    try:
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return message.content[0].text if message.content else "No analysis generated"
-    except Exception as e:
-        st.error(f"Analysis error: {str(e)}")
-        return "Analysis failed"
-
-def search_google_lens(image_url):
-    """Search Google Lens for image matches"""
-    try:
-        response = requests.get(
-            "https://www.searchapi.io/api/v1/search",
-            params={
-                "engine": "google_lens",
-                "url": image_url,
-                "api_key": SEARCH_API_KEY
-            }
-        )
-        return response.json().get("visual_matches", [])[:15]
-    except Exception as e:
-        st.error(f"Lens search failed: {str(e)}")
-        return []
-
-def extract_file_ids_from_folder(folder_url):
-    """Extract file IDs from Google Drive folder"""
-    try:
-        folder_id = folder_url.split('/')[-1]
-        files_url = f"https://drive.google.com/drive/folders/{folder_id}"
-        response = requests.get(files_url)
-        
-        pattern = r"https://drive\.google\.com/file/d/([a-zA-Z0-9_-]+)"
-        file_ids = list(set(re.findall(pattern, response.text)))
-        
-        return [{'id': fid, 'url': f"https://drive.google.com/uc?id={fid}", 'name': f"image_{fid}.jpg"} for fid in file_ids]
-    except Exception as e:
-        st.error(f"Error extracting files: {str(e)}")
-        return []
+def appraisal_search():
+    """Search box over the user's past appraisals"""
+    with st.expander("🔎 Search past appraisals"):
+        query = st.text_input("Item name, maker or pattern", key="appraisal_query",
+                              placeholder="e.g. Hummel goose girl, Pyrex butterprint")
+        if not query:
+            return
+
+        username = st.session_state.authenticated_user
+        matches = search_past_appraisals(query, None if is_admin(username) else username)
+        if not matches:
+            st.info("No past appraisals match your search")
+            return
+
+        st.caption(f"{len(matches)} matching appraisals")
+        for appraisal_id, item_name, created_at, snippet, analysis in matches:
+            with st.container(border=True):
+                st.markdown(f"**{item_name}** · {created_at}")
+                st.markdown(snippet)
+                if st.toggle("Show full appraisal", key=f"appraisal_{appraisal_id}"):
+                    st.text(analysis)
+
+def render_progress(tracker, progress_bar, status_text, elapsed_placeholder, remaining_placeholder):
+    """Render the current state of a ProgressTracker into the status widgets"""
+    progress_bar.progress(tracker.fraction)
+
+    spinner_chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
+    spinner = spinner_chars[int(time.time() * 10) % len(spinner_chars)]
+    active = ", ".join(f"{count} {STAGE_LABELS.get(stage, stage)}"
+                       for stage, count in sorted(tracker.stage_counts().items()))
+    status_text.write(f"{spinner} Processed {tracker.done} of {tracker.total} images"
+                      + (f" ({active})" if active else ""))
+
+    eta = tracker.eta_seconds()
+    elapsed_placeholder.metric("⏱️ Elapsed Time", format_time(tracker.elapsed))
+    remaining_placeholder.metric("⏳ Estimated Remaining", format_time(eta) if eta is not None else "Calculating...")
+
+def stage_latency_dashboard():
+    """Per-stage latency percentiles from recorded spans"""
+    st.subheader("⏱️ Stage Latency")
+    windows = {"Last 24 hours": (24, "h"), "Last 7 days": (24 * 7, "D"), "Last 30 days": (24 * 30, "D")}
+    window = st.selectbox("Time window", list(windows), key="latency_window")
+    hours, bucket = windows[window]
+
+    spans = get_stage_spans(hours)
+    if not spans:
+        st.info("No stage timings recorded in this window")
+        return
+
+    df = pd.DataFrame(spans, columns=["created_at", "stage", "duration_ms", "outcome", "bytes", "tokens"])
+    df["created_at"] = pd.to_datetime(df["created_at"])
+    df["error"] = ~df["outcome"].isin(NORMAL_OUTCOMES)
+
+    summary = df.groupby("stage").agg(
+        count=("duration_ms", "size"),
+        error_rate=("error", "mean"),
+        p50_ms=("duration_ms", lambda d: d.quantile(0.50)),
+        p95_ms=("duration_ms", lambda d: d.quantile(0.95)),
+        p99_ms=("duration_ms", lambda d: d.quantile(0.99)),
+        total_s=("duration_ms", lambda d: d.sum() / 1000),
+        mb=("bytes", lambda b: b.sum() / 1e6),
+        tokens=("tokens", "sum"),
+    ).sort_values("total_s", ascending=False)
+    st.dataframe(summary.round(2))
+
+    percentile = st.radio("Percentile over time", ["p50", "p95", "p99"], index=1, horizontal=True, key="latency_pct")
+    quantile = {"p50": 0.50, "p95": 0.95, "p99": 0.99}[percentile]
+    trend = (df.groupby([df["created_at"].dt.floor(bucket), "stage"])["duration_ms"]
+               .quantile(quantile).unstack("stage"))
+    st.line_chart(trend)
+
+def usage_dashboard():
+    """Token and API-call usage per user/day and per run"""
+    st.subheader("💰 API Usage")
+    days = st.selectbox("Period", [1, 7, 30, 90], index=2, format_func=lambda d: f"Last {d} days", key="usage_days")
+
+    daily = get_daily_usage(days)
+    if not daily:
+        st.info("No usage recorded in this period")
+        return
+
+    counters = [name.replace('_', ' ').title() for name in USAGE_COUNTERS]
+    df = pd.DataFrame(daily, columns=["Day", "Username", "Runs", "Images", "Elapsed (s)"] + counters)
+    df["Username"] = df["Username"].fillna("(batch)")
+    images = df["Images"].where(df["Images"] > 0)
+    df["Tokens / Image"] = ((df["Input Tokens"] + df["Output Tokens"]) / images).round(1)
+    df["Seconds / Image"] = (df["Elapsed (s)"] / images).round(2)
+    st.dataframe(df, hide_index=True)
+
+    by_user = df.groupby("Username")[["Runs", "Images"] + counters].sum()
+    st.bar_chart(by_user[["Input Tokens", "Output Tokens"]])
+
+    st.markdown("**Recent runs**")
+    runs = pd.DataFrame(get_run_usage(), columns=["Run", "Username", "Mode", "Images", "Elapsed (s)",
+                                                  "Created", "Models", "Fast", "Full", "Skipped",
+                                                  "Tokens Saved", "LLM Seconds Saved"] + counters)
+    run_images = runs["Images"].where(runs["Images"] > 0)
+    runs["Tokens / Image"] = ((runs["Input Tokens"] + runs["Output Tokens"]) / run_images).round(1)
+    runs["Seconds / Image"] = (runs["Elapsed (s)"] / run_images).round(2)
+    st.dataframe(runs, hide_index=True)
+
+def speculative_prefetch(folder_url):
+    """Start listing and downloading a newly entered folder before any button is clicked"""
+    prefetch = st.session_state.get('prefetch')
+    if prefetch and prefetch.folder_url == folder_url:
+        return prefetch
+    if prefetch:
+        prefetch.cancel()
+        del st.session_state['prefetch']
+    if not PREFETCH_ENABLED or not is_folder_url(folder_url):
+        return None
+    prefetch = FolderPrefetch(folder_url, st.session_state.authenticated_user).start()
+    st.session_state['prefetch'] = prefetch
+    return prefetch
+
+def read_report(path, run_id=None):
+    """Report bytes, rendering the run's reports first if they were never requested"""
+    with open_report(ensure_report(path, run_id) or path) as f:
+        return f.read()
+
+def export_reports(username):
+    """Sidebar section that exports selected past runs as one ZIP"""
+    runs = user_runs(username)
+    if not runs:
+        return
+    labels = {key: label for key, label, _ in runs}
+    with st.expander("📦 Export reports"):
+        selected = st.multiselect("Runs", list(labels), format_func=labels.get, key="export_runs")
+        results = st.selectbox("Include item results", ["None", "CSV", "JSON"], key="export_results")
+        results = None if results == "None" else results.lower()
+        if not selected:
+            return
+        if EXPORT_BASE_URL:
+            # The API streams the archive; the app only hands out a one-time link
+            if st.button("Prepare download link", key="export_link"):
+                token = create_export_link(username, selected, results)
+                st.link_button("📥 Download ZIP", f"{EXPORT_BASE_URL}/reports/export/{token}")
+        elif export_size(username, selected) > EXPORT_INLINE_MAX_MB * 1024 * 1024:
+            st.warning(f"This export is larger than {EXPORT_INLINE_MAX_MB} MB. Select fewer runs, "
+                       "or ask an administrator to set EXPORT_BASE_URL so exports stream from the API.")
+        else:
+            st.download_button("📥 Download ZIP", data=partial(export_archive, username, selected, results),
+                               file_name=export_file_name(), mime="application/zip", key="export_zip")
+
+def profiling_panel(users):
+    """Switch run profiling on or off and download recorded profiles"""
+    st.subheader("🔬 Profiling")
+    enabled, usernames = profiling_setting()
+    profile_runs = st.checkbox("Profile new runs (cProfile, stack sampling and tracemalloc; slows runs down)",
+                               value=enabled, key="profiling_enabled")
+    profile_users = st.multiselect("Only for these users (all users if empty)",
+                                   [username for _, username, *_ in users], default=usernames, key="profiling_users")
+    if st.button("Save Profiling"):
+        if set_profiling(profile_runs, profile_users):
+            st.success("Profiling settings saved")
+        else:
+            st.error("Failed to save profiling settings")
+
+    profiles = get_run_profiles()
+    if not profiles:
+        st.info("No profiles recorded yet")
+        return
+    df = pd.DataFrame(profiles, columns=["Run", "Kind", "Username", "Wall (s)", "CPU (s)", "Peak Memory",
+                                         "Directory", "Created"])
+    df["Peak Memory"] = (df["Peak Memory"] / 1e6).round(1).astype(str) + " MB"
+    st.dataframe(df.drop(columns=["Directory"]).round(2), hide_index=True)
+
+    labels = {idx: f"{row[7]} — {row[0][:12]} ({row[1]}, {row[2]})" for idx, row in enumerate(profiles)}
+    selected = st.selectbox("Profile", list(labels), format_func=labels.get, key="profile_selected")
+    profile_dir = profiles[selected][6]
+    columns = st.columns(len(PROFILE_FILES))
+    for column, (name, mime_type) in zip(columns, PROFILE_FILES.items()):
+        if os.path.exists(os.path.join(profile_dir, name)):
+            column.download_button(f"📥 {name}", data=partial(read_profile_file, profile_dir, name),
+                                   file_name=f"{os.path.basename(profile_dir)}_{name}", mime=mime_type,
+                                   key=f"profile_{name}")
 
 def admin_panel():
     """Admin dashboard functionality"""
@@ -394,6 +310,48 @@ def admin_panel():
         else:
             st.error("Failed to update limit")
 
+    st.markdown("---")
+    st.subheader("Scheduling")
+    st.dataframe(pd.DataFrame(scheduler_stats()), hide_index=True)
+    priorities = get_user_priorities()
+    st.dataframe(pd.DataFrame([(username, priorities.get(username, 1)) for _, username, *_ in users],
+                              columns=["Username", "Priority"]), hide_index=True)
+    st.caption("A user with priority 2 gets twice the share of a busy server as a user with priority 1. "
+               "Basic reports are always served before appraisals.")
+    priority_user_id = st.number_input("User ID for priority", min_value=1)
+    new_priority = st.number_input("New priority", min_value=1, max_value=10, value=1)
+    if st.button("Update Priority"):
+        if update_user_priority(priority_user_id, new_priority):
+            st.success("Priority updated")
+            st.rerun()
+        else:
+            st.error("Failed to update priority")
+
+    st.markdown("---")
+    st.subheader("Report Storage")
+    st.dataframe(pd.DataFrame(
+        [(username, round(user_storage_bytes(username) / (1024 * 1024), 1),
+          round(user_quota_bytes(username) / (1024 * 1024))) for _, username, *_ in users],
+        columns=["Username", "Used (MB)", "Quota (MB)"]), hide_index=True)
+    quota_user_id = st.number_input("User ID for storage quota", min_value=1)
+    new_quota = st.number_input("New storage quota (MB)", min_value=0, value=STORAGE_QUOTA_MB,
+                                help="0 keeps every report")
+    if st.button("Update Quota"):
+        if update_storage_quota(quota_user_id, new_quota):
+            st.success("Storage quota updated")
+            st.rerun()
+        else:
+            st.error("Failed to update quota")
+
+    st.markdown("---")
+    profiling_panel(users)
+
+    st.markdown("---")
+    stage_latency_dashboard()
+
+    st.markdown("---")
+    usage_dashboard()
+
 def main_application():
     """Main application logic"""
     st.title("🔍 EstateGenius AI")
@@ -410,6 +368,12 @@ def main_application():
         
         current_count, max_allowed = get_user_limits(st.session_state.authenticated_user)
         st.metric("Processed Images", f"{current_count}/{max_allowed}")
+        used_mb = user_storage_bytes(st.session_state.authenticated_user) / (1024 * 1024)
+        quota_mb = user_quota_bytes(st.session_state.authenticated_user) / (1024 * 1024)
+        if quota_mb:
+            st.caption(f"Report storage: {used_mb:.1f} of {quota_mb:.0f} MB (oldest reports are removed first)")
+        else:
+            st.caption(f"Report storage: {used_mb:.1f} MB")
         st.markdown("---")
         st.button("Logout", on_click=lambda: st.session_state.pop("authenticated_user"), key="logout_button")
 
@@ -420,15 +384,13 @@ def main_application():
         report_groups = {}
         for report in reports:
             try:
-                full_path = report[0]
-                if not full_path.startswith('/var/lib/estateai/reports'):
-                    full_path = os.path.join('/var/lib/estateai/reports', os.path.basename(full_path))
+                full_path = resolve_report_path(report[0])
                 
-                base_name = os.path.basename(full_path).split('.')[0]
+                base_name = report_file_name(full_path).split('.')[0]
                 parts = base_name.split('_')
                 if len(parts) >= 3:
                     timestamp_str = f"{parts[1]}_{parts[2]}"
-                    report_groups.setdefault(timestamp_str, []).append(full_path)
+                    report_groups.setdefault(timestamp_str, []).append((full_path, report[2]))
             except Exception as e:
                 st.error(f"Error processing report {full_path}: {str(e)}")
 
@@ -436,31 +398,46 @@ def main_application():
             try:
                 report_date = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
                 with st.expander(f"📅 {report_date.strftime('%Y-%m-%d %H:%M')}"):
-                    for path in report_paths:
+                    for path, report_run_id in report_paths:
                         try:
-                            if path.endswith('.pdf'):
+                            file_name = report_file_name(path)
+                            if file_name.endswith('.pdf'):
                                 btn_label = "📄 PDF Version"
                                 mime_type = "application/pdf"
-                            elif path.endswith('.xlsx'):
+                            elif file_name.endswith('.xlsx'):
                                 btn_label = "📊 Excel Version"
                                 mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                             else:
                                 continue
+                            part = re.search(r"_part(\d+)\.", file_name)
+                            if part:
+                                btn_label += f" (Part {int(part.group(1))})"
                             
-                            with open(path, "rb") as f:
-                                st.download_button(
-                                    label=btn_label,
-                                    data=f.read(),
-                                    file_name=os.path.basename(path),
-                                    mime=mime_type
-                                )
+                            # Files are only read (and rendered, if need be) when their button is clicked
+                            st.download_button(
+                                label=btn_label,
+                                data=partial(read_report, path, report_run_id),
+                                file_name=file_name,
+                                mime=mime_type
+                            )
                         except Exception as e:
                             st.error(f"Error loading file {path}: {str(e)}")
             except Exception as e:
                 st.error(f"Error loading report {timestamp_str}: {str(e)}")
 
+        export_reports(st.session_state.authenticated_user)
+
+    appraisal_search()
+
     folder_url = st.text_input("Google Drive Folder URL", 
                               placeholder="https://drive.google.com/drive/folders/...")
+    prefetch = speculative_prefetch(folder_url)
+    if prefetch and prefetch.quota_error:
+        st.warning(prefetch.quota_error)
+    reuse_prior = st.checkbox("♻️ Reuse prior appraisals of identical items", value=REUSE_PRIOR_APPRAISALS,
+                              help="Skips the AI appraisal when the same item was appraised recently")
+    group_views = st.checkbox("📸 Appraise several photos of the same lot as one item", value=GROUP_VIEWS,
+                              help="Consecutive photos that look alike get a single appraisal and share a report row")
 
     col1, col2 = st.columns(2)
     with col1:
@@ -473,7 +450,10 @@ def main_application():
             st.error("Please enter a valid folder URL")
             return
 
-        with st.status("🔍 Processing images...", expanded=True) as status:
+        run_id = uuid.uuid4().hex
+        with st.status("🔍 Processing images...", expanded=True) as status, \
+                run_context(run_id, st.session_state.authenticated_user) as usage, \
+                profiled_run(run_id, st.session_state.authenticated_user):
             # Initialize containers for updates
             progress_container = st.container()
             metrics_container = st.container()
@@ -489,13 +469,19 @@ def main_application():
                 elapsed_placeholder = col1.empty()
                 remaining_placeholder = col2.empty()
             
-            # Get images from folder
-            images = extract_file_ids_from_folder(folder_url)
+            # Get images from folder, reusing the listing made while the URL was entered
+            images = None
+            if prefetch:
+                # Images not prefetched yet are downloaded by the run itself
+                prefetch.cancel()
+                images = prefetch.listing(timeout=PREFETCH_LISTING_WAIT_SECONDS)
+            if not images:
+                images = extract_file_ids_from_folder(folder_url, on_error=st.error)
+            if len(images) > MAX_IMAGES_PER_RUN:
+                st.warning(f"Processing the first {MAX_IMAGES_PER_RUN} of {len(images)} images in the folder")
+                images = images[:MAX_IMAGES_PER_RUN]
+            # Only the images that will be processed count towards the user's limit
             image_count = len(images)
-            
-            if image_count > 25:
-                st.warning("Processing first 25 images of the folder")
-                images = images[:25]
 
             current_count, max_allowed = get_user_limits(st.session_state.authenticated_user)
             if current_count + image_count > max_allowed:
@@ -505,122 +491,151 @@ def main_application():
             # Start time tracking
             start_time = time.time()
             
+            mode = "basic" if basic_process_button else "analysis"
             if basic_process_button:
-                results, temp_files = create_basic_report(images)
                 status.update(label="📄 Creating basic reports...", state="running")
-            else:
-                results = []
-                temp_files = []
-                
-                for idx, image in enumerate(images, 1):
-                    try:
-                        # Update progress
-                        progress = idx / len(images)
-                        progress_bar.progress(progress)
-                        
-                        # Update status text with spinner and image count
-                        spinner_chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
-                        spinner = spinner_chars[int(time.time() * 10) % len(spinner_chars)]
-                        status_text.write(f"{spinner} Processing image {idx} of {len(images)}")
-                        
-                        # Calculate times
-                        elapsed_time = time.time() - start_time
-                        elapsed_str = format_time(elapsed_time)
-                        
-                        if idx > 1:
-                            avg_time_per_image = elapsed_time / (idx - 1)
-                            remaining_images = len(images) - idx + 1
-                            estimated_remaining = avg_time_per_image * remaining_images
-                            remaining_str = format_time(estimated_remaining)
-                        else:
-                            remaining_str = "Calculating..."
-                        
-                        # Update metrics with icons
-                        elapsed_placeholder.metric("⏱️ Elapsed Time", elapsed_str)
-                        remaining_placeholder.metric("⏳ Estimated Remaining", remaining_str)
-                        
-                        # Show funny message with periodic updates
-                        if idx % 2 == 0 or idx == 1:  # Update message every 2 images or on first image
+
+            # Workers publish progress events; this thread renders them at a fixed rate.
+            # Finished items are spilled to the database a chunk at a time, so large folders
+            # don't pile up in memory. Reports are only rendered once they are downloaded.
+            channel = ProgressChannel()
+            tracker = ProgressTracker(len(images))
+            spool = ReportSpool(run_id, new_report_base_name(), reports_subdir(), on_error=st.error,
+                                lazy=True, username=st.session_state.authenticated_user)
+            shown_errors = 0
+            last_message_time = 0.0
+            username = st.session_state.authenticated_user
+            lane = lane_for_mode(mode)
+
+            def show_queue_position(position):
+                status_text.info(f"⏳ The server is busy — you are #{position} in the queue")
+
+            # Runs are admitted fairly across users, basic reports first; provider calls
+            # made by the workers queue for shared concurrency slots (see scheduler.py)
+            with admitted(username, lane, on_wait=show_queue_position, poll_interval=PROGRESS_REFRESH_SECONDS), \
+                    tenant(username, lane), ThreadPoolExecutor(max_workers=UI_IMAGE_CONCURRENCY) as executor:
+                items = images
+                if group_views:
+                    status_text.info("📸 Grouping photos of the same lot...")
+                    items = group_lots(images, executor)
+                    tracker.total = len(items)
+
+                def submit(image):
+                    return submit_with_context(executor, run_item, channel, image['id'], process_image,
+                                               image, mode, on_error=channel.error_handler(), reuse_prior=reuse_prior)
+
+                for chunk in pipelined_chunks(items, submit):
+                    while True:
+                        chunk_done = all(future.done() for _, _, future in chunk)
+                        tracker.apply(channel.drain())
+                        render_progress(tracker, progress_bar, status_text, elapsed_placeholder, remaining_placeholder)
+
+                        for message in tracker.errors[shown_errors:]:
+                            st.error(message)
+                        shown_errors = len(tracker.errors)
+
+                        if time.time() - last_message_time >= FUNNY_MESSAGE_SECONDS:
                             message_container.info(get_funny_message())
-                        
-                        # Process image
-                        response = requests.get(image['url'])
-                        if response.status_code != 200:
+                            last_message_time = time.time()
+
+                        if chunk_done:
+                            break
+                        time.sleep(PROGRESS_REFRESH_SECONDS)
+
+                    finished = []
+                    for position, _, future in chunk:
+                        try:
+                            result, img_path = future.result()
+                        except Exception:
+                            # Already reported through the progress channel
                             continue
-                            
-                        img_path = f"temp_{image['id']}.jpg"
-                        with Image.open(BytesIO(response.content)) as img:
-                            img.convert('RGB').save(img_path)
-                        temp_files.append(img_path)
-
-                        lens_results = search_google_lens(image['url'])
-                        if lens_results:
-                            analysis = get_anthropic_analysis(lens_results)
-                            results.append({
-                                'name': image['name'],
-                                'temp_image_path': img_path,
-                                'analysis': analysis
-                            })
-                        
-                        # Small delay to allow UI updates
-                        time.sleep(0.1)
-
-                    except Exception as e:
-                        st.error(f"Image {idx} error: {str(e)}")
-
-                # Clear message container when done
-                message_container.empty()
-
-            if results:
-                base_name = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                # Update the reports path to use the persistent volume
-                reports_dir = "/var/lib/estateai/reports"
-                os.makedirs(reports_dir, exist_ok=True)
-                
-                pdf_report_name = os.path.join(reports_dir, f"{base_name}.pdf")
-                excel_report_name = os.path.join(reports_dir, f"{base_name}.xlsx")
+                        if result:
+                            finished.append((position, result))
+                        elif img_path:
+                            os.remove(img_path)
+                    spool.add(finished)
+
+            # Clear message container when done
+            message_container.empty()
+
+            usage_items = usage.snapshot()
+            routing = run_routing_summary(usage_items)
+            save_run_usage(run_id, st.session_state.authenticated_user, mode,
+                           len(images), time.time() - start_time, usage_items, routing)
+
+            if spool.saved:
+                parts = spool.finish()
+
+                # Folder-wide listing prices come straight from the Lens matches
+                if spool.folder_prices is not None and not spool.folder_prices.empty:
+                    st.subheader("💲 Listing Prices")
+                    st.dataframe(pd.DataFrame(folder_summary_rows(spool.folder_prices), columns=PRICE_SUMMARY_HEADERS),
+                                 hide_index=True, width="stretch")
                 
-                # Show generating reports message
-                status.update(label="📊 Generating reports...", state="running")
-                
-                pdf_success = create_pdf_report(results, pdf_report_name)
-                excel_success = create_excel_report(results, excel_report_name)
-                
-                if pdf_success and excel_success:
-                    save_report(st.session_state.authenticated_user, pdf_report_name)
-                    save_report(st.session_state.authenticated_user, excel_report_name)
+                if parts:
+                    for pdf_report_name, excel_report_name in parts:
+                        save_report(st.session_state.authenticated_user, pdf_report_name, run_id)
+                        save_report(st.session_state.authenticated_user, excel_report_name, run_id)
                     increment_image_count(st.session_state.authenticated_user, image_count)
+                    enforce_quota(st.session_state.authenticated_user)
                     
                     status.update(label="✅ Processing complete!", state="complete")
                     
                     # Success message with download buttons
-                    st.success("Reports generated successfully!")
+                    st.success("Results ready! PDF and Excel reports are generated when first downloaded.")
+                    reused = usage.totals().get('cache_hits', 0)
+                    if reused:
+                        st.info(f"♻️ {reused} of {spool.saved} items reused a prior appraisal")
+                    if routing['fast'] or routing['skipped']:
+                        savings = ""
+                        if routing['tokens_saved'] is not None:
+                            savings = (f" — about {routing['tokens_saved']:,} tokens and "
+                                       f"{routing['llm_seconds_saved']}s of model time saved")
+                        st.info(f"⚡ {routing['fast']} items used the fast model, {routing['full']} the full model "
+                                f"and {routing['skipped']} needed no analysis{savings}")
+                    if len(items) < len(images):
+                        st.info(f"📸 {len(images)} photos were appraised as {len(items)} items")
+                    rejected = usage.totals().get('quality_rejected', 0)
+                    if rejected:
+                        st.info(f"🚫 {rejected} images failed the quality check (blank, blurry or not an item) "
+                                f"and were not searched or analyzed; they are flagged in the report")
+                    if len(parts) > 1:
+                        st.info(f"📑 The report was split into {len(parts)} parts of up to {REPORT_PART_SIZE} items")
                     
-                    with open(pdf_report_name, "rb") as f_pdf, open(excel_report_name, "rb") as f_xlsx:
+                    with st.expander(f"🔎 View results ({min(spool.saved, RESULTS_VIEW_LIMIT)} of {spool.saved})",
+                                     expanded=True):
+                        st.html(results_html(run_id))
+                    st.download_button(
+                        label="📥 Download Results (CSV)",
+                        data=partial(results_csv, run_id),
+                        file_name=f"{os.path.basename(parts[0][0]).split('.')[0]}_results.csv",
+                        mime="text/csv",
+                        key="csv_download",
+                        on_click="ignore"
+                    )
+
+                    for part, (pdf_report_name, excel_report_name) in enumerate(parts, 1):
+                        label = f" (Part {part})" if len(parts) > 1 else ""
+                        key = f"_{part}" if len(parts) > 1 else ""
                         col1, col2 = st.columns(2)
                         with col1:
                             st.download_button(
-                                label="📥 Download PDF Report",
-                                data=f_pdf.read(),
+                                label=f"📥 Download PDF Report{label}",
+                                data=partial(read_report, pdf_report_name, run_id),
                                 file_name=os.path.basename(pdf_report_name),
                                 mime="application/pdf",
-                                key="pdf_download"
+                                key=f"pdf_download{key}",
+                                on_click="ignore"
                             )
                         with col2:
                             st.download_button(
-                                label="📥 Download Excel Report",
-                                data=f_xlsx.read(),
+                                label=f"📥 Download Excel Report{label}",
+                                data=partial(read_report, excel_report_name, run_id),
                                 file_name=os.path.basename(excel_report_name),
                                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key="excel_download"
+                                key=f"excel_download{key}",
+                                on_click="ignore"
                             )
 
-            # Cleanup temp files
-            for temp_file in temp_files:
-                try:
-                    os.remove(temp_file)
-                except Exception as e:
-                    st.warning(f"Failed to remove temporary file {temp_file}: {str(e)}")
-
 if __name__ == "__main__":
     authenticated_layout(main_application)
\ No newline at end of file
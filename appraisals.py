@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import logging
+from collections import Counter
+from database import (save_appraisal, set_appraisal_image, get_latest_appraisal_for_item, match_appraisals,
+                      search_appraisals)
+from telemetry import current_run
+
+logger = logging.getLogger(__name__)
+
+# Whether process_image reuses a prior appraisal of a near-identical item by default
+REUSE_PRIOR_APPRAISALS = os.getenv('REUSE_PRIOR_APPRAISALS', '1') == '1'
+REUSE_MAX_AGE_DAYS = int(os.getenv('APPRAISAL_REUSE_MAX_AGE_DAYS', '30'))
+# Minimum overlap of salient listing-title words for two items to count as the same
+REUSE_THRESHOLD = float(os.getenv('APPRAISAL_REUSE_THRESHOLD', '0.6'))
+
+SALIENT_TOKENS = 20
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'from', 'this', 'that', 'new', 'used', 'lot', 'set', 'free',
+    'shipping', 'sale', 'vintage', 'antique', 'rare', 'item', 'items', 'listing', 'ebay', 'etsy',
+    'amazon', 'walmart', 'com', 'www', 'https', 'http', 'buy', 'shop', 'price', 'size',
+}
+
+def lens_titles(lens_results):
+    """Listing titles from Google Lens visual matches, one per line"""
+    return "\n".join(match.get('title', '') for match in lens_results if match.get('title'))
+
+def tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9]+", (text or "").lower())
+            if len(token) >= 3 and token not in STOPWORDS]
+
+def salient_tokens(titles):
+    """Words that describe the item: those repeated across listings, most frequent first"""
+    counts = Counter()
+    for title in titles.splitlines():
+        counts.update(set(tokenize(title)))
+    repeated = [token for token, count in counts.most_common() if count >= 2]
+    tokens = repeated or [token for token, _ in counts.most_common()]
+    return tokens[:SALIENT_TOKENS]
+
+def title_similarity(titles_a, titles_b):
+    """Jaccard overlap of the salient words of two sets of listing titles"""
+    a, b = set(salient_tokens(titles_a)), set(salient_tokens(titles_b))
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def search_query(text):
+    """FTS5 query matching every word of free text (words are quoted, so no syntax errors)"""
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{word}"' for word in words)
+
+def find_prior_appraisal(image, lens_results):
+    """The current run's user's recent appraisal of the same or a near-identical item, or None.
+
+    Appraisals are never shared between users. The same Drive file is reused directly. Otherwise the best full-text
+    match on listing titles is reused when its salient title words overlap
+    by at least REUSE_THRESHOLD.
+    """
+    username = current_run().get('username')
+    prior = get_latest_appraisal_for_item(image['id'], username, REUSE_MAX_AGE_DAYS)
+    if prior:
+        return dict(prior, similarity=1.0)
+
+    titles = lens_titles(lens_results)
+    tokens = salient_tokens(titles)
+    if not tokens:
+        return None
+
+    query = "titles : (" + " OR ".join(f'"{token}"' for token in tokens) + ")"
+    best = None
+    for candidate in match_appraisals(query, username, REUSE_MAX_AGE_DAYS):
+        similarity = title_similarity(titles, candidate['titles'])
+        if similarity >= REUSE_THRESHOLD and (not best or similarity > best['similarity']):
+            best = dict(candidate, similarity=similarity)
+    return best
+
+def remember_appraisal(image, lens_results, analysis, model, image_hash=None):
+    """Index an analysis so later runs can search and reuse it, returning its appraisal_id or None.
+
+    With image_hash (see quality.image_hash) the Lens matches are stored too,
+    so visually matching images can reuse both (see visual_index.py).
+    """
+    run = current_run()
+    return save_appraisal(run.get('run_id'), run.get('username'), image['id'], image['name'],
+                          lens_titles(lens_results), analysis, model,
+                          f"{image_hash:016x}" if image_hash is not None else None,
+                          json.dumps(lens_results) if image_hash is not None else None)
+
+def remember_appraisal_image(appraisal, lens_results, image_hash):
+    """Attach a photo's hash and Lens matches to a reused appraisal stored without them.
+
+    Returns whether it was attached; an appraisal keeps the first photo it was given.
+    """
+    return set_appraisal_image(appraisal['appraisal_id'], f"{image_hash:016x}", json.dumps(lens_results))
+
+def search_past_appraisals(text, username=None, limit=50):
+    """Search stored appraisals by free text; see database.search_appraisals for the row format"""
+    query = search_query(text)
+    if not query:
+        return []
+    return search_appraisals(query, username, limit)
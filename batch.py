@@ -0,0 +1,224 @@
+"""Headless batch appraisal of Google Drive folders.
+
+Usage:
+    python batch.py FOLDER_URL [FOLDER_URL ...] [--manifest FILE] [--mode analysis|basic]
+                    [--concurrency N] [--output-dir DIR] [--summary FILE] [--username USER]
+                    [--record-metrics] [--no-reuse-prior] [--group-views]
+
+The manifest is either a text file with one folder URL per line (blank lines
+and lines starting with '#' are ignored) or a JSON list of URLs.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import shutil
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from database import init_db, get_user_limits, increment_image_count, save_report, save_spans, save_run_usage
+from pipeline import extract_file_ids_from_folder, process_image
+from reports import REPORTS_DIR, new_report_base_name
+from storage import enforce_quota
+from chunked import ReportSpool, pipelined_chunks
+from routing import run_routing_summary
+from telemetry import run_context, submit_with_context, start_span_writer
+from scheduler import lane_for_mode, tenant
+from lots import GROUP_VIEWS, group_lots
+
+logger = logging.getLogger(__name__)
+
+def read_manifest(path):
+    """Read folder URLs from a text or JSON manifest"""
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+
+    if path.endswith('.json'):
+        return [str(url) for url in json.loads(content)]
+
+    return [line.strip() for line in content.splitlines()
+            if line.strip() and not line.strip().startswith('#')]
+
+def process_folder(folder_url, executor, index, options):
+    """Process one folder with the shared image executor and write its reports.
+
+    options holds mode, output_dir, username, save_usage, reuse_prior and group_views (see run_batch).
+    """
+    mode = options['mode']
+    username = options['username']
+    summary = {
+        'folder_url': folder_url,
+        'mode': mode,
+        'status': 'failed',
+        'image_count': 0,
+        'items': 0,
+        'processed': 0,
+        'pdf': None,
+        'xlsx': None,
+        'parts': [],
+        'error': None,
+    }
+    start_time = time.time()
+    work_dir = tempfile.mkdtemp(prefix="estateai_batch_")
+
+    try:
+        run_id = uuid.uuid4().hex
+        with run_context(run_id, username) as usage, tenant(username, lane_for_mode(mode)):
+            run_folder(run_id, folder_url, executor, index, options, work_dir, summary)
+        summary['usage'] = usage.totals()
+        summary['routing'] = run_routing_summary(usage.snapshot())
+        if options['save_usage']:
+            save_run_usage(run_id, username, mode, summary['image_count'],
+                           time.time() - start_time, usage.snapshot(), summary['routing'])
+        return summary
+    except Exception as e:
+        logger.error(f"Folder {folder_url} failed: {str(e)}")
+        summary['error'] = str(e)
+        return summary
+    finally:
+        summary['elapsed_seconds'] = round(time.time() - start_time, 2)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_folder(run_id, folder_url, executor, index, options, work_dir, summary):
+    """List, process and report one folder in chunks, filling in summary"""
+    username = options['username']
+    images = extract_file_ids_from_folder(folder_url)
+    summary['image_count'] = len(images)
+    if not images:
+        summary['error'] = "No images found in folder"
+        return summary
+
+    if username:
+        current_count, max_allowed = get_user_limits(username)
+        if current_count + len(images) > max_allowed:
+            summary['error'] = f"Image limit exceeded: {current_count + len(images)}/{max_allowed}"
+            return summary
+
+    items = group_lots(images, executor, work_dir) if options['group_views'] else images
+    summary['items'] = len(items)
+    spool = ReportSpool(run_id, new_report_base_name(suffix=str(index)), options['output_dir'])
+    submit = partial(submit_with_context, executor, process_image, mode=options['mode'], work_dir=work_dir,
+                     reuse_prior=options['reuse_prior'])
+    for chunk in pipelined_chunks(items, submit):
+        finished = []
+        for position, image, future in chunk:
+            try:
+                result, img_path = future.result()
+                if result:
+                    finished.append((position, result))
+                elif img_path:
+                    os.remove(img_path)
+            except Exception as e:
+                logger.error(f"Image {image['id']} error: {str(e)}")
+        spool.add(finished)
+
+    summary['processed'] = spool.saved
+    if not spool.saved:
+        summary['error'] = "No images could be processed"
+        return summary
+
+    parts = spool.finish()
+    if not parts:
+        summary['error'] = "Report generation failed"
+        return summary
+
+    if username:
+        for pdf_path, excel_path in parts:
+            save_report(username, pdf_path, run_id)
+            save_report(username, excel_path, run_id)
+        increment_image_count(username, len(images))
+        enforce_quota(username)
+
+    summary.update({'status': 'complete', 'pdf': parts[0][0], 'xlsx': parts[0][1],
+                    'parts': [{'pdf': pdf_path, 'xlsx': excel_path} for pdf_path, excel_path in parts]})
+    return summary
+
+def run_batch(folder_urls, mode="analysis", concurrency=4, output_dir=REPORTS_DIR, username=None,
+              save_usage=False, reuse_prior=None, group_views=None):
+    """Process folders concurrently and return a JSON-serialisable summary"""
+    started_at = datetime.now()
+    options = {
+        'mode': mode,
+        'output_dir': output_dir,
+        'username': username,
+        'save_usage': save_usage,
+        'reuse_prior': reuse_prior,
+        'group_views': GROUP_VIEWS if group_views is None else group_views,
+    }
+
+    # Images from every folder share one pool so small folders don't leave workers idle;
+    # folder-level threads only wait on their futures and render reports.
+    with ThreadPoolExecutor(max_workers=concurrency) as image_executor, \
+            ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(folder_urls)))) as folder_executor:
+        folder_futures = [
+            folder_executor.submit(process_folder, url, image_executor, idx, options)
+            for idx, url in enumerate(folder_urls, 1)
+        ]
+        folders = [future.result() for future in folder_futures]
+
+    finished_at = datetime.now()
+    return {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'finished_at': finished_at.isoformat(timespec='seconds'),
+        'elapsed_seconds': round((finished_at - started_at).total_seconds(), 2),
+        'mode': mode,
+        'concurrency': concurrency,
+        'folders': folders,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Appraise Google Drive folders without the Streamlit UI")
+    parser.add_argument("folder_urls", nargs="*", help="Google Drive folder URLs")
+    parser.add_argument("--manifest", help="File listing folder URLs (text, one per line, or JSON list)")
+    parser.add_argument("--mode", choices=["analysis", "basic"], default="analysis",
+                        help="'analysis' runs Lens and the LLM, 'basic' only builds image reports")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of images processed in parallel")
+    parser.add_argument("--output-dir", default=REPORTS_DIR, help="Directory for generated reports")
+    parser.add_argument("--summary", help="Write the JSON summary here instead of stdout")
+    parser.add_argument("--username", help="Record reports and quota usage against this user")
+    parser.add_argument("--no-reuse-prior", action="store_true",
+                        help="Always call the LLM, even for items appraised recently")
+    parser.add_argument("--group-views", action="store_true", default=None,
+                        help="Appraise consecutive photos of the same lot as one item (default: GROUP_VIEWS)")
+    parser.add_argument("--record-metrics", action="store_true",
+                        help="Persist per-stage timings and API usage to the database for the admin dashboard")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    folder_urls = list(args.folder_urls)
+    if args.manifest:
+        folder_urls.extend(read_manifest(args.manifest))
+    if not folder_urls:
+        parser.error("no folder URLs given")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    init_db()
+    span_writer = None
+    if args.record_metrics:
+        span_writer = start_span_writer(save_spans)
+
+    summary = run_batch(folder_urls, args.mode, args.concurrency, args.output_dir, args.username,
+                        save_usage=bool(args.username or args.record_metrics),
+                        reuse_prior=False if args.no_reuse_prior else None, group_views=args.group_views)
+
+    if span_writer:
+        span_writer.close()
+
+    output = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(output)
+        logger.info(f"Summary written to {args.summary}")
+    else:
+        print(output)
+
+    return 0 if all(folder['status'] == 'complete' for folder in summary['folders']) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Offline end-to-end pipeline benchmark against the local stubs.
+
+Usage:
+    python benchmark.py [--sizes 25,250,2500] [--mode analysis|basic] [--concurrency 4]
+                        [--latency-scale 1.0] [--group-views] [--output results.json]
+                        [--baseline previous.json --tolerance 0.10]
+
+Each folder size runs in a fresh process so peak RSS is measured per size.
+Reports images/minute, per-stage p50/p95 and peak RSS. With --baseline the
+run exits non-zero when throughput drops or a stage p95 grows by more than
+the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import queue
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+from stubs import StubServer, add_stub_arguments, config_from_args
+
+logger = logging.getLogger(__name__)
+
+def run_size(count, mode, concurrency, reuse_prior, group_views, environment, results_queue):
+    """Benchmark one folder size; runs in a child process"""
+    output_dir = tempfile.mkdtemp(prefix="estateai_bench_")
+    os.environ.update(environment)
+    os.environ['DATABASE_PATH'] = os.path.join(output_dir, "bench.db")
+    os.environ['IMAGE_CACHE_DIR'] = os.path.join(output_dir, "image_cache")
+    # Imported here so the pipeline picks up the stub endpoints and database from the environment
+    from batch import run_batch
+    from database import init_db
+    from telemetry import add_span_listener, summarize_spans
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db()
+
+    spans = []
+    add_span_listener(spans.append)
+
+    try:
+        start = time.perf_counter()
+        summary = run_batch([f"{environment['DRIVE_BASE_URL']}/drive/folders/bench-{count}"],
+                            mode, concurrency, output_dir, reuse_prior=reuse_prior, group_views=group_views)
+        elapsed = time.perf_counter() - start
+
+        folder = summary['folders'][0]
+        processed = folder['processed']
+        report_bytes = sum(os.path.getsize(part[kind]) for part in folder['parts'] for kind in ('pdf', 'xlsx'))
+        results_queue.put({
+            'images': count,
+            'processed': processed,
+            'items': folder['items'],
+            'status': folder['status'],
+            'error': folder['error'],
+            'elapsed_seconds': round(elapsed, 2),
+            'images_per_minute': round(processed / elapsed * 60, 1) if elapsed else 0.0,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'report_bytes': report_bytes,
+            'routing': folder.get('routing', {}),
+            'stages': summarize_spans(spans),
+        })
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def wait_for_result(process, results_queue, count):
+    """Collect a child's result, or a failed run if the child died without reporting"""
+    while True:
+        try:
+            return results_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                return {'images': count, 'processed': 0, 'items': 0, 'status': 'crashed',
+                        'error': f"Benchmark process exited with code {process.exitcode}",
+                        'elapsed_seconds': 0.0, 'images_per_minute': 0.0, 'peak_rss_mb': 0.0,
+                        'report_bytes': 0, 'stages': {}}
+
+def format_table(runs):
+    """Human-readable summary of benchmark runs"""
+    lines = []
+    for run in runs:
+        lines.append(f"\n{run['images']} images: {run['images_per_minute']} images/min, "
+                     f"{run['elapsed_seconds']}s, peak RSS {run['peak_rss_mb']} MB, "
+                     f"{run['processed']} processed ({run['status']})")
+        routing = run.get('routing')
+        if routing:
+            lines.append(f"  routes: {routing['fast']} fast, {routing['full']} full, {routing['skipped']} skipped; "
+                         f"est. {routing['tokens_saved']} tokens and {routing['llm_seconds_saved']} LLM-seconds saved")
+        lines.append(f"  {'stage':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}")
+        for stage, stats in sorted(run['stages'].items()):
+            lines.append(f"  {stage:<14}{stats['count']:>7}{stats['errors']:>8}"
+                         f"{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}")
+    return "\n".join(lines)
+
+def compare_to_baseline(runs, baseline, tolerance):
+    """Return a list of regressions against a previous benchmark result"""
+    previous = {run['images']: run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in runs:
+        before = previous.get(run['images'])
+        if not before:
+            continue
+        if run['images_per_minute'] < before['images_per_minute'] * (1 - tolerance):
+            regressions.append(f"{run['images']} images: throughput {before['images_per_minute']} -> "
+                               f"{run['images_per_minute']} images/min")
+        if run['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{run['images']} images: peak RSS {before['peak_rss_mb']} -> {run['peak_rss_mb']} MB")
+        for stage, stats in run['stages'].items():
+            old = before['stages'].get(stage)
+            if old and stats['p95'] > old['p95'] * (1 + tolerance):
+                regressions.append(f"{run['images']} images: {stage} p95 "
+                                   f"{old['p95'] * 1000:.1f} -> {stats['p95'] * 1000:.1f} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with local service stubs")
+    parser.add_argument("--sizes", default="25,250,2500", help="Comma-separated folder sizes")
+    parser.add_argument("--mode", choices=["analysis", "basic"], default="analysis")
+    parser.add_argument("--concurrency", type=int, default=4, help="Images processed in parallel")
+    parser.add_argument("--reuse-prior", action="store_true",
+                        help="Let items reuse prior appraisals (off so every item exercises the LLM stage)")
+    parser.add_argument("--group-views", action="store_true",
+                        help="Appraise consecutive photos of the same lot as one item (see lots.py)")
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Previous --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = StubServer(config_from_args(args)).start()
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    try:
+        for count in [int(size) for size in args.sizes.split(',') if size]:
+            results_queue = context.Queue()
+            process = context.Process(target=run_size,
+                                      args=(count, args.mode, args.concurrency, args.reuse_prior,
+                                            args.group_views, server.environment(), results_queue))
+            process.start()
+            run = wait_for_result(process, results_queue, count)
+            process.join()
+            runs.append(run)
+            print(format_table([run]), flush=True)
+    finally:
+        server.stop()
+
+    result = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'reuse_prior': args.reuse_prior,
+        'group_views': args.group_views,
+        'latency_scale': args.latency_scale,
+        'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+        'stub_requests': server.counters,
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_to_baseline(runs, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""Chunked processing for folders of any size.
+
+Images are submitted CHUNK_SIZE at a time. Finished items are spilled to the
+run_items table and report parts of up to REPORT_PART_SIZE items are
+rendered as soon as they fill, so memory use does not grow with the folder.
+
+In lazy mode nothing is rendered while the run is processed: the spilled
+items are the run's canonical results (see results.py) and its reports are
+rendered by render_run() the first time one of them is requested.
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from database import (save_run_items, get_run_items, get_run_prices, save_result_run, get_result_run,
+                      mark_run_rendered)
+from prices import price_statistics
+from reports import REPORTS_DIR, write_reports
+from results import run_image_dir, store_result_image
+from profiling import profiled_run
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '50'))
+REPORT_PART_SIZE = int(os.getenv('REPORT_PART_SIZE', '100'))
+
+def pipelined_chunks(images, submit, chunk_size=CHUNK_SIZE):
+    """Submit images a chunk at a time, yielding each chunk as [(position, image, future)].
+
+    The next chunk is submitted before the current one is yielded, so workers
+    stay busy while the caller collects it; at most two chunks are in flight.
+    """
+    pending = None
+    for start in range(0, len(images), chunk_size):
+        submitted = [(position, image, submit(image))
+                     for position, image in enumerate(images[start:start + chunk_size], start)]
+        if pending is not None:
+            yield pending
+        pending = submitted
+    if pending is not None:
+        yield pending
+
+def part_name(base_name, part):
+    return f"{base_name}_part{part:02d}"
+
+class ReportSpool:
+    """Spill finished results of a run and render its reports in parts.
+
+    add() stores results in the run_items table and renders every full part
+    except the last; finish() renders the remainder with the folder-wide
+    price summary. A run that fits in one part gets a single report named
+    base_name; larger runs get base_name_partNN reports. Image files of a
+    part are removed once it has been rendered.
+
+    With lazy=True, add() keeps a thumbnail of each image instead and
+    finish() only records the run for render_run(), returning the paths its
+    reports will have.
+    """
+
+    def __init__(self, run_id, base_name, reports_dir=REPORTS_DIR, part_size=REPORT_PART_SIZE, on_error=None,
+                 lazy=False, username=None):
+        self.run_id = run_id
+        self.base_name = base_name
+        self.reports_dir = reports_dir
+        self.part_size = part_size
+        self.on_error = on_error
+        self.lazy = lazy
+        self.username = username
+        self.image_dir = run_image_dir(run_id)
+        # Stored thumbnails outlive a render; downloaded images do not
+        self.keep_images = lazy
+        self.saved = 0
+        self.rendered = 0
+        self.parts = []
+        self.failed = False
+        self.folder_prices = None
+
+    def add(self, results):
+        """Spill (position, result) pairs, in folder order"""
+        items = []
+        for position, result in results:
+            if self.lazy:
+                result = store_result_image(self.image_dir, self.saved + len(items), result)
+            items.append({
+                'seq': self.saved + len(items),
+                'position': position,
+                'item_id': result.get('item_id'),
+                'name': result['name'],
+                'result': json.dumps(result),
+                'prices': json.dumps(result.get('prices') or []),
+            })
+        if not items:
+            return
+        if not save_run_items(self.run_id, items):
+            raise RuntimeError(f"Could not save results of run {self.run_id}")
+        self.saved += len(items)
+        if not self.lazy:
+            self.render_full_parts()
+
+    def render_full_parts(self):
+        # Hold back the last full part so finish() always has items for the folder summary
+        while self.saved - self.rendered > self.part_size:
+            self.render_part(self.part_size)
+
+    def planned_parts(self):
+        """[(pdf_path, excel_path)] the reports of all saved items are rendered to"""
+        if self.saved <= self.part_size:
+            names = [self.base_name]
+        else:
+            names = [part_name(self.base_name, part) for part in range(1, -(-self.saved // self.part_size) + 1)]
+        return [(os.path.join(self.reports_dir, f"{name}.pdf"), os.path.join(self.reports_dir, f"{name}.xlsx"))
+                for name in names]
+
+    def finish(self):
+        """Render the last part; returns [(pdf_path, excel_path)] per part, or [] on failure.
+
+        In lazy mode the run is recorded for render_run() and the paths it will
+        render to are returned instead.
+        """
+        if self.saved > self.rendered:
+            with span('price_stats', items=self.saved):
+                prices = [{'prices': json.loads(record)} for record in get_run_prices(self.run_id)]
+                _, self.folder_prices = price_statistics(prices)
+            if self.lazy:
+                if not save_result_run(self.run_id, self.username, self.base_name, self.reports_dir,
+                                       self.image_dir, self.part_size, self.saved):
+                    return []
+                return self.planned_parts()
+            self.render_part(self.saved - self.rendered, self.folder_prices)
+        return [] if self.failed else self.parts
+
+    def render_part(self, count, folder_prices=None):
+        results = [json.loads(record) for record in get_run_items(self.run_id, self.rendered, count)]
+        for result in results:
+            if 'image_path' in result:
+                result['temp_image_path'] = result['image_path']
+        item_prices, empty_folder = price_statistics(results)
+        single = not self.parts and folder_prices is not None
+        base_name = self.base_name if single else part_name(self.base_name, self.rendered // self.part_size + 1)
+
+        pdf_path, excel_path = write_reports(results, base_name, self.reports_dir, self.on_error,
+                                             (item_prices, empty_folder if folder_prices is None else folder_prices))
+        if pdf_path:
+            self.parts.append((pdf_path, excel_path))
+        else:
+            self.failed = True
+        self.rendered += len(results)
+
+        if self.keep_images:
+            return
+        for result in results:
+            for path in [result['temp_image_path'], *(result.get('view_paths') or [])]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+
+def render_run(run_id, on_error=None):
+    """Render the reports of a lazily spooled run unless they exist; returns its parts or [].
+
+    Concurrent requests for the same run in this process wait for a single
+    render.
+    """
+    run = get_result_run(run_id)
+    if not run:
+        return []
+    with _render_locks_guard:
+        lock = _render_locks.setdefault(run_id, threading.Lock())
+    with lock:
+        spool = ReportSpool(run_id, run['base_name'], run['reports_dir'], run['part_size'], on_error)
+        spool.saved = run['items']
+        spool.keep_images = True
+        planned = spool.planned_parts()
+        # Storage maintenance may have compressed reports rendered earlier
+        if all(os.path.exists(path) or os.path.exists(f"{path}.gz") for part in planned for path in part):
+            return planned
+
+        with span('render_run', items=spool.saved), profiled_run(run_id, run['username'], kind='render'):
+            spool.render_full_parts()
+            parts = spool.finish()
+        if not parts:
+            return []
+        for rendered, promised in zip(parts, planned):
+            for path, promised_path in zip(rendered, promised):
+                # Reused reports that could not be hard-linked keep their first path
+                if path != promised_path:
+                    shutil.copyfile(path, promised_path)
+        mark_run_rendered(run_id)
+        logger.info(f"Rendered reports of run {run_id} on request")
+        return planned
+
+def ensure_report(path, run_id=None, on_error=None):
+    """path once the report exists, rendering its run first if needed; None if it cannot be produced"""
+    if not os.path.exists(path) and run_id:
+        render_run(run_id, on_error)
+    return path if os.path.exists(path) else None
@@ -4,7 +4,9 @@ import time
 import bcrypt
 import logging
 import re
+import json
 from typing import Dict, Union
+from telemetry import span
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -23,6 +25,13 @@ def wait_for_database():
         attempt += 1
     return False
 
+def add_missing_columns(cursor, table: str, columns: Dict[str, str]):
+    """Add columns introduced after a table was first created"""
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
 def init_db():
     """Initialize database with retry logic"""
     if not wait_for_database():
@@ -36,6 +45,9 @@ def init_db():
         conn = sqlite3.connect(DATABASE_NAME)
         c = conn.cursor()
         
+        # WAL lets the app, the API and several workers write to the database concurrently
+        c.execute('PRAGMA journal_mode=WAL')
+        
         # Create users table
         c.execute('''CREATE TABLE IF NOT EXISTS users (
                      user_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -49,6 +61,7 @@ def init_db():
                      verification_code TEXT,
                      code_created_at REAL,
                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        add_missing_columns(c, 'users', {'storage_quota_mb': 'INTEGER', 'priority': 'INTEGER DEFAULT 1'})
         
         # Create reports table
         c.execute('''CREATE TABLE IF NOT EXISTS reports (
@@ -56,6 +69,169 @@ def init_db():
                      username TEXT NOT NULL,
                      report_path TEXT NOT NULL,
                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        add_missing_columns(c, 'reports', {'run_id': 'TEXT'})
+        c.execute('CREATE INDEX IF NOT EXISTS idx_reports_user ON reports (username, created_at)')
+        
+        # Create report_artifacts table of rendered reports keyed by their content digest
+        c.execute('''CREATE TABLE IF NOT EXISTS report_artifacts (
+                     digest TEXT PRIMARY KEY,
+                     pdf_path TEXT NOT NULL,
+                     xlsx_path TEXT NOT NULL,
+                     hits INTEGER DEFAULT 0,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        
+        # Create jobs table for appraisals submitted through the API
+        c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                     job_id TEXT PRIMARY KEY,
+                     username TEXT NOT NULL,
+                     folder_url TEXT NOT NULL,
+                     mode TEXT NOT NULL DEFAULT 'analysis',
+                     status TEXT NOT NULL DEFAULT 'queued',
+                     total_images INTEGER DEFAULT 0,
+                     processed_images INTEGER DEFAULT 0,
+                     pdf_path TEXT,
+                     xlsx_path TEXT,
+                     error TEXT,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        add_missing_columns(c, 'jobs', {'report_parts': 'TEXT', 'lease_owner': 'TEXT', 'lease_expires_at': 'REAL',
+                                        'heartbeat_at': 'REAL', 'attempts': 'INTEGER DEFAULT 0'})
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_username ON jobs (username, created_at)')
+        c.execute('DROP INDEX IF EXISTS idx_jobs_status')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_lease ON jobs (status, lease_expires_at)')
+        
+        # Create stage_spans table for per-stage pipeline timings
+        c.execute('''CREATE TABLE IF NOT EXISTS stage_spans (
+                     span_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     run_id TEXT,
+                     username TEXT,
+                     stage TEXT NOT NULL,
+                     duration_ms REAL NOT NULL,
+                     outcome TEXT NOT NULL DEFAULT 'ok',
+                     bytes INTEGER,
+                     tokens INTEGER,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_stage_spans_created ON stage_spans (created_at, stage)')
+        
+        # Create usage tables for per-run and per-item API accounting
+        c.execute('''CREATE TABLE IF NOT EXISTS usage_runs (
+                     run_id TEXT PRIMARY KEY,
+                     username TEXT,
+                     mode TEXT,
+                     images INTEGER DEFAULT 0,
+                     elapsed_seconds REAL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS usage_items (
+                     item_usage_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     run_id TEXT NOT NULL,
+                     username TEXT,
+                     item_id TEXT NOT NULL,
+                     item_name TEXT,
+                     model TEXT,
+                     input_tokens INTEGER DEFAULT 0,
+                     output_tokens INTEGER DEFAULT 0,
+                     cache_creation_input_tokens INTEGER DEFAULT 0,
+                     cache_read_input_tokens INTEGER DEFAULT 0,
+                     llm_calls INTEGER DEFAULT 0,
+                     lens_calls INTEGER DEFAULT 0,
+                     cache_hits INTEGER DEFAULT 0,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        add_missing_columns(c, 'usage_items', {'route': 'TEXT', 'llm_ms': 'INTEGER DEFAULT 0',
+                                               'llm_ttft_ms': 'INTEGER DEFAULT 0'})
+        add_missing_columns(c, 'usage_runs', {'tokens_saved': 'INTEGER', 'llm_seconds_saved': 'REAL'})
+        c.execute('CREATE INDEX IF NOT EXISTS idx_usage_items_run ON usage_items (run_id)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_usage_runs_created ON usage_runs (created_at, username)')
+        
+        # Create run_items table that finished items of a run are spilled to
+        c.execute('''CREATE TABLE IF NOT EXISTS run_items (
+                     run_id TEXT NOT NULL,
+                     seq INTEGER NOT NULL,
+                     position INTEGER,
+                     item_id TEXT,
+                     item_name TEXT,
+                     result TEXT NOT NULL,
+                     prices TEXT,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     PRIMARY KEY (run_id, seq))''')
+        
+        # Create result_runs table of runs whose reports are rendered on first request
+        c.execute('''CREATE TABLE IF NOT EXISTS result_runs (
+                     run_id TEXT PRIMARY KEY,
+                     username TEXT,
+                     base_name TEXT NOT NULL,
+                     reports_dir TEXT NOT NULL,
+                     image_dir TEXT NOT NULL,
+                     part_size INTEGER NOT NULL,
+                     items INTEGER NOT NULL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     rendered_at TIMESTAMP)''')
+        
+        # Create run_profiles table of profiles recorded while profiling is switched on
+        c.execute('''CREATE TABLE IF NOT EXISTS run_profiles (
+                     run_id TEXT NOT NULL,
+                     kind TEXT NOT NULL,
+                     username TEXT,
+                     wall_seconds REAL,
+                     cpu_seconds REAL,
+                     peak_bytes INTEGER,
+                     profile_dir TEXT NOT NULL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     PRIMARY KEY (run_id, kind))''')
+        
+        # Create settings table of options admins change at runtime
+        c.execute('''CREATE TABLE IF NOT EXISTS settings (
+                     key TEXT PRIMARY KEY,
+                     value TEXT)''')
+        
+        # Create image_cache table indexing normalized Drive images kept on disk
+        c.execute('''CREATE TABLE IF NOT EXISTS image_cache (
+                     file_id TEXT NOT NULL,
+                     revision TEXT NOT NULL DEFAULT '',
+                     path TEXT NOT NULL,
+                     bytes INTEGER NOT NULL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     PRIMARY KEY (file_id, revision))''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_image_cache_used ON image_cache (last_used_at)')
+        
+        # Create export_links table of one-time report export downloads
+        c.execute('''CREATE TABLE IF NOT EXISTS export_links (
+                     token TEXT PRIMARY KEY,
+                     username TEXT NOT NULL,
+                     run_keys TEXT NOT NULL,
+                     results TEXT,
+                     expires_at REAL NOT NULL)''')
+        
+        # Create appraisals table of past analyses for search and reuse
+        c.execute('''CREATE TABLE IF NOT EXISTS appraisals (
+                     appraisal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     run_id TEXT,
+                     username TEXT,
+                     item_id TEXT,
+                     item_name TEXT,
+                     titles TEXT,
+                     analysis TEXT NOT NULL,
+                     model TEXT,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        # Image hash (16 hex digits, see quality.image_hash) and Lens matches (JSON) for visual reuse
+        add_missing_columns(c, 'appraisals', {'image_hash': 'TEXT', 'lens_results': 'TEXT'})
+        c.execute('CREATE INDEX IF NOT EXISTS idx_appraisals_item ON appraisals (item_id, created_at)')
+        try:
+            c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS appraisals_fts USING fts5(
+                         item_name, titles, analysis,
+                         content='appraisals', content_rowid='appraisal_id',
+                         tokenize='porter unicode61')''')
+            c.execute('''CREATE TRIGGER IF NOT EXISTS appraisals_ai AFTER INSERT ON appraisals BEGIN
+                         INSERT INTO appraisals_fts (rowid, item_name, titles, analysis)
+                         VALUES (new.appraisal_id, new.item_name, new.titles, new.analysis);
+                         END''')
+            c.execute('''CREATE TRIGGER IF NOT EXISTS appraisals_ad AFTER DELETE ON appraisals BEGIN
+                         INSERT INTO appraisals_fts (appraisals_fts, rowid, item_name, titles, analysis)
+                         VALUES ('delete', old.appraisal_id, old.item_name, old.titles, old.analysis);
+                         END''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Full-text search unavailable, appraisal search disabled: {str(e)}")
         
         conn.commit()
         logger.info("Database initialized successfully")
@@ -76,19 +252,21 @@ def init_db():
 
 
 
-def save_report(username: str, report_path: str):
+def save_report(username: str, report_path: str, run_id: str = None):
 
-    conn = sqlite3.connect(DATABASE_NAME)
+    with span('db_write', op='save_report'):
 
-    c = conn.cursor()
+        conn = sqlite3.connect(DATABASE_NAME)
 
-    c.execute('''INSERT INTO reports (username, report_path)
+        c = conn.cursor()
 
-                 VALUES (?, ?)''', (username, report_path))
+        c.execute('''INSERT INTO reports (username, report_path, run_id)
 
-    conn.commit()
+                     VALUES (?, ?, ?)''', (username, report_path, run_id))
 
-    conn.close()
+        conn.commit()
+
+        conn.close()
 
 
 
@@ -98,7 +276,7 @@ def get_user_reports(username: str):
 
     c = conn.cursor()
 
-    c.execute('''SELECT report_path, created_at FROM reports 
+    c.execute('''SELECT report_path, created_at, run_id FROM reports 
 
                  WHERE username = ? ORDER BY created_at DESC''', (username,))
 
@@ -184,6 +362,17 @@ def verify_user(username: str, password: str) -> bool:
         if 'conn' in locals():
             conn.close()
 
+def get_password_hash(username: str) -> Union[str, None]:
+    """The stored bcrypt hash of a user's password, or None if there is no such user"""
+    try:
+        conn = sqlite3.connect(DATABASE_NAME)
+        row = conn.execute('SELECT password_hash FROM users WHERE username = ?', (username,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Database error in get_password_hash: {str(e)}")
+        return None
+
 def create_test_user():
     """Create a test user if no users exist"""
     try:
@@ -239,21 +428,23 @@ def increment_image_count(username: str, amount: int) -> bool:
 
     """Increment user's processed image count"""
 
-    conn = sqlite3.connect(DATABASE_NAME)
+    with span('db_write', op='increment_image_count'):
 
-    c = conn.cursor()
+        conn = sqlite3.connect(DATABASE_NAME)
 
-    c.execute('''UPDATE users 
+        c = conn.cursor()
 
-                 SET processed_images = processed_images + ? 
+        c.execute('''UPDATE users 
 
-                 WHERE username = ?''', (amount, username))
+                     SET processed_images = processed_images + ? 
 
-    conn.commit()
+                     WHERE username = ?''', (amount, username))
 
-    success = c.rowcount > 0
+        conn.commit()
 
-    conn.close()
+        success = c.rowcount > 0
+
+        conn.close()
 
     return success
 
@@ -323,6 +514,39 @@ def update_user_limit(user_id: int, new_limit: int) -> bool:
 
 
 
+def get_storage_quota(username: str) -> Union[int, None]:
+    """User's report storage quota in MB, or None for the default"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    row = conn.execute('SELECT storage_quota_mb FROM users WHERE username = ?', (username,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def update_storage_quota(user_id: int, quota_mb: int) -> bool:
+    """Set a user's report storage quota in MB"""
+    with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+        cursor = conn.execute('UPDATE users SET storage_quota_mb = ? WHERE user_id = ?', (quota_mb, user_id))
+        return cursor.rowcount > 0
+
+def get_user_priorities() -> dict:
+    """Scheduling weight of every user whose priority is not the default"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    rows = conn.execute('SELECT username, priority FROM users WHERE COALESCE(priority, 1) != 1').fetchall()
+    conn.close()
+    return {username: priority for username, priority in rows}
+
+def update_user_priority(user_id: int, priority: int) -> bool:
+    """Set a user's scheduling weight; a user with weight 2 gets twice the share of a user with 1"""
+    with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+        cursor = conn.execute('UPDATE users SET priority = ? WHERE user_id = ?', (priority, user_id))
+        return cursor.rowcount > 0
+
+def get_report_usernames() -> list:
+    """Users that have past reports"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    rows = conn.execute('SELECT DISTINCT username FROM reports').fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
 def is_admin(username: str) -> bool:
 
     """Check if user has admin role"""
@@ -337,4 +561,701 @@ def is_admin(username: str) -> bool:
 
     conn.close()
 
-    return result[0] == 'admin' if result else False
\ No newline at end of file
+    return result[0] == 'admin' if result else False
+
+JOB_FIELDS = ('job_id', 'username', 'folder_url', 'mode', 'status', 'total_images',
+              'processed_images', 'pdf_path', 'xlsx_path', 'error', 'created_at', 'updated_at',
+              'report_parts', 'lease_owner', 'lease_expires_at', 'heartbeat_at', 'attempts')
+
+def create_job(job_id: str, username: str, folder_url: str, mode: str) -> bool:
+    """Queue an appraisal job"""
+    try:
+        with span('db_write', op='create_job'), sqlite3.connect(DATABASE_NAME) as conn:
+            conn.execute('''INSERT INTO jobs (job_id, username, folder_url, mode)
+                            VALUES (?, ?, ?, ?)''', (job_id, username, folder_url, mode))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error creating job: {str(e)}")
+        return False
+
+def update_job(job_id: str, **fields) -> bool:
+    """Update job status/progress columns"""
+    columns = [name for name in fields if name in JOB_FIELDS and name != 'job_id']
+    if not columns:
+        return False
+    assignments = ", ".join(f"{name} = ?" for name in columns)
+    try:
+        with span('db_write', op='update_job'), sqlite3.connect(DATABASE_NAME) as conn:
+            c = conn.execute(f'''UPDATE jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP
+                                WHERE job_id = ?''', [fields[name] for name in columns] + [job_id])
+            return c.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error updating job {job_id}: {str(e)}")
+        return False
+
+def get_job(job_id: str):
+    """Get a job as a dict, or None"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute(f'SELECT {", ".join(JOB_FIELDS)} FROM jobs WHERE job_id = ?', (job_id,))
+    row = c.fetchone()
+    conn.close()
+    return dict(zip(JOB_FIELDS, row)) if row else None
+
+def get_user_jobs(username: str, job_ids=None, limit: int = 100) -> list:
+    """Get a user's jobs, optionally restricted to the given IDs"""
+    query = f'SELECT {", ".join(JOB_FIELDS)} FROM jobs WHERE username = ?'
+    params = [username]
+    if job_ids:
+        query += f' AND job_id IN ({", ".join("?" for _ in job_ids)})'
+        params.extend(job_ids)
+    query += ' ORDER BY created_at DESC LIMIT ?'
+    params.append(limit)
+
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute(query, params)
+    rows = c.fetchall()
+    conn.close()
+    return [dict(zip(JOB_FIELDS, row)) for row in rows]
+
+# Claimable jobs in the order workers take them: basic jobs first, then the job of the user
+# with the fewest running jobs for their priority, oldest first
+CLAIM_ORDER_QUERY = '''SELECT job_id FROM jobs j
+                       WHERE status = 'queued' OR (status = 'running' AND COALESCE(lease_expires_at, 0) < ?)
+                       ORDER BY CASE WHEN mode = 'basic' THEN 0 ELSE 1 END,
+                                (SELECT COUNT(*) FROM jobs r WHERE r.username = j.username AND r.status = 'running'
+                                 AND r.lease_expires_at >= ?) * 1.0
+                                / MAX(COALESCE((SELECT priority FROM users u WHERE u.username = j.username), 1), 1),
+                                created_at'''
+
+def get_queue_positions() -> dict:
+    """1-based position of every claimable job in claim order"""
+    now = time.time()
+    conn = sqlite3.connect(DATABASE_NAME)
+    rows = conn.execute(CLAIM_ORDER_QUERY, (now, now)).fetchall()
+    conn.close()
+    return {row[0]: position for position, row in enumerate(rows, 1)}
+
+def claim_job(worker_id: str, lease_seconds: float, max_attempts: int = 3) -> Union[str, None]:
+    """Lease the next claimable job to a worker, returning its ID or None.
+
+    Queued jobs are claimable, and so are running jobs whose lease expired
+    because their worker stopped heartbeating. Jobs are shared fairly
+    between users (see CLAIM_ORDER_QUERY). A job whose lease has expired
+    max_attempts times is marked failed instead.
+    """
+    now = time.time()
+    try:
+        with span('db_write', op='claim_job'):
+            conn = sqlite3.connect(DATABASE_NAME, timeout=30, isolation_level=None)
+            try:
+                # IMMEDIATE takes the write lock up front so two workers can't claim the same job
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('''UPDATE jobs SET status = 'failed', lease_owner = NULL, lease_expires_at = NULL,
+                                       error = 'Abandoned after ' || attempts || ' attempts',
+                                       updated_at = CURRENT_TIMESTAMP
+                                WHERE status = 'running' AND COALESCE(lease_expires_at, 0) < ? AND attempts >= ?''',
+                             (now, max_attempts))
+                row = conn.execute(CLAIM_ORDER_QUERY + ' LIMIT 1', (now, now)).fetchone()
+                if row:
+                    conn.execute('''UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires_at = ?,
+                                           heartbeat_at = ?, attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                                    WHERE job_id = ?''', (worker_id, now + lease_seconds, now, row[0]))
+                conn.execute('COMMIT')
+                return row[0] if row else None
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Error claiming job for {worker_id}: {str(e)}")
+        return None
+
+def renew_lease(job_id: str, worker_id: str, lease_seconds: float) -> bool:
+    """Extend a worker's lease on a running job; False if the worker no longer holds it"""
+    now = time.time()
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            c = conn.execute('''UPDATE jobs SET lease_expires_at = ?, heartbeat_at = ?
+                                WHERE job_id = ? AND lease_owner = ? AND status = 'running' ''',
+                             (now + lease_seconds, now, job_id, worker_id))
+            return c.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error renewing lease on job {job_id}: {str(e)}")
+        return False
+
+def release_job(job_id: str, worker_id: str) -> bool:
+    """Drop a worker's lease once it has finished with a job"""
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            c = conn.execute('''UPDATE jobs SET lease_owner = NULL, lease_expires_at = NULL
+                                WHERE job_id = ? AND lease_owner = ?''', (job_id, worker_id))
+            return c.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error releasing job {job_id}: {str(e)}")
+        return False
+
+def get_jobs_by_status(status: str) -> list:
+    """Get job IDs with the given status, oldest first"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute('SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at', (status,))
+    rows = c.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+def get_report_artifact(digest: str):
+    """(pdf_path, xlsx_path) previously rendered for a content digest, or None"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute('SELECT pdf_path, xlsx_path FROM report_artifacts WHERE digest = ?', (digest,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+def save_report_artifact(digest: str, pdf_path: str, xlsx_path: str) -> bool:
+    """Remember the reports rendered for a content digest"""
+    try:
+        with span('db_write', op='save_report_artifact'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('''INSERT OR REPLACE INTO report_artifacts (digest, pdf_path, xlsx_path)
+                            VALUES (?, ?, ?)''', (digest, pdf_path, xlsx_path))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving report artifact: {str(e)}")
+        return False
+
+def touch_report_artifact(digest: str) -> bool:
+    """Count a reuse of previously rendered reports"""
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('''UPDATE report_artifacts SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                            WHERE digest = ?''', (digest,))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error updating report artifact: {str(e)}")
+        return False
+
+def get_reports(username: str = None, older_than_days: float = None) -> list:
+    """(report_id, username, report_path, created_at, run_id) rows, oldest first"""
+    query = 'SELECT report_id, username, report_path, created_at, run_id FROM reports WHERE 1 = 1'
+    params = []
+    if username is not None:
+        query += ' AND username = ?'
+        params.append(username)
+    if older_than_days is not None:
+        query += " AND created_at < datetime('now', ?)"
+        params.append(f'-{int(older_than_days * 86400)} seconds')
+    conn = sqlite3.connect(DATABASE_NAME)
+    rows = conn.execute(query + ' ORDER BY created_at, report_id', params).fetchall()
+    conn.close()
+    return rows
+
+def delete_reports(report_ids: list) -> bool:
+    """Remove report rows; their files are handled by storage.py"""
+    try:
+        with span('db_write', op='delete_reports'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.executemany('DELETE FROM reports WHERE report_id = ?', [(report_id,) for report_id in report_ids])
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting reports: {str(e)}")
+        return False
+
+def get_referenced_report_paths() -> set:
+    """Every report file path still referenced by past reports or jobs"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    paths = {row[0] for row in c.execute('SELECT report_path FROM reports')}
+    for pdf_path, xlsx_path, report_parts in c.execute(
+            'SELECT pdf_path, xlsx_path, report_parts FROM jobs WHERE pdf_path IS NOT NULL'):
+        paths.update((pdf_path, xlsx_path))
+        for part in json.loads(report_parts or '[]'):
+            paths.update(part)
+    conn.close()
+    paths.discard(None)
+    return paths
+
+def replace_report_path(old_path: str, new_path: str) -> bool:
+    """Point every reference to a report file at its new path, e.g. after compression"""
+    try:
+        with span('db_write', op='replace_report_path'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('UPDATE reports SET report_path = ? WHERE report_path = ?', (new_path, old_path))
+            conn.execute('UPDATE jobs SET pdf_path = ? WHERE pdf_path = ?', (new_path, old_path))
+            conn.execute('UPDATE jobs SET xlsx_path = ? WHERE xlsx_path = ?', (new_path, old_path))
+            # report_parts is a JSON list of [pdf_path, xlsx_path] pairs
+            conn.execute('UPDATE jobs SET report_parts = REPLACE(report_parts, ?, ?) WHERE report_parts LIKE ?',
+                         (json.dumps(old_path), json.dumps(new_path), f'%{old_path}%'))
+            # A compressed file can no longer be linked into new reports
+            conn.execute('DELETE FROM report_artifacts WHERE pdf_path = ? OR xlsx_path = ?', (old_path, old_path))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error updating report path: {str(e)}")
+        return False
+
+def delete_report_artifacts(paths: list) -> bool:
+    """Forget reusable reports whose files were removed or are no longer wanted"""
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.executemany('DELETE FROM report_artifacts WHERE pdf_path = ? OR xlsx_path = ?',
+                             [(path, path) for path in paths])
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting report artifacts: {str(e)}")
+        return False
+
+def delete_old_run_items(keep_days: int) -> int:
+    """Drop spilled results older than keep_days, returning the number of rows removed"""
+    with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+        cursor = conn.execute("DELETE FROM run_items WHERE created_at < datetime('now', ?)",
+                              (f'-{int(keep_days)} days',))
+        return cursor.rowcount
+
+RESULT_RUN_FIELDS = ['run_id', 'username', 'base_name', 'reports_dir', 'image_dir', 'part_size', 'items',
+                     'created_at', 'rendered_at']
+
+def save_result_run(run_id: str, username: str, base_name: str, reports_dir: str, image_dir: str,
+                    part_size: int, items: int) -> bool:
+    """Record a finished run whose reports will be rendered from its stored results on demand"""
+    try:
+        with span('db_write', op='save_result_run'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('''INSERT OR REPLACE INTO result_runs
+                            (run_id, username, base_name, reports_dir, image_dir, part_size, items)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         (run_id, username, base_name, reports_dir, image_dir, part_size, items))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving result run: {str(e)}")
+        return False
+
+def get_result_run(run_id: str):
+    """A result run as a dict, or None"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    row = conn.execute(f'SELECT {", ".join(RESULT_RUN_FIELDS)} FROM result_runs WHERE run_id = ?',
+                       (run_id,)).fetchone()
+    conn.close()
+    return dict(zip(RESULT_RUN_FIELDS, row)) if row else None
+
+def mark_run_rendered(run_id: str) -> bool:
+    with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+        cursor = conn.execute('UPDATE result_runs SET rendered_at = CURRENT_TIMESTAMP WHERE run_id = ?', (run_id,))
+        return cursor.rowcount > 0
+
+def get_result_run_ids() -> set:
+    conn = sqlite3.connect(DATABASE_NAME)
+    run_ids = {row[0] for row in conn.execute('SELECT run_id FROM result_runs')}
+    conn.close()
+    return run_ids
+
+def get_old_result_runs(keep_days: int) -> list:
+    """(run_id, image_dir) of result runs older than keep_days"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    rows = conn.execute("SELECT run_id, image_dir FROM result_runs WHERE created_at < datetime('now', ?)",
+                        (f'-{int(keep_days)} days',)).fetchall()
+    conn.close()
+    return rows
+
+def delete_result_runs(run_ids: list) -> bool:
+    """Forget result runs along with their spilled items"""
+    try:
+        with span('db_write', op='delete_result_runs'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.executemany('DELETE FROM result_runs WHERE run_id = ?', [(run_id,) for run_id in run_ids])
+            conn.executemany('DELETE FROM run_items WHERE run_id = ?', [(run_id,) for run_id in run_ids])
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting result runs: {str(e)}")
+        return False
+
+def get_setting(key: str, default=None):
+    conn = sqlite3.connect(DATABASE_NAME)
+    row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+    conn.close()
+    return row[0] if row else default
+
+def set_setting(key: str, value: str) -> bool:
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving setting {key}: {str(e)}")
+        return False
+
+def save_run_profile(run_id: str, kind: str, username: str, wall_seconds: float, cpu_seconds: float,
+                     peak_bytes: int, profile_dir: str) -> bool:
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('''INSERT OR REPLACE INTO run_profiles
+                            (run_id, kind, username, wall_seconds, cpu_seconds, peak_bytes, profile_dir)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         (run_id, kind, username, wall_seconds, cpu_seconds, peak_bytes, profile_dir))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving run profile: {str(e)}")
+        return False
+
+def get_run_profiles(limit: int = 100) -> list:
+    """Recent run profiles, newest first"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    rows = conn.execute('''SELECT run_id, kind, username, wall_seconds, cpu_seconds, peak_bytes, profile_dir,
+                                 created_at
+                          FROM run_profiles ORDER BY created_at DESC LIMIT ?''', (limit,)).fetchall()
+    conn.close()
+    return rows
+
+def delete_old_run_profiles(keep_days: int) -> list:
+    """Delete profiles older than keep_days, returning their directories"""
+    with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+        cutoff = f'-{int(keep_days)} days'
+        rows = conn.execute("SELECT profile_dir FROM run_profiles WHERE created_at < datetime('now', ?)",
+                            (cutoff,)).fetchall()
+        conn.execute("DELETE FROM run_profiles WHERE created_at < datetime('now', ?)", (cutoff,))
+    return [row[0] for row in rows]
+
+def save_export_link(token: str, username: str, run_keys: str, results: str, expires_at: float) -> bool:
+    """Store a one-time export request; run_keys is a JSON list"""
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('DELETE FROM export_links WHERE expires_at < ?', (time.time(),))
+            conn.execute('''INSERT INTO export_links (token, username, run_keys, results, expires_at)
+                            VALUES (?, ?, ?, ?, ?)''', (token, username, run_keys, results, expires_at))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving export link: {str(e)}")
+        return False
+
+def get_export_link(token: str):
+    """Consume an unexpired export link, returning (username, run_keys, results) or None"""
+    conn = sqlite3.connect(DATABASE_NAME, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''SELECT username, run_keys, results FROM export_links
+                              WHERE token = ? AND expires_at >= ?''', (token, time.time())).fetchone()
+        conn.execute('DELETE FROM export_links WHERE token = ?', (token,))
+        conn.execute('COMMIT')
+        return row
+    except sqlite3.Error as e:
+        logger.error(f"Export link lookup failed: {str(e)}")
+        return None
+    finally:
+        conn.close()
+
+def get_cached_image(file_id: str, revision: str = '', max_age_hours: float = None):
+    """Path of a cached image, marking it as used, or None.
+
+    max_age_hours limits how old the entry may be, for images whose Drive
+    revision is not known.
+    """
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            query = 'SELECT path FROM image_cache WHERE file_id = ? AND revision = ?'
+            params = [file_id, revision]
+            if max_age_hours is not None:
+                query += " AND created_at >= datetime('now', ?)"
+                params.append(f'-{int(max_age_hours * 3600)} seconds')
+            row = conn.execute(query, params).fetchone()
+            if row:
+                conn.execute('''UPDATE image_cache SET last_used_at = CURRENT_TIMESTAMP
+                                WHERE file_id = ? AND revision = ?''', (file_id, revision))
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Image cache lookup failed: {str(e)}")
+        return None
+
+def save_cached_image(file_id: str, revision: str, path: str, size: int) -> bool:
+    """Index an image written to the cache directory"""
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('''INSERT OR REPLACE INTO image_cache (file_id, revision, path, bytes)
+                            VALUES (?, ?, ?, ?)''', (file_id, revision, path, size))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving cached image: {str(e)}")
+        return False
+
+def evict_cached_images(max_bytes: int) -> list:
+    """Drop least recently used images until the cache fits in max_bytes, returning their paths"""
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            if conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM image_cache').fetchone()[0] <= max_bytes:
+                return []
+            rows = conn.execute('''SELECT file_id, revision, path, bytes FROM image_cache
+                                   ORDER BY last_used_at DESC, created_at DESC''').fetchall()
+            total = 0
+            evicted = []
+            for file_id, revision, path, size in rows:
+                total += size
+                if total > max_bytes:
+                    evicted.append((file_id, revision, path))
+            conn.executemany('DELETE FROM image_cache WHERE file_id = ? AND revision = ?',
+                             [(file_id, revision) for file_id, revision, _ in evicted])
+        return [path for _, _, path in evicted]
+    except sqlite3.Error as e:
+        logger.error(f"Image cache eviction failed: {str(e)}")
+        return []
+
+def save_run_items(run_id: str, items: list) -> bool:
+    """Spill finished items of a run; items are dicts with seq, position, item_id, name, result and prices (JSON)"""
+    rows = [(run_id, item['seq'], item['position'], item['item_id'], item['name'], item['result'], item['prices'])
+            for item in items]
+    try:
+        with span('db_write', op='save_run_items'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.executemany('''INSERT OR REPLACE INTO run_items
+                                (run_id, seq, position, item_id, item_name, result, prices)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving items for run {run_id}: {str(e)}")
+        return False
+
+def delete_run_items(run_id: str) -> bool:
+    """Drop spilled items of a run, e.g. before a retried job starts over"""
+    try:
+        with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('DELETE FROM run_items WHERE run_id = ?', (run_id,))
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting items for run {run_id}: {str(e)}")
+        return False
+
+def get_run_items(run_id: str, offset: int = 0, limit: int = -1) -> list:
+    """Spilled result JSON of a run in the order items were saved"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute('SELECT result FROM run_items WHERE run_id = ? ORDER BY seq LIMIT ? OFFSET ?',
+              (run_id, limit, offset))
+    rows = c.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+def get_run_prices(run_id: str) -> list:
+    """Price records JSON of every spilled item of a run, in save order"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute('SELECT prices FROM run_items WHERE run_id = ? ORDER BY seq', (run_id,))
+    rows = c.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+def save_spans(records: list):
+    """Insert a batch of finished telemetry spans"""
+    rows = [(record.get('run_id'), record.get('username'), record['stage'],
+             record['duration'] * 1000, record.get('outcome', 'ok'),
+             record.get('bytes'), record.get('tokens'),
+             time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(record.get('ended_at', time.time()))))
+            for record in records]
+    with sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+        conn.executemany('''INSERT INTO stage_spans
+                            (run_id, username, stage, duration_ms, outcome, bytes, tokens, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+
+def get_stage_spans(since_hours: int) -> list:
+    """Get (created_at, stage, duration_ms, outcome, bytes, tokens) rows from the last N hours"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute('''SELECT created_at, stage, duration_ms, outcome, bytes, tokens
+                 FROM stage_spans WHERE created_at >= datetime('now', ?)
+                 ORDER BY created_at''', (f'-{int(since_hours)} hours',))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+def prune_stage_spans(keep_days: int = 30) -> int:
+    """Delete spans older than keep_days, returning the number removed"""
+    with sqlite3.connect(DATABASE_NAME) as conn:
+        c = conn.execute("DELETE FROM stage_spans WHERE created_at < datetime('now', ?)",
+                         (f'-{int(keep_days)} days',))
+        return c.rowcount
+
+USAGE_COUNTERS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens',
+                  'cache_read_input_tokens', 'llm_calls', 'lens_calls', 'cache_hits', 'llm_ms', 'llm_ttft_ms')
+
+def save_run_usage(run_id: str, username: str, mode: str, images: int,
+                   elapsed_seconds: float, items: list, routing: dict = None) -> bool:
+    """Record a run and its per-item usage (UsageLedger.snapshot() entries).
+
+    routing is routing.routing_summary() for the run, whose estimated
+    savings are stored with the run. Usage saved earlier under the same
+    run_id (e.g. by a failed attempt of a retried job) is replaced.
+    """
+    routing = routing or {}
+    rows = [(run_id, username, item['item_id'], item.get('name'), item.get('model'), item.get('route'))
+            + tuple(int(item.get(name, 0)) for name in USAGE_COUNTERS) for item in items]
+    try:
+        with span('db_write', op='save_run_usage'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            conn.execute('''INSERT OR REPLACE INTO usage_runs
+                            (run_id, username, mode, images, elapsed_seconds, tokens_saved, llm_seconds_saved)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         (run_id, username, mode, images, elapsed_seconds,
+                          routing.get('tokens_saved'), routing.get('llm_seconds_saved')))
+            conn.execute('DELETE FROM usage_items WHERE run_id = ?', (run_id,))
+            conn.executemany(f'''INSERT INTO usage_items
+                                (run_id, username, item_id, item_name, model, route, {", ".join(USAGE_COUNTERS)})
+                                VALUES ({", ".join("?" for _ in range(6 + len(USAGE_COUNTERS)))})''', rows)
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving usage for run {run_id}: {str(e)}")
+        return False
+
+def get_daily_usage(days: int) -> list:
+    """Per user and day: runs, images, elapsed seconds and summed usage counters"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute(f'''SELECT date(r.created_at) AS day, r.username, COUNT(*) AS runs,
+                        SUM(r.images), SUM(r.elapsed_seconds),
+                        {", ".join(f"SUM(COALESCE(i.{name}, 0))" for name in USAGE_COUNTERS)}
+                  FROM usage_runs r
+                  LEFT JOIN (SELECT run_id, {", ".join(f"SUM({name}) AS {name}" for name in USAGE_COUNTERS)}
+                             FROM usage_items GROUP BY run_id) i ON i.run_id = r.run_id
+                  WHERE r.created_at >= datetime('now', ?)
+                  GROUP BY day, r.username
+                  ORDER BY day DESC, r.username''', (f'-{int(days)} days',))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+def get_route_baseline(days: int = 30) -> Union[Dict, None]:
+    """Average tokens and LLM milliseconds of successful full-model calls in recent runs"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute('''SELECT AVG(input_tokens + output_tokens), AVG(llm_ms) FROM usage_items
+                 WHERE route = 'full' AND llm_calls > 0 AND created_at >= datetime('now', ?)''',
+              (f'-{int(days)} days',))
+    tokens, llm_ms = c.fetchone()
+    conn.close()
+    return {'tokens': tokens, 'llm_ms': llm_ms or 0} if tokens else None
+
+def get_run_usage(limit: int = 50) -> list:
+    """Most recent runs with route counts, estimated routing savings, summed usage counters and the models used"""
+    conn = sqlite3.connect(DATABASE_NAME)
+    c = conn.cursor()
+    c.execute(f'''SELECT r.run_id, r.username, r.mode, r.images, r.elapsed_seconds, r.created_at,
+                        GROUP_CONCAT(DISTINCT i.model),
+                        COALESCE(SUM(i.route = 'fast'), 0), COALESCE(SUM(i.route = 'full'), 0),
+                        COALESCE(SUM(i.route = 'skipped'), 0), r.tokens_saved, r.llm_seconds_saved,
+                        {", ".join(f"COALESCE(SUM(i.{name}), 0)" for name in USAGE_COUNTERS)}
+                  FROM usage_runs r LEFT JOIN usage_items i ON i.run_id = r.run_id
+                  GROUP BY r.run_id
+                  ORDER BY r.created_at DESC LIMIT ?''', (limit,))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+APPRAISAL_FIELDS = ('appraisal_id', 'run_id', 'username', 'item_id', 'item_name', 'titles',
+                    'analysis', 'model', 'created_at')
+
+def save_appraisal(run_id: str, username: str, item_id: str, item_name: str,
+                   titles: str, analysis: str, model: str,
+                   image_hash: str = None, lens_results: str = None) -> Union[int, None]:
+    """Store an analysis with its Lens listing titles for search and reuse, returning its appraisal_id"""
+    try:
+        with span('db_write', op='save_appraisal'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            c = conn.execute('''INSERT INTO appraisals
+                                (run_id, username, item_id, item_name, titles, analysis, model, image_hash, lens_results)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                             (run_id, username, item_id, item_name, titles, analysis, model, image_hash, lens_results))
+            return c.lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"Error saving appraisal: {str(e)}")
+        return None
+
+def get_appraisal_hashes(max_age_days: int, after_id: int = 0) -> list:
+    """(appraisal_id, username, image_hash) of recent hashed appraisals newer than after_id, oldest first"""
+    try:
+        conn = sqlite3.connect(DATABASE_NAME)
+        c = conn.cursor()
+        c.execute('''SELECT appraisal_id, username, image_hash FROM appraisals
+                     WHERE appraisal_id > ? AND image_hash IS NOT NULL AND created_at >= datetime('now', ?)
+                     ORDER BY appraisal_id''', (after_id, f'-{int(max_age_days)} days'))
+        rows = c.fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        logger.error(f"Appraisal hash lookup failed: {str(e)}")
+        return []
+
+def set_appraisal_image(appraisal_id: int, image_hash: str, lens_results: str) -> bool:
+    """Attach an image hash and Lens matches to an appraisal stored without them"""
+    try:
+        with span('db_write', op='set_appraisal_image'), sqlite3.connect(DATABASE_NAME, timeout=30) as conn:
+            c = conn.execute('''UPDATE appraisals SET image_hash = ?, lens_results = ?
+                                WHERE appraisal_id = ? AND image_hash IS NULL''',
+                             (image_hash, lens_results, appraisal_id))
+            return c.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error updating appraisal {appraisal_id}: {str(e)}")
+        return False
+
+def get_appraisal(appraisal_id: int, max_age_days: int):
+    """A recent appraisal with its stored Lens matches ('lens_results', JSON), as a dict, or None"""
+    try:
+        conn = sqlite3.connect(DATABASE_NAME)
+        c = conn.cursor()
+        c.execute(f'''SELECT {", ".join(APPRAISAL_FIELDS)}, lens_results FROM appraisals
+                      WHERE appraisal_id = ? AND created_at >= datetime('now', ?)''',
+                  (appraisal_id, f'-{int(max_age_days)} days'))
+        row = c.fetchone()
+        conn.close()
+        return dict(zip(APPRAISAL_FIELDS + ('lens_results',), row)) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Appraisal lookup failed: {str(e)}")
+        return None
+
+def get_latest_appraisal_for_item(item_id: str, username: str, max_age_days: int):
+    """The user's most recent appraisal of the same Drive file, as a dict, or None"""
+    try:
+        conn = sqlite3.connect(DATABASE_NAME)
+        c = conn.cursor()
+        c.execute(f'''SELECT {", ".join(APPRAISAL_FIELDS)} FROM appraisals
+                      WHERE item_id = ? AND username = ? AND created_at >= datetime('now', ?)
+                      ORDER BY created_at DESC LIMIT 1''', (item_id, username, f'-{int(max_age_days)} days'))
+        row = c.fetchone()
+        conn.close()
+        return dict(zip(APPRAISAL_FIELDS, row)) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Appraisal lookup failed: {str(e)}")
+        return None
+
+def match_appraisals(fts_query: str, username: str, max_age_days: int, limit: int = 5) -> list:
+    """The user's best full-text matches for an FTS5 query, as dicts; empty if FTS5 is unavailable"""
+    try:
+        conn = sqlite3.connect(DATABASE_NAME)
+        c = conn.cursor()
+        c.execute(f'''SELECT {", ".join("a." + name for name in APPRAISAL_FIELDS)}
+                      FROM appraisals_fts JOIN appraisals a ON a.appraisal_id = appraisals_fts.rowid
+                      WHERE appraisals_fts MATCH ? AND a.username = ? AND a.created_at >= datetime('now', ?)
+                      ORDER BY bm25(appraisals_fts) LIMIT ?''',
+                  (fts_query, username, f'-{int(max_age_days)} days', limit))
+        rows = c.fetchall()
+        conn.close()
+        return [dict(zip(APPRAISAL_FIELDS, row)) for row in rows]
+    except sqlite3.Error as e:
+        logger.error(f"Appraisal match failed: {str(e)}")
+        return []
+
+def search_appraisals(fts_query: str, username: str = None, limit: int = 50) -> list:
+    """Full-text search of past appraisals, optionally limited to one user.
+
+    Returns (appraisal_id, item_name, created_at, snippet, analysis) rows.
+    """
+    query = '''SELECT a.appraisal_id, a.item_name, a.created_at,
+                      snippet(appraisals_fts, -1, '**', '**', '…', 12), a.analysis
+               FROM appraisals_fts JOIN appraisals a ON a.appraisal_id = appraisals_fts.rowid
+               WHERE appraisals_fts MATCH ?'''
+    params = [fts_query]
+    if username:
+        query += ' AND a.username = ?'
+        params.append(username)
+    query += ' ORDER BY bm25(appraisals_fts) LIMIT ?'
+    params.append(limit)
+
+    try:
+        conn = sqlite3.connect(DATABASE_NAME)
+        c = conn.cursor()
+        c.execute(query, params)
+        rows = c.fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        logger.error(f"Appraisal search failed: {str(e)}")
+        return []
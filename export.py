@@ -0,0 +1,167 @@
+"""Bulk export of a user's reports as a streamed ZIP archive.
+
+stream_export() yields the archive in small chunks while it is being
+written, so the API never holds a whole archive in memory. Each selected
+run gets a folder with its PDF and Excel reports and, optionally, its item
+results as CSV or JSON.
+
+The Streamlit app cannot stream a response, so it hands exports to the API
+through one-time links (create_export_link / EXPORT_BASE_URL, set by the
+deployment). Without EXPORT_BASE_URL it builds small exports itself.
+"""
+import io
+import os
+import json
+import time
+import secrets
+import zipfile
+from datetime import datetime
+from chunked import ensure_report
+from database import get_reports, get_result_run, save_export_link, get_export_link
+from results import results_csv_blocks, results_json_blocks
+from storage import file_size, open_report, report_file_name, resolve_report_path, run_groups, run_key
+from telemetry import span
+
+# Public or reverse-proxied URL of the job API that users' browsers can reach; when set the app links
+# exports to it instead of building them itself, so leave it unset while the API is only local
+EXPORT_BASE_URL = os.getenv('EXPORT_BASE_URL', '').rstrip('/')
+EXPORT_LINK_SECONDS = int(os.getenv('EXPORT_LINK_SECONDS', '900'))
+# Largest selection the app builds itself when EXPORT_BASE_URL is not set; Streamlit holds it in memory
+EXPORT_INLINE_MAX_MB = int(os.getenv('EXPORT_INLINE_MAX_MB', '50'))
+
+RESULT_FORMATS = ('csv', 'json')
+# Bytes buffered before a chunk is handed to the caller
+STREAM_CHUNK_SIZE = 256 * 1024
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable buffer that zipfile writes into and stream_zip drains"""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def stream_zip(entries, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield a ZIP archive of (name, mtime, blocks, compress_type) entries chunk by chunk.
+
+    blocks is an iterable of bytes. The sink cannot seek, so zipfile writes
+    sizes in data descriptors after each entry instead of going back.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for name, mtime, blocks, compress_type in entries:
+            info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+            info.compress_type = compress_type
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for block in blocks:
+                    entry.write(block)
+                    if len(sink.buffer) >= chunk_size:
+                        yield sink.take()
+            if sink.buffer:
+                yield sink.take()
+    yield sink.take()
+
+def file_blocks(path, block_size=64 * 1024):
+    with open_report(path) as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+def user_runs(username):
+    """[(run_key, label, rows)] of a user's past reports, newest first"""
+    runs = []
+    for rows in reversed(run_groups(get_reports(username))):
+        created = min(row[3] for row in rows)
+        runs.append((run_key(rows[0]), f"{created} ({len(rows)} files)", rows))
+    return runs
+
+def export_entries(username, run_keys, results=None):
+    """Archive entries for the selected runs of a user"""
+    selected = set(run_keys)
+    for key, _, rows in user_runs(username):
+        if key not in selected:
+            continue
+        folder = f"{min(row[3] for row in rows)[:10]}_{key[:12]}"
+        for row in rows:
+            path = ensure_report(resolve_report_path(row[2]), row[4])
+            if path:
+                # PDF and XLSX files are already compressed, so they are stored as they are
+                yield (f"{folder}/{report_file_name(path)}", os.path.getmtime(path), file_blocks(path),
+                       zipfile.ZIP_STORED)
+        run_id = rows[0][4]
+        if results in RESULT_FORMATS and run_id:
+            blocks = results_csv_blocks(run_id) if results == 'csv' else results_json_blocks(run_id)
+            yield f"{folder}/results.{results}", time.time(), blocks, zipfile.ZIP_DEFLATED
+
+def stream_export(username, run_keys, results=None):
+    """Yield the ZIP export of a user's selected runs"""
+    with span('export_zip') as export_span:
+        size = 0
+        for chunk in stream_zip(export_entries(username, run_keys, results)):
+            size += len(chunk)
+            yield chunk
+        export_span['bytes'] = size
+
+def export_size(username, run_keys):
+    """Estimated bytes of the reports of the selected runs.
+
+    Reports that were never rendered are estimated from their run's stored
+    images, which the PDF and the Excel report each embed.
+    """
+    selected = set(run_keys)
+    size = 0
+    unrendered = set()
+    for key, _, rows in user_runs(username):
+        if key not in selected:
+            continue
+        for row in rows:
+            path = resolve_report_path(row[2])
+            if os.path.exists(path):
+                size += file_size(path)
+            elif row[4]:
+                unrendered.add(row[4])
+    for run in filter(None, map(get_result_run, unrendered)):
+        if os.path.isdir(run['image_dir']):
+            size += 2 * sum(entry.stat().st_size for entry in os.scandir(run['image_dir']) if entry.is_file())
+    return size
+
+def export_archive(username, run_keys, results=None):
+    """The export as bytes, for the app's download button when EXPORT_BASE_URL is not set.
+
+    The whole archive is held in memory, so the app refuses selections over
+    EXPORT_INLINE_MAX_MB (see export_size).
+    """
+    archive = io.BytesIO()
+    for chunk in stream_export(username, run_keys, results):
+        archive.write(chunk)
+    return archive.getvalue()
+
+def export_file_name():
+    return f"estateai_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+
+def create_export_link(username, run_keys, results=None):
+    """Store a one-time export request and return its token"""
+    token = secrets.token_urlsafe(24)
+    save_export_link(token, username, json.dumps(list(run_keys)), results, time.time() + EXPORT_LINK_SECONDS)
+    return token
+
+def redeem_export_link(token):
+    """(username, run_keys, results) for a valid, unused export token, else None"""
+    link = get_export_link(token)
+    if not link:
+        return None
+    username, run_keys, results = link
+    return username, json.loads(run_keys), results
@@ -0,0 +1,87 @@
+"""On-disk cache of downloaded Drive images.
+
+Each Drive file is downloaded and normalized once: converted to RGB, scaled
+down to IMAGE_MAX_SIDE and saved as a JPEG under IMAGE_CACHE_DIR. Entries are
+keyed by file ID and revision and indexed in the image_cache table. The
+folder listing does not expose revisions, so entries without one are only
+trusted for IMAGE_CACHE_TTL_HOURS. Least recently used images are evicted
+once the cache grows past IMAGE_CACHE_MAX_MB.
+"""
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from PIL import Image
+from io import BytesIO
+from database import get_cached_image, save_cached_image, evict_cached_images
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', '/var/lib/estateai/image_cache')
+IMAGE_CACHE_MAX_BYTES = int(float(os.getenv('IMAGE_CACHE_MAX_MB', '2048')) * 1024 * 1024)
+IMAGE_CACHE_TTL_HOURS = float(os.getenv('IMAGE_CACHE_TTL_HOURS', '24'))
+# Longest side of stored images; reports show them at a few hundred points at most
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '1600'))
+
+def image_revision(image):
+    return image.get('revision') or ''
+
+def cache_path(file_id, revision):
+    # Hash the key so any file ID or revision string makes a safe file name
+    key = hashlib.sha1(f"{file_id}:{revision}".encode('utf-8')).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, key[:2], f"{key}.jpg")
+
+def copy_image(source, destination):
+    """Place a cached image at destination, hard-linking it when possible"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+    return destination
+
+def fetch_cached(image, destination):
+    """Copy a cached image to destination, returning the path or None on a miss"""
+    revision = image_revision(image)
+    path = get_cached_image(image['id'], revision, None if revision else IMAGE_CACHE_TTL_HOURS)
+    if not path:
+        return None
+    try:
+        return copy_image(path, destination)
+    except OSError:
+        # Evicted by another process since the lookup
+        return None
+
+def normalize_image(content):
+    """Decode downloaded bytes into a report-resolution RGB image"""
+    with Image.open(BytesIO(content)) as img:
+        img = img.convert('RGB')
+    img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    return img
+
+def store_image(image, content, destination):
+    """Normalize downloaded bytes into the cache and copy the result to destination"""
+    img = normalize_image(content)
+    revision = image_revision(image)
+    path = cache_path(image['id'], revision)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so concurrent readers never see a partial file
+        partial_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        img.save(partial_path, 'JPEG')
+        os.replace(partial_path, path)
+    except OSError as e:
+        logger.warning(f"Image cache unavailable, saving {image['id']} uncached: {str(e)}")
+        img.save(destination, 'JPEG')
+        return destination
+
+    save_cached_image(image['id'], revision, path, os.path.getsize(path))
+    copy_image(path, destination)
+    for evicted in evict_cached_images(IMAGE_CACHE_MAX_BYTES):
+        try:
+            os.remove(evicted)
+        except OSError:
+            pass
+    return destination
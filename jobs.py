@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import shutil
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from database import (
+    get_job, update_job, get_user_limits, increment_image_count, save_report, save_run_usage, delete_run_items
+)
+from pipeline import MAX_IMAGES_PER_RUN, extract_file_ids_from_folder, process_image
+from reports import new_report_base_name, reports_subdir
+from storage import enforce_quota
+from chunked import ReportSpool, pipelined_chunks
+from routing import run_routing_summary
+from telemetry import run_context, submit_with_context
+from scheduler import lane_for_mode, tenant
+from profiling import profiled_run
+from lots import GROUP_VIEWS, group_lots
+
+logger = logging.getLogger(__name__)
+
+# Images processed in parallel within one job
+IMAGE_CONCURRENCY = int(os.getenv('JOB_IMAGE_CONCURRENCY', '4'))
+
+# Minimum seconds between progress writes, so large jobs don't hammer SQLite
+PROGRESS_INTERVAL = 1.0
+
+class LeaseLost(Exception):
+    """The worker's lease on a job expired and another worker may have taken it over"""
+
+def check_lease(lease, job_id, executor=None):
+    """Raise LeaseLost if the lease is lost, cancelling the images still queued on executor"""
+    if lease and lease.lost.is_set():
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise LeaseLost(job_id)
+
+def execute_job(job_id, lease=None):
+    """Run a claimed job to completion, recording status and progress in the jobs table.
+
+    lease is the worker's worker.Lease on the job. If it is lost, the job is
+    abandoned before its next write of results, status or usage, which now
+    belong to whichever worker claims it next.
+    """
+    job = get_job(job_id)
+    if not job:
+        logger.error(f"Job {job_id} not found")
+        return False
+
+    start_time = time.time()
+    with run_context(job_id, job['username']) as usage, tenant(job['username'], lane_for_mode(job['mode'])), \
+            profiled_run(job_id, job['username']):
+        try:
+            success = run_job(job, lease)
+        except LeaseLost:
+            # The worker that takes the job over records the usage of its own attempt
+            logger.warning(f"Lost the lease on job {job_id}, abandoning it")
+            return False
+    items = usage.snapshot()
+    save_run_usage(job_id, job['username'], job['mode'], job_image_count(job_id),
+                   time.time() - start_time, items, run_routing_summary(items))
+    return success
+
+def job_image_count(job_id):
+    """Images the job ended up processing"""
+    job = get_job(job_id)
+    return job['total_images'] if job else 0
+
+def run_job(job, lease=None):
+    """Process a job row; see execute_job"""
+    job_id = job['job_id']
+    username = job['username']
+    update_job(job_id, status='running', error=None)
+    work_dir = tempfile.mkdtemp(prefix="estateai_job_")
+    # A retried job starts over
+    delete_run_items(job_id)
+
+    try:
+        errors = []
+        images = extract_file_ids_from_folder(job['folder_url'], on_error=errors.append)
+        if not images:
+            update_job(job_id, status='failed', error=errors[0] if errors else "No images found in folder")
+            return False
+
+        # Only the images that will be processed count towards the user's limit
+        images = images[:MAX_IMAGES_PER_RUN]
+        image_count = len(images)
+
+        current_count, max_allowed = get_user_limits(username)
+        if current_count + image_count > max_allowed:
+            update_job(job_id, status='failed', error=f"Image limit exceeded: {current_count + image_count}/{max_allowed}")
+            return False
+
+        update_job(job_id, total_images=len(images), processed_images=0)
+
+        # Reports are rendered when first downloaded; the job completes as soon as its results are stored
+        spool = ReportSpool(job_id, new_report_base_name(suffix=job_id[:8]), reports_subdir(), lazy=True,
+                            username=username)
+        processed = 0
+        last_update = time.time()
+        with ThreadPoolExecutor(max_workers=IMAGE_CONCURRENCY) as executor:
+            items = group_lots(images, executor, work_dir) if GROUP_VIEWS else images
+            submit = partial(submit_with_context, executor, process_image, mode=job['mode'], work_dir=work_dir)
+            for chunk in pipelined_chunks(items, submit):
+                check_lease(lease, job_id, executor)
+                finished = []
+                for position, image, future in chunk:
+                    try:
+                        result, img_path = future.result()
+                        if result:
+                            finished.append((position, result))
+                        elif img_path:
+                            os.remove(img_path)
+                    except Exception as e:
+                        logger.error(f"Job {job_id} image {image['id']} error: {str(e)}")
+
+                    processed += len(image.get('views') or [image])
+                    if time.time() - last_update >= PROGRESS_INTERVAL:
+                        update_job(job_id, processed_images=processed)
+                        last_update = time.time()
+                # The chunk may have outlived the lease; the next owner has cleared this job's items
+                check_lease(lease, job_id, executor)
+                spool.add(finished)
+
+        update_job(job_id, processed_images=len(images))
+        if not spool.saved:
+            update_job(job_id, status='failed', error="No images could be processed")
+            return False
+
+        check_lease(lease, job_id)
+        parts = spool.finish()
+        check_lease(lease, job_id)
+        if not parts:
+            update_job(job_id, status='failed', error="Could not store results")
+            return False
+
+        for pdf_path, excel_path in parts:
+            save_report(username, pdf_path, job_id)
+            save_report(username, excel_path, job_id)
+        increment_image_count(username, image_count)
+
+        update_job(job_id, status='complete', pdf_path=parts[0][0], xlsx_path=parts[0][1],
+                   report_parts=json.dumps(parts))
+        enforce_quota(username)
+        return True
+    except LeaseLost:
+        raise
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}")
+        update_job(job_id, status='failed', error=str(e))
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
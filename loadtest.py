@@ -0,0 +1,292 @@
+"""Concurrent-session load test of the Streamlit app against the local stubs.
+
+Usage:
+    python loadtest.py [--sessions 1,2,4,8] [--images 25] [--runs 1] [--reruns 5]
+                       [--mode analysis|basic] [--latency-scale 1.0] [--output capacity.json]
+
+Each concurrency level runs in a fresh process holding N simulated browser
+sessions (streamlit.testing AppTest on app.py), like one Streamlit server
+with N tabs open. Every session signs in through the login form with its own
+user, times idle reruns, then enters a folder URL and processes it, --runs
+times. Sessions of the same level run at the same time, so reruns of some
+sessions overlap the runs of others.
+
+Per level it reports rerun latency p50/p95, run throughput, SQLite write
+waits (db_write spans and "database is locked" errors) and memory per
+session, which together form the capacity curve: the number of concurrent
+users the process serves before reruns or throughput degrade. Reference
+curve (25-image analysis runs, --latency-scale 0.2, one CPU):
+
+    sessions  rerun p95  run p95 s  img/min  MB/session
+           1      145ms       10.0    141.0        55.4
+           4      512ms       22.4    242.0        42.1
+           8     1123ms       42.8    249.4        25.7
+          16     4634ms       85.6    249.0        17.5
+
+Throughput levels off once MAX_ACTIVE_RUNS and the provider limits are
+saturated (see scheduler.py); beyond that, more sessions only queue longer
+and slow each other's reruns. AppTest recompiles app.py on every rerun,
+which a real server caches, so rerun latencies are a slight overestimate.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import queue
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime
+from stubs import StubServer, add_stub_arguments, config_from_args
+
+logger = logging.getLogger(__name__)
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+LOAD_PASSWORD = "LoadTest#2024"
+# Seconds a single rerun (including a whole folder run) may take before AppTest gives up
+RERUN_TIMEOUT_SECONDS = 1800
+# A db_write span longer than this is counted as having waited for the write lock
+LOCK_WAIT_SECONDS = 0.1
+RSS_SAMPLE_SECONDS = 0.2
+
+def current_rss_mb():
+    """Resident set size of this process, falling back to the peak where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class LockErrorCounter(logging.Handler):
+    """Counts log records reporting a locked SQLite database"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        if "database is locked" in record.getMessage():
+            self.count += 1
+
+def widget(elements, label, index):
+    """The element with label on a session's current page"""
+    for element in elements:
+        if element.label == label:
+            return element
+    raise RuntimeError(f"Session {index} has no {label!r} widget on its page")
+
+def run_session(index, folder_url, mode, runs, reruns, reuse_prior, timings):
+    """Drive one browser session: sign in, idle reruns, then folder runs; runs in a thread"""
+    from streamlit.testing.v1 import AppTest
+    username = f"load{index:03d}"
+    at = AppTest.from_file(APP_SCRIPT, default_timeout=RERUN_TIMEOUT_SECONDS)
+
+    def timed_run(action):
+        start = time.perf_counter()
+        action()
+        return time.perf_counter() - start
+
+    timings['reruns'].append(timed_run(at.run))
+    widget(at.text_input, "Username", index).input(username)
+    widget(at.text_input, "Password", index).input(LOAD_PASSWORD)
+    timings['logins'].append(timed_run(lambda: widget(at.button, "Sign In", index).click().run()))
+    if at.session_state['authenticated_user'] != username:
+        raise RuntimeError(f"Session {index} could not sign in")
+
+    label = "Process without Appraisal" if mode == 'basic' else "Process Images with Analysis"
+    for run_number in range(runs):
+        for _ in range(reruns):
+            timings['reruns'].append(timed_run(at.run))
+        reuse = [checkbox for checkbox in at.checkbox if checkbox.label.startswith("♻️")]
+        if reuse:
+            reuse[0].set_value(reuse_prior)
+        widget(at.text_input, "Google Drive Folder URL", index).input(folder_url.format(run=run_number))
+        elapsed = timed_run(lambda: widget(at.button, label, index).click().run())
+        if at.exception:
+            raise RuntimeError(f"Session {index} failed: {at.exception[0].message}")
+        timings['runs'].append({'seconds': elapsed, 'ok': bool(at.success),
+                                'errors': [element.value for element in at.error]})
+
+def run_level(sessions, images, mode, runs, reruns, reuse_prior, environment, results_queue):
+    """Load-test one concurrency level; runs in a child process"""
+    work_dir = tempfile.mkdtemp(prefix="estateai_load_")
+    os.environ.update(environment)
+    for name, subdir in (('REPORTS_DIR', "reports"), ('RESULTS_DIR', "results"),
+                         ('IMAGE_CACHE_DIR', "image_cache"), ('PROFILES_DIR', "profiles")):
+        os.environ[name] = os.path.join(work_dir, subdir)
+    os.environ['DATABASE_PATH'] = os.path.join(work_dir, "load.db")
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', "error")
+    os.chdir(work_dir)
+    # Imported here so the app picks up the stub endpoints and database from the environment
+    from streamlit import config
+    from streamlit.testing.v1 import AppTest
+    from database import init_db, create_user, get_all_users, update_user_limit
+    from telemetry import add_span_listener, summarize_spans, percentile
+    # AppTest recompiles app.py on every rerun, and magic's ast.parse is not thread-safe on Python 3.11
+    config.set_option('runner.magicEnabled', False)
+    logging.getLogger().setLevel(logging.WARNING)
+    lock_errors = LockErrorCounter()
+    logging.getLogger().addHandler(lock_errors)
+    init_db()
+
+    try:
+        for index in range(sessions):
+            create_user(f"load{index:03d}", f"load{index:03d}@example.com", LOAD_PASSWORD, "")
+        for user in get_all_users():
+            update_user_limit(user[0], 10**9)
+
+        # Render the login page once so module imports are not charged to the sessions
+        AppTest.from_file(APP_SCRIPT, default_timeout=RERUN_TIMEOUT_SECONDS).run()
+        baseline_rss = current_rss_mb()
+        peak_rss = [baseline_rss]
+        stop_sampling = threading.Event()
+
+        def sample_rss():
+            while not stop_sampling.wait(RSS_SAMPLE_SECONDS):
+                peak_rss[0] = max(peak_rss[0], current_rss_mb())
+
+        spans = []
+        add_span_listener(spans.append)
+        timings = {'reruns': [], 'logins': [], 'runs': []}
+        failures = []
+
+        def session(index):
+            folder_url = f"{environment['DRIVE_BASE_URL']}/drive/folders/load{index:03d}r{{run}}-{images}"
+            try:
+                run_session(index, folder_url, mode, runs, reruns, reuse_prior, timings)
+            except Exception as e:
+                failures.append(str(e))
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        threads = [threading.Thread(target=session, args=(index,), name=f"load-session-{index}")
+                   for index in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop_sampling.set()
+        sampler.join()
+
+        def ms(values, pct):
+            return round((percentile(values, pct) or 0.0) * 1000, 1)
+
+        completed = [run for run in timings['runs'] if run['ok']]
+        run_seconds = [run['seconds'] for run in timings['runs']]
+        writes = [record['duration'] for record in spans if record['stage'] == 'db_write']
+        stages = summarize_spans(spans)
+        results_queue.put({
+            'sessions': sessions,
+            'elapsed_seconds': round(elapsed, 2),
+            'failures': failures,
+            'rerun_p50_ms': ms(timings['reruns'], 50),
+            'rerun_p95_ms': ms(timings['reruns'], 95),
+            'login_p95_ms': ms(timings['logins'], 95),
+            'runs': len(timings['runs']),
+            'runs_completed': len(completed),
+            'run_p50_seconds': round(percentile(run_seconds, 50) or 0.0, 2),
+            'run_p95_seconds': round(percentile(run_seconds, 95) or 0.0, 2),
+            'runs_per_minute': round(len(completed) / elapsed * 60, 2) if elapsed else 0.0,
+            'images_per_minute': round(len(completed) * images / elapsed * 60, 1) if elapsed else 0.0,
+            'db_writes': len(writes),
+            'db_write_p95_ms': ms(writes, 95),
+            'db_write_max_ms': round(max(writes, default=0.0) * 1000, 1),
+            'db_lock_waits': sum(1 for duration in writes if duration > LOCK_WAIT_SECONDS),
+            'db_lock_errors': lock_errors.count,
+            'baseline_rss_mb': round(baseline_rss, 1),
+            'peak_rss_mb': round(peak_rss[0], 1),
+            'rss_per_session_mb': round((peak_rss[0] - baseline_rss) / sessions, 1),
+            'stages': stages,
+        })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def wait_for_result(process, results_queue, sessions):
+    """Collect a child's result, or a failed level if the child died without reporting"""
+    while True:
+        try:
+            return results_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                return {'sessions': sessions, 'elapsed_seconds': 0.0,
+                        'failures': [f"Load test process exited with code {process.exitcode}"],
+                        'rerun_p50_ms': 0.0, 'rerun_p95_ms': 0.0, 'login_p95_ms': 0.0, 'runs': 0,
+                        'runs_completed': 0, 'run_p50_seconds': 0.0, 'run_p95_seconds': 0.0,
+                        'runs_per_minute': 0.0, 'images_per_minute': 0.0, 'db_writes': 0,
+                        'db_write_p95_ms': 0.0, 'db_write_max_ms': 0.0, 'db_lock_waits': 0,
+                        'db_lock_errors': 0, 'baseline_rss_mb': 0.0, 'peak_rss_mb': 0.0,
+                        'rss_per_session_mb': 0.0, 'stages': {}}
+
+TABLE_HEADER = (f"{'sessions':>8}{'rerun p50':>11}{'rerun p95':>11}{'run p95 s':>11}{'runs/min':>10}"
+                f"{'img/min':>9}{'write p95':>11}{'lock waits':>12}{'MB/session':>12}")
+
+def format_rows(levels):
+    """Capacity curve rows, one per concurrency level (see TABLE_HEADER)"""
+    lines = []
+    for level in levels:
+        lines.append(f"{level['sessions']:>8}{level['rerun_p50_ms']:>9.0f}ms{level['rerun_p95_ms']:>9.0f}ms"
+                     f"{level['run_p95_seconds']:>11.1f}{level['runs_per_minute']:>10.2f}"
+                     f"{level['images_per_minute']:>9.1f}{level['db_write_p95_ms']:>9.1f}ms"
+                     f"{level['db_lock_waits']:>6}/{level['db_lock_errors']:<5}{level['rss_per_session_mb']:>12.1f}")
+        if level['failures']:
+            lines.append(f"  {len(level['failures'])} failed sessions: {level['failures'][0]}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent Streamlit session load test with local service stubs")
+    parser.add_argument("--sessions", default="1,2,4,8", help="Comma-separated concurrent session counts")
+    parser.add_argument("--images", type=int, default=25, help="Images in each processed folder")
+    parser.add_argument("--runs", type=int, default=1, help="Folders processed by each session")
+    parser.add_argument("--reruns", type=int, default=5, help="Idle reruns timed before each folder run")
+    parser.add_argument("--mode", choices=["analysis", "basic"], default="analysis")
+    parser.add_argument("--reuse-prior", action="store_true",
+                        help="Let items reuse prior appraisals (off so every item exercises the LLM stage)")
+    parser.add_argument("--output", help="Write results as JSON")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = StubServer(config_from_args(args)).start()
+    context = multiprocessing.get_context("spawn")
+    levels = []
+    print(TABLE_HEADER, flush=True)
+    try:
+        for sessions in [int(count) for count in args.sessions.split(',') if count]:
+            results_queue = context.Queue()
+            process = context.Process(target=run_level,
+                                      args=(sessions, args.images, args.mode, args.runs, args.reruns,
+                                            args.reuse_prior, server.environment(), results_queue))
+            process.start()
+            level = wait_for_result(process, results_queue, sessions)
+            process.join()
+            levels.append(level)
+            print(format_rows([level]), flush=True)
+    finally:
+        server.stop()
+
+    result = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'mode': args.mode,
+        'images': args.images,
+        'runs': args.runs,
+        'reruns': args.reruns,
+        'latency_scale': args.latency_scale,
+        'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+        'stub_requests': server.counters,
+        'levels': levels,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 1 if any(level['failures'] for level in levels) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Grouping several photos of one lot into a single item.
+
+Estate photographers often shoot a lot from several angles, and appraising
+each photo on its own gives contradicting reports. With grouping on, every
+image of a folder is downloaded (into the image cache, so the run itself
+gets cache hits) and hashed first (see quality.image_hash). An image joins
+the lot of the image before it in the listing when their hashes are within
+GROUP_MAX_DISTANCE bits, unless numbered file names say they were not shot
+one after the other (IMG_0412 and IMG_0413 may group, IMG_0412 and
+IMG_0415 may not). An image within GROUP_DUPLICATE_DISTANCE bits of any
+earlier photo joins that photo's lot wherever it is in the folder. A lot
+holds at most GROUP_MAX_VIEWS photos.
+
+Lots are image dicts of their first photo with every photo in 'views';
+pipeline.process_image appraises them with one Lens and one LLM call.
+"""
+import os
+import re
+import logging
+import numpy as np
+from pipeline import download_image
+from quality import image_hash, hash_distance
+from telemetry import span, submit_with_context
+
+logger = logging.getLogger(__name__)
+
+# Whether runs group photos into lots by default
+GROUP_VIEWS = os.getenv('GROUP_VIEWS', '0') == '1'
+GROUP_MAX_VIEWS = int(os.getenv('GROUP_MAX_VIEWS', '4'))
+# Hash bits consecutive photos of one lot may differ by; unrelated photos differ by about 32
+GROUP_MAX_DISTANCE = int(os.getenv('GROUP_MAX_DISTANCE', '16'))
+GROUP_DUPLICATE_DISTANCE = int(os.getenv('GROUP_DUPLICATE_DISTANCE', '6'))
+
+NAME_SEQUENCE_PATTERN = re.compile(r"^(.*?)(\d+)$")
+
+def name_sequence(name):
+    """(prefix, number) of a file name ending in digits, e.g. ('IMG_', 412) for IMG_0412.jpg, or None"""
+    match = NAME_SEQUENCE_PATTERN.match(os.path.splitext(name or "")[0])
+    if not match:
+        return None
+    return match.group(1).lower(), int(match.group(2))
+
+def consecutive(previous, image):
+    """Whether two photos next to each other in the listing may have been shot one after the other"""
+    a, b = name_sequence(previous['name']), name_sequence(image['name'])
+    if a and b and a[0] == b[0]:
+        return b[1] - a[1] == 1
+    # Names without a shared numbering (e.g. named after Drive file IDs) don't tell
+    return True
+
+def hash_view(image, work_dir):
+    """Hash of an image, downloading it into the image cache; None if it cannot be read"""
+    path = download_image(image, work_dir)
+    if not path:
+        return None
+    try:
+        return image_hash(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not hash image {image['id']}: {str(e)}")
+        return None
+    finally:
+        os.remove(path)
+
+def hash_images(images, executor, work_dir="."):
+    futures = [submit_with_context(executor, hash_view, image, work_dir) for image in images]
+    return [future.result() for future in futures]
+
+def group_views(images, hashes):
+    """Group images (in folder order) into lots given their hashes (None when unknown); see the module docstring"""
+    lots = []
+    known = np.zeros(len(images), dtype=np.uint64)
+    owners = []
+    previous = None
+    for image, value in zip(images, hashes):
+        target = None
+        if value is not None:
+            if (previous and consecutive(previous[0], image)
+                    and hash_distance(previous[1], value) <= GROUP_MAX_DISTANCE):
+                target = previous[2]
+            elif owners:
+                # Compare with every earlier photo at once, counting differing bits byte by byte
+                differing = np.unpackbits((known[:len(owners)] ^ np.uint64(value)).view(np.uint8))
+                distances = differing.reshape(len(owners), 64).sum(axis=1)
+                closest = int(distances.argmin())
+                if distances[closest] <= GROUP_DUPLICATE_DISTANCE:
+                    target = owners[closest]
+        if target is not None and len(lots[target]['views']) >= GROUP_MAX_VIEWS:
+            target = None
+
+        if target is None:
+            lots.append(dict(image, views=[image]))
+            target = len(lots) - 1
+        else:
+            lots[target]['views'].append(image)
+
+        previous = None
+        if value is not None:
+            known[len(owners)] = value
+            owners.append(target)
+            previous = (image, value, target)
+    return lots
+
+def group_lots(images, executor, work_dir="."):
+    """Lots of a folder's images, hashing them on executor"""
+    with span('group_views', items=len(images)) as group_span:
+        lots = group_views(images, hash_images(images, executor, work_dir))
+        group_span['lots'] = len(lots)
+    logger.info(f"Grouped {len(images)} images into {len(lots)} lots")
+    return lots
@@ -0,0 +1,317 @@
+import os
+import re
+import json
+import time
+import logging
+import requests
+import anthropic
+from dotenv import load_dotenv
+from telemetry import span, record_usage, current_run
+from scheduler import provider_slot
+from image_cache import fetch_cached, store_image
+from appraisals import REUSE_PRIOR_APPRAISALS, find_prior_appraisal, remember_appraisal, remember_appraisal_image
+from prices import price_records, without_prices
+from routing import FULL_MAX_TOKENS, SKIPPED_ANALYSIS, route_item
+from quality import check_image_quality, quality_analysis
+from visual_index import add_to_visual_index, find_visual_match, lookup_hash
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
+SEARCH_API_KEY = os.getenv('SEARCH_API_KEY')
+
+# Service endpoints, overridable so the pipeline can run against local stubs
+DRIVE_BASE_URL = os.getenv('DRIVE_BASE_URL', 'https://drive.google.com').rstrip('/')
+SEARCH_API_URL = os.getenv('SEARCH_API_URL', 'https://www.searchapi.io/api/v1/search')
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL')
+
+# Upper bound on images per run; larger folders are processed in chunks (see chunked.py)
+MAX_IMAGES_PER_RUN = int(os.getenv('MAX_IMAGES_PER_RUN', '5000'))
+
+ANALYSIS_MODEL = "claude-3-5-sonnet-20241022"
+
+# Fixed analysis instructions, sent as the system prompt so only the Lens data varies per item.
+# Bump the version whenever the text changes; it is recorded on the 'llm' spans.
+ANALYSIS_PROMPT_VERSION = 2
+ANALYSIS_INSTRUCTIONS = """Analyze product search results and provide structured summary following these guidelines:
+1. Name: If there are multiple listings with same name or almost similar name then the item must be exactly
+the same item as that in image. then assertively say the item: "Name", if the all the names in item listings  are mutually exclusive
+then the first listing is likely the item similar to the image then say item: "likely- first listing item name"
+2.opinion: tell succintly what you know about the item, its collector market and trends.
+3. auctions houses:just say this item was or is listed in this action houses but dont say the prices in there.
+4. dont list marketplace prices, they are summarized separately from the listings.
+5. give all the above bullet points for clear reading.
+6. dont give any introduction like this:"Here's the structured summary:"
+"""
+# Mark the instructions for prompt caching. The API only caches prefixes of at least 1024 tokens
+# (2048 for Haiku), so reads start once the instructions grow past that; shorter ones are billed as usual.
+ANALYSIS_PROMPT_CACHE = os.getenv('ANALYSIS_PROMPT_CACHE', '1') == '1'
+
+def report_error(on_error, message):
+    """Send an error message to the caller's handler (e.g. st.error) or the log"""
+    if on_error:
+        on_error(message)
+    else:
+        logger.error(message)
+
+def get_anthropic_analysis(json_data, on_error=None):
+    """Get analysis from Anthropic API"""
+    analysis, _ = request_anthropic_analysis(json_data, on_error)
+    return analysis
+
+def usage_from_message(message):
+    """Token counts from an Anthropic response, as a plain dict"""
+    usage = {'model': message.model, 'llm_calls': 1}
+    if message.usage:
+        usage.update({
+            'input_tokens': message.usage.input_tokens or 0,
+            'output_tokens': message.usage.output_tokens or 0,
+            'cache_creation_input_tokens': getattr(message.usage, 'cache_creation_input_tokens', None) or 0,
+            'cache_read_input_tokens': getattr(message.usage, 'cache_read_input_tokens', None) or 0,
+        })
+    return usage
+
+def analysis_system_prompt():
+    """System blocks for analysis calls, marking the fixed instructions for prompt caching"""
+    block = {"type": "text", "text": ANALYSIS_INSTRUCTIONS}
+    if ANALYSIS_PROMPT_CACHE:
+        block["cache_control"] = {"type": "ephemeral"}
+    return [block]
+
+def request_anthropic_analysis(json_data, on_error=None, model=ANALYSIS_MODEL, max_tokens=FULL_MAX_TOKENS):
+    """Get analysis from Anthropic API, returning (analysis, usage)
+
+    The response is streamed so the time to its first token can be recorded
+    as llm_ttft_ms.
+    """
+    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL)
+
+    start_time = time.time()
+    try:
+        with provider_slot('llm'), span('llm', model=model, prompt=ANALYSIS_PROMPT_VERSION) as llm_span:
+            request_start = time.time()
+            first_token = None
+            with client.messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                system=analysis_system_prompt(),
+                messages=[{"role": "user", "content": f"Data: {json.dumps(json_data, indent=2)}"}]
+            ) as stream:
+                for _ in stream.text_stream:
+                    if first_token is None:
+                        first_token = time.time()
+                message = stream.get_final_message()
+            usage = usage_from_message(message)
+            llm_span['tokens'] = usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
+            llm_span['cached_tokens'] = usage.get('cache_read_input_tokens', 0)
+        usage['llm_ms'] = int((time.time() - start_time) * 1000)
+        usage['llm_ttft_ms'] = int(((first_token or time.time()) - request_start) * 1000)
+        return (message.content[0].text if message.content else "No analysis generated"), usage
+    except Exception as e:
+        report_error(on_error, f"Analysis error: {str(e)}")
+        return "Analysis failed", {'model': model, 'llm_calls': 1, 'llm_errors': 1,
+                                   'llm_ms': int((time.time() - start_time) * 1000)}
+
+def search_google_lens(image_url, on_error=None):
+    """Search Google Lens for image matches"""
+    try:
+        with provider_slot('lens'), span('lens') as lens_span:
+            response = requests.get(
+                SEARCH_API_URL,
+                params={
+                    "engine": "google_lens",
+                    "url": image_url,
+                    "api_key": SEARCH_API_KEY
+                }
+            )
+            lens_span['bytes'] = len(response.content)
+            if response.status_code != 200:
+                lens_span['outcome'] = f"http_{response.status_code}"
+            return response.json().get("visual_matches", [])[:15]
+    except Exception as e:
+        report_error(on_error, f"Lens search failed: {str(e)}")
+        return []
+
+def extract_file_ids_from_folder(folder_url, on_error=None):
+    """Extract file IDs from Google Drive folder"""
+    try:
+        folder_id = folder_url.split('/')[-1]
+        files_url = f"{DRIVE_BASE_URL}/drive/folders/{folder_id}"
+        with provider_slot('drive'), span('drive_listing') as listing_span:
+            response = requests.get(files_url)
+            listing_span['bytes'] = len(response.content)
+
+        pattern = r"https://drive\.google\.com/file/d/([a-zA-Z0-9_-]+)"
+        # Keep the listing's order so the same folder always yields the same report
+        file_ids = list(dict.fromkeys(re.findall(pattern, response.text)))
+
+        return [{'id': fid, 'url': f"{DRIVE_BASE_URL}/uc?id={fid}", 'name': f"image_{fid}.jpg"} for fid in file_ids]
+    except Exception as e:
+        report_error(on_error, f"Error extracting files: {str(e)}")
+        return []
+
+def download_image(image, work_dir=".", on_error=None):
+    """Fetch a Drive image as a normalized RGB JPEG in work_dir, returning the local path.
+
+    Images already in the disk cache (see image_cache.py) are not downloaded again.
+    """
+    img_path = os.path.join(work_dir, f"temp_{image['id']}.jpg")
+    with span('image_cache') as cache_span:
+        cached = fetch_cached(image, img_path)
+        cache_span['outcome'] = 'hit' if cached else 'miss'
+    if cached:
+        return cached
+
+    with provider_slot('drive'), span('download') as download_span:
+        response = requests.get(image['url'])
+        download_span['bytes'] = len(response.content)
+        if response.status_code != 200:
+            download_span['outcome'] = f"http_{response.status_code}"
+            return None
+
+    with span('decode'):
+        return store_image(image, response.content, img_path)
+
+def process_image(image, mode="analysis", work_dir=".", on_error=None, reuse_prior=None):
+    """Run one image, or one lot of photos (see lots.py), through the pipeline.
+
+    Returns (result, temp_path). result is None when the image could not be
+    downloaded or, in analysis mode, when Lens returned no matches. Images
+    failing the quality gate (see quality.py) skip Lens and the LLM and are
+    returned with the reasons in 'quality'. With reuse_prior (default
+    REUSE_PRIOR_APPRAISALS) the user's recent appraisal of a visually
+    matching image (see visual_index.py) replaces both Lens and the LLM
+    call, and one of an item with near-identical Lens matches replaces the
+    LLM call; reused results say how they matched in 'reuse_match'.
+    Otherwise the item is routed by match agreement (see
+    routing.route_item) to the fast or full model, or skips the LLM when no
+    match is usable.
+    """
+    if reuse_prior is None:
+        reuse_prior = REUSE_PRIOR_APPRAISALS
+    if len(image.get('views') or []) > 1:
+        return process_lot(image, mode, work_dir, on_error, reuse_prior)
+
+    img_path = download_image(image, work_dir, on_error)
+    if not img_path:
+        return None, None
+    return analyze_image(image, img_path, mode, on_error, reuse_prior)
+
+def process_lot(lot, mode, work_dir, on_error, reuse_prior):
+    """Appraise the views of one lot as a single item.
+
+    Every view is downloaded and scored; the sharpest view passing the
+    quality gate is searched with Lens and analyzed once. The other views
+    are returned in the result's 'view_paths' so reports show them in the
+    same row.
+    """
+    downloaded = [(view, download_image(view, work_dir, on_error)) for view in lot['views']]
+    downloaded = [(view, path) for view, path in downloaded if path]
+    if not downloaded:
+        return None, None
+
+    scored = []
+    for idx, (view, path) in enumerate(downloaded):
+        problems, metrics = check_image_quality(path) if mode != "basic" else ([], None)
+        sharpness = metrics['sharpness'] if metrics else 0.0
+        # Passing views first, then the sharpest; ties keep the folder order
+        scored.append(((bool(problems), -sharpness, idx), view, path, problems))
+    _, best_view, best_path, problems = min(scored, key=lambda entry: entry[0])
+    view_paths = [path for view, path in downloaded if path != best_path]
+
+    result = img_path = None
+    try:
+        result, img_path = analyze_image(best_view, best_path, mode, on_error, reuse_prior, problems)
+    finally:
+        # The other views only outlive this call inside a result, and the analyzed one
+        # is left to the caller unless analyze_image raised
+        if result is None:
+            for path in view_paths if img_path else view_paths + [best_path]:
+                os.remove(path)
+    if result is None:
+        return None, img_path
+    record_usage(best_view['id'], views=len(downloaded))
+    result.update(views=[view['name'] for view, _ in downloaded], view_paths=view_paths)
+    return result, img_path
+
+def remember_visually(image, lens_results, analysis, model, value):
+    """Store an appraisal and add its image hash (if any) to the visual index"""
+    appraisal_id = remember_appraisal(image, lens_results, analysis, model, value)
+    if appraisal_id and value is not None:
+        add_to_visual_index(value, appraisal_id, current_run().get('username'))
+
+def analyze_image(image, img_path, mode, on_error=None, reuse_prior=REUSE_PRIOR_APPRAISALS, problems=None):
+    """The pipeline stages after download; see process_image. problems skips the quality check when given"""
+    if mode == "basic":
+        return {'item_id': image['id'], 'name': image['name'], 'temp_image_path': img_path, 'analysis': ''}, img_path
+
+    if problems is None:
+        problems, _ = check_image_quality(img_path)
+    if problems:
+        record_usage(image['id'], name=image['name'], quality_rejected=1)
+        return {'item_id': image['id'], 'name': image['name'], 'temp_image_path': img_path, 'prices': [],
+                'analysis': quality_analysis(problems), 'quality': ", ".join(problems)}, img_path
+
+    # Every appraisal is indexed by its hash, so hash the image even when not reusing
+    value = lookup_hash(img_path)
+    username = current_run().get('username')
+    visual = find_visual_match(value, username) if reuse_prior and value is not None else None
+    if visual:
+        record_usage(image['id'], name=image['name'], cache_hits=1)
+        return {'item_id': image['id'], 'name': image['name'], 'temp_image_path': img_path,
+                'prices': price_records(visual['lens_results']), 'analysis': visual['analysis'],
+                'reused_from': visual['created_at'],
+                'reuse_match': f"photo, {visual['distance']} of 64 bits differ"}, img_path
+
+    lens_results = search_google_lens(image['url'], on_error)
+    record_usage(image['id'], name=image['name'], lens_calls=1)
+    if not lens_results:
+        return None, img_path
+
+    # Listing prices are summarized locally (see prices.py); the LLM only gives the opinion
+    result = {'item_id': image['id'], 'name': image['name'], 'temp_image_path': img_path,
+              'prices': price_records(lens_results)}
+
+    prior = find_prior_appraisal(image, lens_results) if reuse_prior else None
+    if prior:
+        record_usage(image['id'], cache_hits=1)
+        result.update(analysis=prior['analysis'], reused_from=prior['created_at'],
+                      reuse_match=f"listing titles, {prior['similarity']:.0%} similar")
+        # Index this photo under the reused appraisal (if it has none yet), so the user's later runs
+        # find it without a Lens call; reuse never stores another appraisal
+        if value is not None and remember_appraisal_image(prior, lens_results, value):
+            add_to_visual_index(value, prior['appraisal_id'], username)
+        return result, img_path
+
+    route, model, max_tokens, confidence = route_item(lens_results, ANALYSIS_MODEL)
+    result['match_confidence'] = confidence
+    if route == 'skipped':
+        record_usage(image['id'], route=route)
+        result['analysis'] = SKIPPED_ANALYSIS
+        return result, img_path
+
+    analysis, usage = request_anthropic_analysis(without_prices(lens_results), on_error, model, max_tokens)
+    record_usage(image['id'], route=route, **usage)
+    if not usage.get('llm_errors'):
+        remember_visually(image, lens_results, analysis, usage.get('model'), value)
+    result['analysis'] = analysis
+    return result, img_path
+
+def create_basic_report(images, on_error=None):
+    """Create report data without API processing and analysis"""
+    results = []
+    temp_files = []
+
+    for image in images:
+        try:
+            result, img_path = process_image(image, "basic", on_error=on_error)
+            if img_path:
+                temp_files.append(img_path)
+            if result:
+                results.append(result)
+        except Exception as e:
+            report_error(on_error, f"Basic processing error: {str(e)}")
+
+    return results, temp_files
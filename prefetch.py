@@ -0,0 +1,107 @@
+"""Speculative folder prefetch for the Streamlit app.
+
+As soon as a Drive folder URL is entered, FolderPrefetch lists the folder,
+checks the user's image quota and downloads the first PREFETCH_MAX_IMAGES
+images into the disk image cache (see image_cache.py) on a few background
+threads. When the user clicks a process button the run reuses the listing
+and its downloads become cache hits. Prefetching stops when it is cancelled
+(the URL changes or the run starts) or after PREFETCH_TIMEOUT_SECONDS.
+"""
+import os
+import re
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import get_user_limits
+from pipeline import MAX_IMAGES_PER_RUN, extract_file_ids_from_folder, download_image
+from telemetry import run_context, span, submit_with_context
+from scheduler import tenant
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Images downloaded ahead of a click; the rest are fetched by the run itself
+PREFETCH_MAX_IMAGES = int(os.getenv('PREFETCH_MAX_IMAGES', '100'))
+PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', '2'))
+PREFETCH_TIMEOUT_SECONDS = float(os.getenv('PREFETCH_TIMEOUT_SECONDS', '300'))
+
+FOLDER_URL_PATTERN = re.compile(r"/folders/[a-zA-Z0-9_-]+/?$")
+
+def is_folder_url(url):
+    return bool(url) and bool(FOLDER_URL_PATTERN.search(url.split('?')[0]))
+
+class FolderPrefetch:
+    """Background listing, quota check and image download for one folder URL"""
+
+    def __init__(self, folder_url, username, max_images=PREFETCH_MAX_IMAGES, concurrency=PREFETCH_CONCURRENCY,
+                 timeout=PREFETCH_TIMEOUT_SECONDS):
+        self.folder_url = folder_url
+        self.username = username
+        self.max_images = max_images
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.images = None
+        self.quota_error = None
+        self.downloaded = 0
+        self.lock = threading.Lock()
+        self.listed = threading.Event()
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="folder-prefetch", daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        work_dir = tempfile.mkdtemp(prefix="prefetch_")
+        try:
+            # Speculative downloads queue behind the provider calls of every run
+            with run_context(f"prefetch-{id(self):x}", self.username), tenant(self.username, 'speculative'), \
+                    span('prefetch') as prefetch_span:
+                self.images = extract_file_ids_from_folder(self.folder_url)
+                self.listed.set()
+                current_count, max_allowed = get_user_limits(self.username)
+                if current_count + len(self.images) > max_allowed:
+                    self.quota_error = f"Image limit exceeded: {current_count + len(self.images)}/{max_allowed}"
+                    return
+                self.download(self.images[:min(self.max_images, MAX_IMAGES_PER_RUN)], work_dir)
+                prefetch_span['items'] = self.downloaded
+                if self.cancelled.is_set():
+                    prefetch_span['outcome'] = 'cancelled'
+        except Exception as e:
+            logger.warning(f"Prefetch of {self.folder_url} failed: {str(e)}")
+        finally:
+            self.listed.set()
+            self.done.set()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def download(self, images, work_dir):
+        deadline = time.monotonic() + self.timeout
+
+        def fetch(image):
+            if self.cancelled.is_set() or time.monotonic() > deadline:
+                return
+            path = download_image(image, work_dir)
+            if path:
+                # Only the cached copy is kept for the run
+                os.remove(path)
+                with self.lock:
+                    self.downloaded += 1
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for image in images:
+                submit_with_context(executor, fetch, image)
+
+    def listing(self, timeout=None):
+        """The folder's images once listed, or None if listing failed or timed out"""
+        if not self.listed.wait(timeout):
+            return None
+        return self.images
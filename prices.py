@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# Retail marketplaces reported separately; any other seller is grouped as "Other"
+MARKETPLACES = [
+    ('ebay', "eBay"),
+    ('etsy', "Etsy"),
+    ('amazon', "Amazon"),
+    ('walmart', "Walmart"),
+    ('macy', "Macy's"),
+]
+
+# Auction results are mentioned by the LLM but their prices are left out of the stats
+AUCTION_HOUSES = ('liveauctioneers', 'invaluable', 'worthpoint', 'bidsquare', 'hibid',
+                  'christie', 'sotheby', 'bonhams', 'heritage', 'auction')
+
+PRICE_PATTERN = r'(\d[\d,]*(?:\.\d+)?)'
+
+STAT_COLUMNS = ['count', 'min', 'median', 'max']
+
+def price_records(lens_results):
+    """Compact price fields from Lens visual matches, kept on each result for report-time stats"""
+    records = []
+    for match in lens_results:
+        price = match.get('price')
+        if not price:
+            continue
+        if not isinstance(price, dict):
+            price = {'value': str(price)}
+        records.append({
+            'source': match.get('source', ''),
+            'value': price.get('value'),
+            'extracted_value': price.get('extracted_value'),
+            'currency': price.get('currency'),
+        })
+    return records
+
+def without_prices(lens_results):
+    """Visual matches with price fields removed, for the LLM which no longer reports prices"""
+    return [{key: value for key, value in match.items() if key != 'price'} for match in lens_results]
+
+def price_frame(results):
+    """One row per priced listing across all results, with numeric price and marketplace"""
+    rows = [dict(record, item=idx) for idx, result in enumerate(results)
+            for record in result.get('prices') or []]
+    if not rows:
+        return pd.DataFrame(columns=['item', 'marketplace', 'price', 'currency'])
+
+    df = pd.DataFrame(rows)
+    parsed = pd.to_numeric(
+        df['value'].astype('string').str.extract(PRICE_PATTERN, expand=False).str.replace(',', '', regex=False),
+        errors='coerce')
+    df['price'] = pd.to_numeric(df['extracted_value'], errors='coerce').fillna(parsed)
+
+    source = df['source'].fillna('').astype(str).str.lower()
+    auction = source.str.contains('|'.join(AUCTION_HOUSES), regex=True)
+    df['marketplace'] = np.select([source.str.contains(key, regex=False) for key, _ in MARKETPLACES],
+                                  [name for _, name in MARKETPLACES], default="Other")
+    df['currency'] = df['currency'].fillna('$').replace({'USD': '$'})
+
+    df = df[~auction & df['price'].gt(0)]
+    return df[['item', 'marketplace', 'price', 'currency']]
+
+def price_statistics(results):
+    """Listing count, min, median and max price per item/marketplace and per marketplace for the folder.
+
+    Returns (item_stats, folder_stats) DataFrames indexed by
+    (item, marketplace, currency) and (marketplace, currency).
+    """
+    df = price_frame(results)
+    if df.empty:
+        empty_item = pd.DataFrame(columns=STAT_COLUMNS, index=pd.MultiIndex.from_arrays(
+            [[], [], []], names=['item', 'marketplace', 'currency']))
+        empty_folder = pd.DataFrame(columns=STAT_COLUMNS, index=pd.MultiIndex.from_arrays(
+            [[], []], names=['marketplace', 'currency']))
+        return empty_item, empty_folder
+
+    item_stats = df.groupby(['item', 'marketplace', 'currency'])['price'].agg(STAT_COLUMNS)
+    folder_stats = df.groupby(['marketplace', 'currency'])['price'].agg(STAT_COLUMNS)
+    return item_stats, folder_stats
+
+def format_price(value, currency='$'):
+    return f"{currency}{value:,.2f}"
+
+def format_item_prices(item_stats, item_index):
+    """One line per marketplace for a result, e.g. 'eBay: 4 listings, $12.00–$30.00 (median $18.50)'"""
+    if item_index not in item_stats.index.get_level_values('item'):
+        return []
+    lines = []
+    for (marketplace, currency), row in item_stats.loc[item_index].iterrows():
+        count = int(row['count'])
+        if count == 1:
+            lines.append(f"{marketplace}: 1 listing, {format_price(row['median'], currency)}")
+        else:
+            lines.append(f"{marketplace}: {count} listings, {format_price(row['min'], currency)}–"
+                         f"{format_price(row['max'], currency)} (median {format_price(row['median'], currency)})")
+    return lines
+
+def folder_summary_rows(folder_stats):
+    """Folder-level stats as display rows: marketplace, listings, min, median, max"""
+    return [[marketplace, int(row['count']), format_price(row['min'], currency),
+             format_price(row['median'], currency), format_price(row['max'], currency)]
+            for (marketplace, currency), row in folder_stats.iterrows()]
@@ -0,0 +1,225 @@
+"""Opt-in profiling of runs, switched on by admins at runtime.
+
+While profiling is on (for everyone or for chosen users), profiled_run()
+wraps a run in cProfile, including the pool tasks it submits with
+telemetry.submit_with_context, samples the stacks of those threads every
+PROFILE_SAMPLE_MS and records the tracemalloc peak. The results are stored
+under PROFILES_DIR and listed in the run_profiles table:
+
+    profile.prof    cProfile stats of all the run's threads (snakeviz, pstats)
+    samples.folded  sampled stacks in folded format (flamegraph.pl, speedscope)
+    summary.txt     timings, memory peak, top functions and allocation sites
+
+CPU time and memory are process-wide, so runs profiled at the same time
+share them.
+"""
+import os
+import io
+import sys
+import time
+import json
+import pstats
+import shutil
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from database import get_setting, set_setting, save_run_profile, delete_old_run_profiles
+from telemetry import current_profile, profile_context
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = os.getenv('PROFILES_DIR', '/var/lib/estateai/profiles')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_MS', '10')) / 1000
+PROFILE_RETENTION_DAYS = int(os.getenv('PROFILE_RETENTION_DAYS', '14'))
+# Frames kept per allocation; the summary groups by line, and every extra frame slows runs down further
+PROFILE_TRACE_FRAMES = 1
+PROFILE_TOP_ENTRIES = 30
+
+# Profiled runs in progress; tracemalloc is stopped when the last one ends
+_tracing_runs = 0
+_tracing_lock = threading.Lock()
+
+PROFILE_FILES = {
+    'profile.prof': "application/octet-stream",
+    'samples.folded': "text/plain",
+    'summary.txt': "text/plain",
+}
+
+def profiling_setting():
+    """(enabled, usernames); an empty usernames list profiles every user"""
+    setting = json.loads(get_setting('profiling', '{}'))
+    return bool(setting.get('enabled')), setting.get('users', [])
+
+def set_profiling(enabled, usernames=()):
+    return set_setting('profiling', json.dumps({'enabled': bool(enabled), 'users': list(usernames)}))
+
+def profiling_enabled(username):
+    enabled, usernames = profiling_setting()
+    return enabled and (not usernames or username in usernames)
+
+def folded_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class ProfileSession:
+    """Profiles and stack samples collected from every thread working on one run"""
+
+    def __init__(self, run_id, kind, username):
+        self.run_id = run_id
+        self.kind = kind
+        self.username = username
+        self.stats = None
+        self.samples = Counter()
+        self.threads = Counter()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name=f"profile-sampler-{run_id[:8]}", daemon=True)
+
+    def add_profile(self, profiler):
+        with self.lock:
+            try:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profiler)
+                else:
+                    self.stats.add(profiler)
+            except TypeError:
+                pass  # the profiler recorded nothing
+
+    @contextmanager
+    def track(self):
+        """Sample the current thread while in this block"""
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.threads[thread_id] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.threads[thread_id] -= 1
+                if not self.threads[thread_id]:
+                    del self.threads[thread_id]
+
+    def run_task(self, fn, *args, **kwargs):
+        """Run a pool task under its own profiler; cProfile only sees the thread it runs in"""
+        profiler = cProfile.Profile()
+        with self.track():
+            profiler.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self.add_profile(profiler)
+
+    def sample(self):
+        while not self.stopped.wait(PROFILE_SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with self.lock:
+                thread_ids = list(self.threads)
+            stacks = [folded_stack(frames[thread_id]) for thread_id in thread_ids if thread_id in frames]
+            with self.lock:
+                self.samples.update(stacks)
+
+    def summary(self, wall_seconds, cpu_seconds, peak_bytes, snapshot):
+        text = io.StringIO()
+        text.write(f"Run {self.run_id} ({self.kind}) of {self.username}\n")
+        text.write(f"Wall time: {wall_seconds:.2f}s, process CPU time: {cpu_seconds:.2f}s, "
+                   f"traced memory peak: {peak_bytes / 1e6:.1f} MB, "
+                   f"stack samples: {sum(self.samples.values())} every {PROFILE_SAMPLE_INTERVAL * 1000:g} ms\n")
+        if self.stats is not None:
+            for order in ('cumulative', 'tottime'):
+                text.write(f"\n== Top functions by {order} ==\n")
+                self.stats.stream = text
+                self.stats.sort_stats(order).print_stats(PROFILE_TOP_ENTRIES)
+
+        text.write("\n== Most sampled functions (self) ==\n")
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        for leaf, count in leaves.most_common(PROFILE_TOP_ENTRIES):
+            text.write(f"{count:8d}  {leaf}\n")
+
+        if snapshot is not None:
+            text.write("\n== Top allocation sites still held at the end ==\n")
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ENTRIES]:
+                text.write(f"{stat}\n")
+        return text.getvalue()
+
+    def save(self, wall_seconds, cpu_seconds, peak_bytes, snapshot):
+        profile_dir = os.path.join(PROFILES_DIR, f"{self.run_id}-{self.kind}")
+        os.makedirs(profile_dir, exist_ok=True)
+        if self.stats is not None:
+            self.stats.dump_stats(os.path.join(profile_dir, 'profile.prof'))
+        with open(os.path.join(profile_dir, 'samples.folded'), 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(profile_dir, 'summary.txt'), 'w') as f:
+            f.write(self.summary(wall_seconds, cpu_seconds, peak_bytes, snapshot))
+        save_run_profile(self.run_id, self.kind, self.username, wall_seconds, cpu_seconds, peak_bytes, profile_dir)
+        logger.info(f"Saved {self.kind} profile of run {self.run_id} to {profile_dir}")
+
+def start_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        if not _tracing_runs and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        _tracing_runs += 1
+        tracemalloc.reset_peak()
+
+def stop_tracing():
+    """(peak bytes, snapshot) of the traced memory, stopping tracing after the last profiled run"""
+    global _tracing_runs
+    with _tracing_lock:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        _tracing_runs -= 1
+        if not _tracing_runs:
+            tracemalloc.stop()
+    return peak_bytes, snapshot
+
+@contextmanager
+def profiled_run(run_id, username, kind='run'):
+    """Profile the block if profiling is on for username; yields the ProfileSession or None"""
+    if current_profile() is not None or not profiling_enabled(username):
+        yield None
+        return
+
+    session = ProfileSession(run_id, kind, username)
+    start_tracing()
+    session.sampler.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    profiler = cProfile.Profile()
+    try:
+        with profile_context(session), session.track():
+            profiler.enable()
+            try:
+                yield session
+            finally:
+                profiler.disable()
+    finally:
+        wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        session.stopped.set()
+        session.sampler.join()
+        session.add_profile(profiler)
+        peak_bytes, snapshot = stop_tracing()
+        try:
+            session.save(wall_seconds, cpu_seconds, peak_bytes, snapshot)
+        except Exception as e:
+            logger.error(f"Could not save the profile of run {run_id}: {str(e)}")
+
+def read_profile_file(profile_dir, name):
+    with open(os.path.join(profile_dir, name), 'rb') as f:
+        return f.read()
+
+def prune_profiles(days=PROFILE_RETENTION_DAYS):
+    """Delete profiles older than days, returning how many"""
+    profile_dirs = delete_old_run_profiles(days)
+    for profile_dir in profile_dirs:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    return len(profile_dirs)
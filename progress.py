@@ -0,0 +1,132 @@
+import time
+import queue
+import contextvars
+from contextlib import contextmanager
+
+# Channel and item the current worker thread is publishing for
+_channel = contextvars.ContextVar('progress_channel', default=None)
+_item = contextvars.ContextVar('progress_item', default=None)
+
+class ProgressChannel:
+    """Thread-safe channel of progress events published by pipeline workers.
+
+    Events are dicts with 'type' (started, stage, finished, skipped, error),
+    'item', 'time' and any extra fields.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def publish(self, event_type, item=None, **fields):
+        self.events.put({'type': event_type, 'item': item, 'time': time.time(), **fields})
+
+    def drain(self):
+        """Return every event published since the last drain"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def error_handler(self):
+        """on_error callback that publishes errors for the current item"""
+        return lambda message: self.publish('error', _item.get(), message=message)
+
+@contextmanager
+def bind(channel, item_id):
+    """Publish stage events for item_id from pipeline code run in this block"""
+    channel_token = _channel.set(channel)
+    item_token = _item.set(item_id)
+    try:
+        yield
+    finally:
+        _item.reset(item_token)
+        _channel.reset(channel_token)
+
+def publish_stage(stage):
+    """Report that the current item entered a pipeline stage (no-op outside bind())"""
+    channel = _channel.get()
+    if channel is not None:
+        channel.publish('stage', _item.get(), stage=stage)
+
+def run_item(channel, item_id, fn, *args, **kwargs):
+    """Call fn for one item, publishing started/finished/skipped/error events around it"""
+    channel.publish('started', item_id)
+    with bind(channel, item_id):
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            channel.publish('error', item_id, message=f"Image processing error: {str(e)}", final=True)
+            raise
+    outcome = result[0] if isinstance(result, tuple) else result
+    channel.publish('finished' if outcome else 'skipped', item_id)
+    return result
+
+class ProgressTracker:
+    """Aggregate progress events into counts, active stages and an ETA.
+
+    The ETA uses an exponentially weighted moving average of the interval
+    between completions, so it reflects overall throughput when several
+    items are processed in parallel.
+    """
+
+    def __init__(self, total, alpha=0.3):
+        self.total = total
+        self.alpha = alpha
+        self.start_time = time.time()
+        self.last_completion = self.start_time
+        self.interval = None
+        self.done = 0
+        self.finished = 0
+        self.failed = 0
+        self.active = {}
+        self.errors = []
+
+    def apply(self, events):
+        for event in events:
+            item = event['item']
+            if event['type'] == 'started':
+                self.active[item] = 'starting'
+            elif event['type'] == 'stage':
+                if item in self.active:
+                    self.active[item] = event['stage']
+            elif event['type'] == 'error':
+                self.errors.append(event['message'])
+                if event.get('final'):
+                    self.complete(item, event['time'], failed=True)
+            elif event['type'] in ('finished', 'skipped'):
+                self.complete(item, event['time'], failed=event['type'] == 'skipped')
+
+    def complete(self, item, when, failed=False):
+        self.active.pop(item, None)
+        self.done += 1
+        if failed:
+            self.failed += 1
+        else:
+            self.finished += 1
+        interval = max(when - self.last_completion, 0.0)
+        self.last_completion = when
+        self.interval = interval if self.interval is None else self.alpha * interval + (1 - self.alpha) * self.interval
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    @property
+    def fraction(self):
+        return self.done / self.total if self.total else 1.0
+
+    def eta_seconds(self):
+        """Estimated seconds remaining, or None before the first completion"""
+        if self.interval is None:
+            return None
+        remaining = self.total - self.done
+        # Time already spent waiting since the last completion counts toward the next one
+        return max(remaining * self.interval - (time.time() - self.last_completion), 0.0)
+
+    def stage_counts(self):
+        counts = {}
+        for stage in self.active.values():
+            counts[stage] = counts.get(stage, 0) + 1
+        return counts
@@ -0,0 +1,103 @@
+"""Image quality gate run on every downloaded image before the paid stages.
+
+Drive folders hold lot-number cards, blurry shots and near-black frames
+that cost a Lens and an LLM call each only to come back as garbage. The
+gate scores a small grayscale copy of the image with NumPy:
+
+    sharpness   variance of the Laplacian (low when blurred)
+    brightness  mean gray level (near 0 or 255 when under- or overexposed)
+    entropy     Shannon entropy of the gray histogram in bits (low for
+                blank frames and printed cards)
+
+Images failing any threshold skip Lens and the LLM and are flagged in the
+report. Thresholds are set with the QUALITY_* environment variables;
+QUALITY_GATE_ENABLED=0 turns the gate off.
+
+image_hash() gives the 64-bit difference hash used to compare photos (see
+lots.py); near-identical images differ in only a few bits.
+"""
+import os
+import logging
+import numpy as np
+from PIL import Image
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+QUALITY_GATE_ENABLED = os.getenv('QUALITY_GATE_ENABLED', '1') == '1'
+# Longest side of the copy that is scored; the thresholds below assume this size
+QUALITY_SIDE = 512
+QUALITY_MIN_SHARPNESS = float(os.getenv('QUALITY_MIN_SHARPNESS', '20'))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv('QUALITY_MIN_BRIGHTNESS', '20'))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv('QUALITY_MAX_BRIGHTNESS', '245'))
+QUALITY_MIN_ENTROPY = float(os.getenv('QUALITY_MIN_ENTROPY', '3.0'))
+
+# Side of the grid image_hash() compares neighbouring pixels on
+HASH_SIDE = 8
+
+def image_quality(path):
+    """Sharpness, brightness and entropy of an image file, scored on a QUALITY_SIDE grayscale copy"""
+    with Image.open(path) as img:
+        # JPEGs decode straight to a reduced grayscale size, which is most of the cost
+        img.draft('L', (QUALITY_SIDE, QUALITY_SIDE))
+        gray = img.convert('L')
+    gray.thumbnail((QUALITY_SIDE, QUALITY_SIDE))
+    levels = np.asarray(gray)
+    pixels = levels.astype(np.float32)
+
+    laplacian = (pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+                 - 4 * pixels[1:-1, 1:-1])
+    histogram = np.bincount(levels.ravel(), minlength=256) / levels.size
+    histogram = histogram[histogram > 0]
+    return {
+        'sharpness': round(float(laplacian.var()), 1),
+        'brightness': round(float(pixels.mean()), 1),
+        'entropy': round(float(-(histogram * np.log2(histogram)).sum()), 2),
+    }
+
+def image_hash(path):
+    """64-bit difference hash: whether each pixel of a 9x8 grayscale copy is brighter than its right neighbour"""
+    with Image.open(path) as img:
+        img.draft('L', (HASH_SIDE * 8, HASH_SIDE * 8))
+        gray = img.convert('L').resize((HASH_SIDE + 1, HASH_SIDE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hash_distance(a, b):
+    """Number of differing bits between two image hashes"""
+    return bin(a ^ b).count('1')
+
+def quality_problems(metrics):
+    """Why an image fails the gate, as a list of short reasons (empty when it passes)"""
+    problems = []
+    if metrics['brightness'] < QUALITY_MIN_BRIGHTNESS:
+        problems.append("too dark")
+    elif metrics['brightness'] > QUALITY_MAX_BRIGHTNESS:
+        problems.append("too bright")
+    if metrics['entropy'] < QUALITY_MIN_ENTROPY:
+        problems.append("no visible item")
+    elif metrics['sharpness'] < QUALITY_MIN_SHARPNESS:
+        # Blank frames have no edges either; only call an image blurry when it has content
+        problems.append("blurry")
+    return problems
+
+def check_image_quality(path):
+    """(problems, metrics) for a downloaded image; unreadable images and a disabled gate pass"""
+    if not QUALITY_GATE_ENABLED:
+        return [], None
+    with span('quality') as quality_span:
+        try:
+            metrics = image_quality(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not score image {path}: {str(e)}")
+            quality_span['outcome'] = 'unreadable'
+            return [], None
+        problems = quality_problems(metrics)
+        quality_span['outcome'] = 'rejected' if problems else 'ok'
+        return problems, metrics
+
+def quality_analysis(problems):
+    """Report text for an image the gate rejected"""
+    return (f"Image quality check failed ({', '.join(problems)}). "
+            "This image was not searched or analyzed; check the photo and process it again if needed.")
@@ -0,0 +1,448 @@
+import os
+import json
+import hashlib
+import logging
+from io import BytesIO
+from datetime import datetime
+from PIL import Image
+import openpyxl
+from openpyxl.drawing.image import Image as XLImage
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Image as PDFImage, Paragraph, Spacer
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib import colors
+from reportlab.lib.units import mm
+from database import get_report_artifact, save_report_artifact, touch_report_artifact
+from pipeline import report_error
+from prices import price_statistics, format_item_prices, folder_summary_rows
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = os.getenv('REPORTS_DIR', '/var/lib/estateai/reports')
+
+# Bump whenever the report layout changes so older renders are not reused
+REPORT_TEMPLATE_VERSION = 4
+
+# Embedded images are resampled to this resolution at their display size and re-encoded
+REPORT_IMAGE_DPI = int(os.getenv('REPORT_IMAGE_DPI', '150'))
+REPORT_JPEG_QUALITY = int(os.getenv('REPORT_JPEG_QUALITY', '75'))
+
+# Display box of item images: points in the PDF, 96 DPI pixels in the workbook
+PDF_IMAGE_BOX = 150
+EXCEL_IMAGE_BOX = 200
+# Other photos of a lot (see lots.py) are shown smaller, several per row
+PDF_VIEW_BOX = 48
+EXCEL_VIEW_BOX = 96
+
+PRICE_SUMMARY_HEADERS = ["Marketplace", "Listings", "Min", "Median", "Max"]
+
+def report_thumbnail(image_path, box, units_per_inch):
+    """Resample an image for embedding in a box x box display area.
+
+    Returns (jpeg, width, height): the JPEG as a file object holding just
+    enough pixels for REPORT_IMAGE_DPI, and its display size in box units
+    with the aspect ratio kept.
+    """
+    pixels = max(1, round(box / units_per_inch * REPORT_IMAGE_DPI))
+    with Image.open(image_path) as img:
+        scale = box / max(img.width, img.height)
+        width, height = img.width * scale, img.height * scale
+        # Let the JPEG decoder scale down while decoding instead of decoding full size
+        img.draft('RGB', (pixels, pixels))
+        thumbnail = img.convert('RGB')
+    thumbnail.thumbnail((pixels, pixels), Image.LANCZOS)
+    jpeg = BytesIO()
+    thumbnail.save(jpeg, 'JPEG', quality=REPORT_JPEG_QUALITY, optimize=True)
+    jpeg.seek(0)
+    return jpeg, width, height
+
+def item_thumbnail(image_path, box, units_per_inch, on_error=None):
+    """report_thumbnail of a result's photo, or None when it was not stored or cannot be read"""
+    if not image_path or not os.path.exists(image_path):
+        return None
+    try:
+        return report_thumbnail(image_path, box, units_per_inch)
+    except (OSError, ValueError) as e:
+        report_error(on_error, f"Image error: {str(e)}")
+        return None
+
+def pdf_view_strip(view_paths, on_error=None):
+    """Table of small thumbnails of a lot's other photos for the image cell of its row, or None"""
+    per_row = int(PDF_IMAGE_BOX // PDF_VIEW_BOX)
+    images = []
+    for path in view_paths:
+        thumbnail = item_thumbnail(path, PDF_VIEW_BOX, 72, on_error)
+        if thumbnail:
+            jpeg, width, height = thumbnail
+            images.append(PDFImage(jpeg, width=width, height=height))
+    if not images:
+        return None
+    rows = [images[start:start + per_row] for start in range(0, len(images), per_row)]
+    rows[-1] += [""] * (per_row - len(rows[-1]))
+    strip = Table(rows, colWidths=[PDF_VIEW_BOX + 2] * per_row)
+    strip.setStyle(TableStyle([('LEFTPADDING', (0, 0), (-1, -1), 1), ('RIGHTPADDING', (0, 0), (-1, -1), 1)]))
+    return strip
+
+def create_pdf_report(results, output_file, on_error=None, price_stats=None):
+    """Create PDF report with images and analyses - modified for two columns"""
+    item_prices, folder_prices = price_stats or price_statistics(results)
+
+    class CustomDocTemplate(SimpleDocTemplate):
+        def __init__(self, filename, **kwargs):
+            super().__init__(filename, **kwargs)
+            self.topMargin = 15*mm
+            self.leftMargin = 25*mm
+    
+    doc = CustomDocTemplate(output_file, pagesize=A4)
+    elements = []
+    styles = getSampleStyleSheet()
+    
+    # Create custom style for analysis text with increased line spacing
+    analysis_style = styles['BodyText']
+    analysis_style.leading = 20  # Increase line spacing (default is usually around 12-14)
+    
+    # Create custom styles
+    header_style = styles['Title']
+    header_style.spaceAfter = 5
+    
+    contact_style = styles['Normal']
+    contact_style.fontSize = 9
+    contact_style.leading = 11
+    contact_style.textColor = colors.gray
+    
+    tagline_style = styles['Normal']
+    tagline_style.alignment = 1  # Center alignment
+    tagline_style.fontSize = 11
+    tagline_style.leading = 14
+    tagline_style.spaceAfter = 20
+    
+    # Create header table with title and contact info
+    header_style.textColor = colors.HexColor('#D97757')  # Set title color
+    header_style.alignment = 1  # Center alignment
+    
+    # Contact info in the right column
+    contact_info = [
+        [Paragraph("Email: maggie@estategeniusai.com", contact_style)],
+        [Paragraph("Mobile: (+1)469-659-7089", contact_style)],
+        [Paragraph("Website: www.estategeniusai.com", contact_style)]
+    ]
+    
+    # Title and taglines in the center column
+    title_content = [
+        [Paragraph("EstateGenius AI", header_style)],
+        [Paragraph("Your Pricing Partner", tagline_style)],
+        [Paragraph("Saves Hours of Internet Search", tagline_style)],
+        [Paragraph("We Customize AI According to Your Needs", tagline_style)]
+    ]
+    
+    # Create tables for each section
+    contact_table = Table(contact_info, colWidths=[200])
+    title_table = Table(title_content, colWidths=[300])
+    
+    # Style the tables
+    contact_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    
+    title_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    
+    # Create a table for the header layout
+    header_layout = Table([
+        ['', title_table, contact_table]
+    ], colWidths=[20, 300, 200])  # Added small left margin
+    
+    header_layout.setStyle(TableStyle([
+        ('ALIGN', (1, 0), (1, 0), 'CENTER'),  # Center title
+        ('ALIGN', (2, 0), (2, 0), 'RIGHT'),   # Right align contact
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    
+    elements.append(header_layout)
+    elements.append(Spacer(1, 20))
+
+    # Modified table with only two columns
+    data = [["Image", "Analysis"]]  # Changed headers
+    for idx, result in enumerate(results):
+        try:
+            thumbnail = item_thumbnail(result.get('temp_image_path'), PDF_IMAGE_BOX, 72, on_error)
+            if thumbnail:
+                jpeg, width, height = thumbnail
+                img = PDFImage(jpeg, width=width, height=height)
+            else:
+                img = Paragraph("Image unavailable", analysis_style)
+            strip = pdf_view_strip(result.get('view_paths') or [], on_error)
+            if strip:
+                img = [img, Spacer(1, 4), strip]
+            # Analysis followed by the locally computed listing prices
+            analysis = [Paragraph(result['analysis'], analysis_style)]
+            price_lines = format_item_prices(item_prices, idx)
+            if price_lines:
+                analysis.append(Paragraph("<b>Listing prices</b><br/>" + "<br/>".join(price_lines), analysis_style))
+            row = [
+                img,
+                analysis
+            ]
+            data.append(row)
+        except Exception as e:
+            report_error(on_error, f"PDF error: {str(e)}")
+
+    # Adjusted column widths for two columns
+    table = Table(data, colWidths=[160, 420])  # Increased width for analysis column
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.grey),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('FONTSIZE', (0,0), (-1,0), 12),
+        ('BOTTOMPADDING', (0,0), (-1,0), 12),
+        ('BACKGROUND', (0,1), (-1,-1), colors.beige),
+        ('GRID', (0,0), (-1,-1), 1, colors.black),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('ALIGN', (1,1), (1,-1), 'LEFT'),  # Left align analysis text
+    ]))
+
+    elements.append(table)
+
+    if not folder_prices.empty:
+        elements.append(Spacer(1, 20))
+        elements.append(Paragraph("Listing Prices Across All Items", styles['Heading2']))
+        summary = Table([PRICE_SUMMARY_HEADERS] + folder_summary_rows(folder_prices),
+                        colWidths=[160, 80, 110, 110, 110])
+        summary.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.grey),
+            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+            ('GRID', (0,0), (-1,-1), 1, colors.black),
+            ('ALIGN', (1,0), (-1,-1), 'RIGHT'),
+        ]))
+        elements.append(summary)
+
+    try:
+        doc.build(elements)
+        return True
+    except Exception as e:
+        report_error(on_error, f"PDF creation failed: {str(e)}")
+        return False
+
+def create_excel_report(results, output_file, on_error=None, price_stats=None):
+    """Create Excel report with images and analyses - modified for two columns"""
+    item_prices, folder_prices = price_stats or price_statistics(results)
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    
+    # Add contact information (top left)
+    ws['A1'] = "Email: maggie@estategeniusai.com"
+    ws['A2'] = "Mobile: (+)469-659-7089"
+    ws['A3'] = "Website: www.estategeniusai.com"
+    
+    # Style contact info
+    for cell in [ws['A1'], ws['A2'], ws['A3']]:
+        cell.font = openpyxl.styles.Font(size=9, color="666666")  # Gray color
+        cell.alignment = openpyxl.styles.Alignment(vertical='center')
+    
+    # Add header and taglines (center aligned in column B with same width as analysis)
+    header_cell = ws['B1']
+    header_cell.value = "EstateGenius AI"
+    header_cell.font = openpyxl.styles.Font(size=16, bold=True)
+    header_cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
+    
+    # Add taglines
+    taglines = [
+        "Your Pricing Partner",
+        "Saves Hours of Internet Search",
+        "We Customize AI According to Your Needs"
+    ]
+    
+    for idx, tagline in enumerate(taglines, 2):
+        cell = ws[f'B{idx}']
+        cell.value = tagline
+        cell.font = openpyxl.styles.Font(size=11)
+        cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
+    
+    # Add some space before the table headers
+    start_row = 6  # Start the actual content from row 6
+    
+    # Modified headers for two columns
+    headers = ['Image', 'Analysis']
+    view_columns = max((len(result.get('view_paths') or []) for result in results), default=0)
+    if view_columns:
+        headers.append('Other views')
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=start_row, column=col, value=header)
+        cell.font = openpyxl.styles.Font(bold=True)
+        cell.fill = openpyxl.styles.PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
+        cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
+
+    # Add data with combined filename and analysis
+    for idx, result in enumerate(results):
+        row_idx = start_row + 1 + idx
+        try:
+            thumbnail = item_thumbnail(result.get('temp_image_path'), EXCEL_IMAGE_BOX, 96, on_error)
+            if thumbnail:
+                jpeg, width, height = thumbnail
+                img = XLImage(jpeg)
+                img.width = width
+                img.height = height
+                ws.add_image(img, f'A{row_idx}')
+            # Other photos of a lot go in the columns after the analysis
+            for column, path in enumerate(result.get('view_paths') or [], 3):
+                thumbnail = item_thumbnail(path, EXCEL_VIEW_BOX, 96, on_error)
+                if not thumbnail:
+                    continue
+                jpeg, width, height = thumbnail
+                view = XLImage(jpeg)
+                view.width = width
+                view.height = height
+                ws.add_image(view, f'{openpyxl.utils.get_column_letter(column)}{row_idx}')
+            
+            # Analysis followed by the locally computed listing prices
+            analysis = result['analysis']
+            price_lines = format_item_prices(item_prices, idx)
+            if price_lines:
+                analysis = "\n".join([analysis, "", "Listing prices:"] + price_lines)
+            analysis_cell = ws.cell(row=row_idx, column=2, value=analysis)
+            analysis_cell.alignment = openpyxl.styles.Alignment(wrap_text=True, vertical='top')
+            
+            # Set row height based on content
+            ws.row_dimensions[row_idx].height = max(150, len(analysis.split('\n')) * 15)
+            
+        except Exception as e:
+            report_error(on_error, f"Excel error: {str(e)}")
+
+    # Adjust column widths for two columns
+    ws.column_dimensions['A'].width = 30  # For images
+    ws.column_dimensions['B'].width = 70  # Wider column for combined analysis
+    for column in range(3, 3 + view_columns):
+        ws.column_dimensions[openpyxl.utils.get_column_letter(column)].width = 15
+
+    # Set row heights for header section
+    for i in range(1, 5):  # Rows 1-4 (contact info and taglines)
+        ws.row_dimensions[i].height = 20
+    
+    # Add borders to content cells
+    content_range = f'A{start_row}:B{len(results) + start_row}'
+    for row in ws[content_range]:
+        for cell in row:
+            cell.border = openpyxl.styles.Border(
+                left=openpyxl.styles.Side(style='thin'),
+                right=openpyxl.styles.Side(style='thin'),
+                top=openpyxl.styles.Side(style='thin'),
+                bottom=openpyxl.styles.Side(style='thin')
+            )
+
+    if not folder_prices.empty:
+        summary_ws = wb.create_sheet("Price Summary")
+        summary_ws.append(PRICE_SUMMARY_HEADERS)
+        for cell in summary_ws[1]:
+            cell.font = openpyxl.styles.Font(bold=True)
+        for row in folder_summary_rows(folder_prices):
+            summary_ws.append(row)
+        summary_ws.column_dimensions['A'].width = 20
+
+    try:
+        wb.save(output_file)
+        return True
+    except Exception as e:
+        report_error(on_error, f"Save error: {str(e)}")
+        return False
+
+def reports_subdir(reports_dir=REPORTS_DIR):
+    """This month's subdirectory of reports_dir, so no single directory grows without bound"""
+    return os.path.join(reports_dir, datetime.now().strftime('%Y-%m'))
+
+def new_report_base_name(suffix=None):
+    """Timestamped report base name; the past-reports sidebar groups on the timestamp part"""
+    base_name = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    return f"{base_name}_{suffix}" if suffix else base_name
+
+def record_artifact_span(render_span, success, path):
+    """Attach the outcome and file size of a rendered report to its span"""
+    if success and os.path.exists(path):
+        render_span['bytes'] = os.path.getsize(path)
+    else:
+        render_span['outcome'] = 'error'
+
+def results_digest(results, price_stats):
+    """Content hash of everything a report is rendered from, or None if an image is missing.
+
+    Covers the template version and image settings, each result's image bytes, analysis and
+    listing prices in order, and the folder-wide price summary.
+    """
+    settings = f"template:{REPORT_TEMPLATE_VERSION}:{REPORT_IMAGE_DPI}:{REPORT_JPEG_QUALITY}"
+    digest = hashlib.sha256(settings.encode('utf-8'))
+    try:
+        for result in results:
+            fields = {'analysis': result.get('analysis'), 'prices': result.get('prices') or []}
+            digest.update(json.dumps(fields, sort_keys=True).encode('utf-8'))
+            for path in [result.get('temp_image_path'), *(result.get('view_paths') or [])]:
+                if path is None:
+                    return None
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+    except OSError:
+        return None
+    _, folder_prices = price_stats
+    digest.update(folder_prices.to_csv().encode('utf-8'))
+    return digest.hexdigest()
+
+def link_report(existing_path, new_path):
+    """Hard-link an existing report under a new name, falling back to the existing path"""
+    try:
+        os.link(existing_path, new_path)
+        return new_path
+    except OSError as e:
+        logger.info(f"Could not link {existing_path} to {new_path}, reusing it directly: {str(e)}")
+        return existing_path
+
+def reuse_reports(digest, base_name, reports_dir):
+    """(pdf_path, excel_path) of earlier reports with the same content, linked under base_name, or None"""
+    artifact = get_report_artifact(digest)
+    if not artifact or not all(os.path.exists(path) for path in artifact):
+        return None
+    with span('report_reuse'):
+        pdf_path, excel_path = artifact
+        touch_report_artifact(digest)
+        return (link_report(pdf_path, os.path.join(reports_dir, f"{base_name}.pdf")),
+                link_report(excel_path, os.path.join(reports_dir, f"{base_name}.xlsx")))
+
+def write_reports(results, base_name, reports_dir=REPORTS_DIR, on_error=None, price_stats=None):
+    """Render PDF and Excel reports, returning (pdf_path, excel_path) or (None, None) on failure.
+
+    price_stats defaults to price_statistics(results); report parts of a
+    larger run pass their own item stats with the run-wide folder stats.
+    Reports whose content digest matches an earlier render are linked to
+    the existing files instead of being rendered again.
+    """
+    os.makedirs(reports_dir, exist_ok=True)
+
+    pdf_report_name = os.path.join(reports_dir, f"{base_name}.pdf")
+    excel_report_name = os.path.join(reports_dir, f"{base_name}.xlsx")
+
+    # Price stats for the whole folder are computed once and shared by both reports
+    if price_stats is None:
+        with span('price_stats', items=len(results)):
+            price_stats = price_statistics(results)
+
+    digest = results_digest(results, price_stats)
+    if digest:
+        reused = reuse_reports(digest, base_name, reports_dir)
+        if reused:
+            return reused
+
+    with span('pdf_render', items=len(results)) as pdf_span:
+        pdf_success = create_pdf_report(results, pdf_report_name, on_error, price_stats)
+        record_artifact_span(pdf_span, pdf_success, pdf_report_name)
+    with span('xlsx_render', items=len(results)) as excel_span:
+        excel_success = create_excel_report(results, excel_report_name, on_error, price_stats)
+        record_artifact_span(excel_span, excel_success, excel_report_name)
+
+    if pdf_success and excel_success:
+        if digest:
+            save_report_artifact(digest, pdf_report_name, excel_report_name)
+        return pdf_report_name, excel_report_name
+    return None, None
@@ -0,0 +1,139 @@
+"""Canonical results of a run and the views that need no report rendering.
+
+Every finished item of a run is kept in the run_items table as one compact
+JSON record (name, analysis, prices, matches) plus a report-resolution
+thumbnail under RESULTS_DIR. That is enough to render the PDF and Excel
+reports later (see chunked.render_run) and to show the results right away as
+HTML, CSV or JSON.
+"""
+import os
+import csv
+import json
+import base64
+import shutil
+from io import StringIO
+from html import escape
+from datetime import datetime
+from database import get_run_items
+from prices import price_statistics, format_item_prices
+from reports import PDF_IMAGE_BOX, EXCEL_IMAGE_BOX, report_thumbnail
+
+RESULTS_DIR = os.getenv('RESULTS_DIR', '/var/lib/estateai/results')
+
+RESULT_COLUMNS = ['position', 'item_id', 'name', 'views', 'analysis', 'listing_prices', 'match_confidence',
+                  'reused_from', 'reuse_match', 'quality']
+# Bytes buffered before a block of CSV is handed to the caller
+RESULTS_BLOCK_SIZE = 256 * 1024
+# Run items read from the database at a time
+RESULTS_PAGE_SIZE = 200
+# Items shown by the HTML view at a time
+RESULTS_VIEW_LIMIT = int(os.getenv('RESULTS_VIEW_LIMIT', '50'))
+
+# Thumbnails are stored at the largest size either report embeds, so later renders lose nothing
+THUMBNAIL_BOX = max(PDF_IMAGE_BOX / 72, EXCEL_IMAGE_BOX / 96) * 96
+
+def run_image_dir(run_id, results_dir=RESULTS_DIR):
+    return os.path.join(results_dir, datetime.now().strftime('%Y-%m'), run_id)
+
+def store_thumbnail(temp_path, path):
+    """Save a report-resolution copy of a downloaded image at path and drop the download; path or None"""
+    stored = None
+    if temp_path:
+        try:
+            jpeg, _, _ = report_thumbnail(temp_path, THUMBNAIL_BOX, 96)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(jpeg.getbuffer())
+            stored = path
+        except OSError:
+            pass
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+    return stored
+
+def store_result_image(image_dir, seq, result):
+    """Keep report-resolution copies of a result's images and drop the downloaded files.
+
+    Returns the result with image_path set to the stored thumbnail, or to
+    None when the image could not be read. The other views of a lot (see
+    lots.py) are stored the same way in view_paths.
+    """
+    result = dict(result)
+    result['image_path'] = store_thumbnail(result.pop('temp_image_path', None),
+                                           os.path.join(image_dir, f"{seq:05d}.jpg"))
+    if result.get('view_paths'):
+        stored = [store_thumbnail(path, os.path.join(image_dir, f"{seq:05d}_{view}.jpg"))
+                  for view, path in enumerate(result['view_paths'], 1)]
+        result['view_paths'] = [path for path in stored if path]
+    return result
+
+def remove_result_images(image_dir):
+    shutil.rmtree(image_dir, ignore_errors=True)
+
+def run_results(run_id, offset=0, limit=None):
+    """Item results of a run in folder order, read a page at a time"""
+    while limit is None or limit > 0:
+        count = RESULTS_PAGE_SIZE if limit is None else min(limit, RESULTS_PAGE_SIZE)
+        page = [json.loads(record) for record in get_run_items(run_id, offset, count)]
+        if not page:
+            return
+        item_prices, _ = price_statistics(page)
+        for idx, result in enumerate(page):
+            result['listing_prices'] = "; ".join(format_item_prices(item_prices, idx))
+            result['position'] = offset + idx + 1
+            if result.get('views'):
+                result['views'] = "; ".join(result['views'])
+            yield result
+        offset += len(page)
+        if limit is not None:
+            limit -= len(page)
+
+def results_csv_blocks(run_id):
+    text = StringIO()
+    writer = csv.DictWriter(text, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for result in run_results(run_id):
+        writer.writerow(result)
+        if text.tell() >= RESULTS_BLOCK_SIZE:
+            yield text.getvalue().encode('utf-8')
+            text.seek(0)
+            text.truncate()
+    yield text.getvalue().encode('utf-8')
+
+def results_json_blocks(run_id):
+    yield b"["
+    for idx, result in enumerate(run_results(run_id)):
+        record = {key: result.get(key) for key in RESULT_COLUMNS}
+        record['prices'] = result.get('prices') or []
+        yield (b"," if idx else b"") + b"\n" + json.dumps(record).encode('utf-8')
+    yield b"\n]\n"
+
+def results_csv(run_id):
+    return b"".join(results_csv_blocks(run_id))
+
+def image_data_uri(path):
+    try:
+        with open(path, 'rb') as f:
+            return "data:image/jpeg;base64," + base64.b64encode(f.read()).decode('ascii')
+    except (OSError, TypeError):
+        return None
+
+def results_html(run_id, offset=0, limit=RESULTS_VIEW_LIMIT):
+    """A self-contained HTML table of a page of a run's results"""
+    rows = []
+    for result in run_results(run_id, offset, limit):
+        uri = image_data_uri(result.get('image_path'))
+        image = f'<img src="{uri}" style="max-width:160px;max-height:160px">' if uri else ''
+        for view_uri in filter(None, map(image_data_uri, result.get('view_paths') or [])):
+            image += f'<img src="{view_uri}" style="max-width:76px;max-height:76px;margin:2px">'
+        prices = escape(result['listing_prices']).replace('; ', '<br>')
+        analysis = escape(result.get('analysis') or '').replace('\n', '<br>')
+        if result.get('reused_from'):
+            analysis += f"<br><i>Reused from {escape(str(result['reused_from']))} ({escape(result.get('reuse_match') or '')})</i>"
+        rows.append(f"<tr><td>{result['position']}</td><td>{image}</td>"
+                    f"<td><b>{escape(result['name'])}</b><br>{analysis}</td><td>{prices}</td></tr>")
+    return ('<table style="border-collapse:collapse;width:100%" border="1" cellpadding="6">'
+            '<tr><th>#</th><th>Image</th><th>Analysis</th><th>Listing prices</th></tr>'
+            + "".join(rows) + '</table>')
@@ -0,0 +1,95 @@
+import os
+from appraisals import tokenize, salient_tokens
+from database import get_route_baseline
+
+# Model tiers: confident items go to the fast model with a shorter output budget
+FAST_MODEL = os.getenv('FAST_ANALYSIS_MODEL', "claude-3-5-haiku-20241022")
+FAST_MAX_TOKENS = int(os.getenv('FAST_ANALYSIS_MAX_TOKENS', '512'))
+FULL_MAX_TOKENS = 1024
+
+# Minimum confidence score for the fast tier; 1.1 or more disables it
+FAST_THRESHOLD = float(os.getenv('ROUTING_FAST_THRESHOLD', '0.6'))
+# Matches with a title needed for full confidence; fewer scale the score down
+CONFIDENT_MATCHES = 5
+# Words per item the agreement score looks for in each listing title
+AGREEMENT_TOKENS = 4
+
+ROUTES = ('fast', 'full', 'skipped')
+
+SKIPPED_ANALYSIS = "No reliable listing matches were found for this item."
+
+def match_confidence(lens_results):
+    """How strongly the Lens matches agree on one item, from 0 to 1.
+
+    Title agreement is the average share of the item's salient words found
+    in each listing title. It is weighted by source diversity (agreement
+    across different sellers counts for more than one seller's catalogue)
+    and scaled down when there are only a few usable matches.
+    """
+    titles = [match['title'] for match in lens_results if match.get('title')]
+    if not titles:
+        return 0.0
+
+    salient = set(salient_tokens("\n".join(titles))[:AGREEMENT_TOKENS])
+    if not salient:
+        return 0.0
+    agreement = sum(len(salient & set(tokenize(title))) for title in titles) / (len(salient) * len(titles))
+
+    sources = {(match.get('source') or '').lower() for match in lens_results if match.get('title')}
+    diversity = min(len(sources) / min(len(titles), CONFIDENT_MATCHES), 1.0)
+    coverage = min(len(titles) / CONFIDENT_MATCHES, 1.0)
+    return round(agreement * (0.6 + 0.4 * diversity) * coverage, 3)
+
+def route_item(lens_results, full_model):
+    """Pick (route, model, max_tokens, confidence) for an item's analysis.
+
+    route is 'skipped' when no match has a usable title, in which case
+    model and max_tokens are None and the LLM is not called.
+    """
+    if not any(match.get('title') for match in lens_results):
+        return 'skipped', None, None, 0.0
+    confidence = match_confidence(lens_results)
+    if confidence >= FAST_THRESHOLD:
+        return 'fast', FAST_MODEL, FAST_MAX_TOKENS, confidence
+    return 'full', full_model, FULL_MAX_TOKENS, confidence
+
+def routing_summary(items, baseline=None):
+    """Per-run route counts and estimated savings against sending every item to the full model.
+
+    items are UsageLedger.snapshot() entries. The cost of a full-model call
+    is the average over this run's full-tier items, falling back to
+    baseline ({'tokens', 'llm_ms'} averaged over recent runs) when the run
+    has none. Savings are None when neither is available.
+    """
+    summary = {route: 0 for route in ROUTES}
+    routed = [item for item in items if item.get('route') in ROUTES]
+    for item in routed:
+        summary[item['route']] += 1
+
+    called = [item for item in routed if item['route'] != 'skipped' and not item.get('llm_errors')]
+    full = [item for item in called if item['route'] == 'full']
+    if full:
+        baseline = {
+            'tokens': sum(item_tokens(item) for item in full) / len(full),
+            'llm_ms': sum(item.get('llm_ms', 0) for item in full) / len(full),
+        }
+
+    summary['tokens_saved'] = summary['llm_seconds_saved'] = None
+    if baseline and baseline.get('tokens'):
+        others = [item for item in called if item['route'] == 'fast']
+        tokens_saved = sum(baseline['tokens'] - item_tokens(item) for item in others)
+        ms_saved = sum(baseline['llm_ms'] - item.get('llm_ms', 0) for item in others)
+        tokens_saved += summary['skipped'] * baseline['tokens']
+        ms_saved += summary['skipped'] * baseline['llm_ms']
+        summary['tokens_saved'] = int(tokens_saved)
+        summary['llm_seconds_saved'] = round(ms_saved / 1000, 1)
+    return summary
+
+def item_tokens(item):
+    return item.get('input_tokens', 0) + item.get('output_tokens', 0)
+
+def run_routing_summary(items):
+    """routing_summary() for a finished run, using recent full-model calls as the baseline if needed"""
+    has_full = any(item.get('route') == 'full' and item.get('llm_calls') and not item.get('llm_errors')
+                   for item in items)
+    return routing_summary(items, None if has_full else get_route_baseline())
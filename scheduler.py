@@ -0,0 +1,188 @@
+"""Fair scheduling of runs and provider calls across the users of a process.
+
+Every Streamlit session runs in the same server process, so the app shares
+one set of queues: run admission (MAX_ACTIVE_RUNS runs at a time) and one
+queue per provider capping concurrent Drive, searchapi and Anthropic calls.
+Job workers are separate processes with their own caps; the jobs they
+claim are ordered fairly by the database (see database.CLAIM_ORDER_QUERY).
+
+Waiters are served by lane first (basic reports, then analysis, then
+speculative prefetching) and within a lane by start-time fair queuing: each
+grant moves the user's virtual start time on by 1/weight, so a user with
+priority 2 gets twice the share of a busy user with priority 1 and nobody
+waits behind another user's whole folder. Priorities are set by admins in
+the users table.
+"""
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from database import get_user_priorities
+from telemetry import span
+
+LANES = ('basic', 'analysis', 'speculative')
+PROVIDER_LIMITS = {
+    'drive': int(os.getenv('DRIVE_CONCURRENCY', '8')),
+    'lens': int(os.getenv('LENS_CONCURRENCY', '4')),
+    'llm': int(os.getenv('LLM_CONCURRENCY', '4')),
+}
+MAX_ACTIVE_RUNS = int(os.getenv('MAX_ACTIVE_RUNS', '4'))
+# Priorities are re-read from the database at most this often
+PRIORITY_CACHE_SECONDS = 30
+
+# (username, lane) of the work running in this context
+_tenant = contextvars.ContextVar('scheduler_tenant', default=(None, 'analysis'))
+
+_priorities = {}
+_priorities_loaded = 0.0
+_priorities_lock = threading.Lock()
+
+def user_weight(username):
+    global _priorities, _priorities_loaded
+    with _priorities_lock:
+        if time.monotonic() - _priorities_loaded > PRIORITY_CACHE_SECONDS:
+            _priorities = get_user_priorities()
+            _priorities_loaded = time.monotonic()
+        return max(_priorities.get(username, 1) or 1, 1)
+
+def lane_for_mode(mode):
+    return 'basic' if mode == 'basic' else 'analysis'
+
+class Ticket:
+    """A place in a FairQueue; granted once the holder may proceed"""
+
+    def __init__(self, queue, username, lane, start, seq):
+        self.queue = queue
+        self.username = username
+        self.lane = lane
+        self.start = start
+        self.seq = seq
+        self.granted = False
+        self.released = False
+
+    def sort_key(self):
+        return (LANES.index(self.lane), self.start, self.seq)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+    def wait(self, timeout=None):
+        """True once granted; False if timeout passed first"""
+        return self.queue.wait(self, timeout)
+
+    def position(self):
+        """1-based place among the waiters, or 0 once granted"""
+        return self.queue.position(self)
+
+    def release(self):
+        """Give the slot back, or leave the queue if it was never granted"""
+        self.queue.release(self)
+
+class FairQueue:
+    """Counting semaphore that grants slots by lane, then by weighted fair share across users"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.active = 0
+        self.waiting = []
+        self.finish = {}
+        self.clock = 0.0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def enqueue(self, username, lane='analysis', weight=1):
+        with self.cond:
+            # Idle users restart at the current virtual time instead of banking credit
+            start = max(self.clock, self.finish.get((username, lane), 0.0))
+            self.finish[(username, lane)] = start + 1.0 / weight
+            ticket = Ticket(self, username, lane, start, next(self.seq))
+            heapq.heappush(self.waiting, ticket)
+            self._grant()
+            return ticket
+
+    def _grant(self):
+        while self.active < self.capacity and self.waiting:
+            ticket = heapq.heappop(self.waiting)
+            ticket.granted = True
+            self.active += 1
+            self.clock = max(self.clock, ticket.start)
+        self.cond.notify_all()
+
+    def wait(self, ticket, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: ticket.granted, timeout)
+
+    def position(self, ticket):
+        with self.cond:
+            if ticket.granted:
+                return 0
+            return 1 + sum(1 for other in self.waiting if other < ticket)
+
+    def release(self, ticket):
+        with self.cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self.active -= 1
+            else:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+            self._grant()
+
+    def stats(self):
+        with self.cond:
+            return {'queue': self.name, 'active': self.active, 'capacity': self.capacity,
+                    'waiting': len(self.waiting)}
+
+run_queue = FairQueue('runs', MAX_ACTIVE_RUNS)
+provider_queues = {provider: FairQueue(provider, limit) for provider, limit in PROVIDER_LIMITS.items()}
+
+@contextmanager
+def tenant(username, lane='analysis'):
+    """Attribute provider calls made in this block (and tasks submitted with submit_with_context)"""
+    token = _tenant.set((username, lane))
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+def admit_run(username, lane='analysis'):
+    """Join the run admission queue; wait() on the ticket and release() it when the run ends"""
+    return run_queue.enqueue(username, lane, user_weight(username))
+
+@contextmanager
+def admitted(username, lane='analysis', on_wait=None, poll_interval=0.5):
+    """Hold a run slot for the block, calling on_wait(position) while queued for it"""
+    ticket = admit_run(username, lane)
+    try:
+        while not ticket.wait(poll_interval):
+            if on_wait:
+                on_wait(ticket.position())
+        yield ticket
+    finally:
+        ticket.release()
+
+@contextmanager
+def provider_slot(provider):
+    """Hold one of a provider's concurrency slots, queuing fairly for it"""
+    username, lane = _tenant.get()
+    queue = provider_queues[provider]
+    with span(f'queue_{provider}'):
+        ticket = queue.enqueue(username, lane, user_weight(username))
+        try:
+            ticket.wait()
+        except BaseException:
+            ticket.release()
+            raise
+    try:
+        yield
+    finally:
+        ticket.release()
+
+def scheduler_stats():
+    return [queue.stats() for queue in [run_queue, *provider_queues.values()]]
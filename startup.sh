@@ -14,7 +14,9 @@ python3 startup.py
 
 # If database initialization was successful, start the app
 if [ $? -eq 0 ]; then
-    echo "Database initialized successfully, starting Streamlit app..."
+    echo "Database initialized successfully, starting job API, workers and Streamlit app..."
+    python3 api.py --port 8502 &
+    python3 worker.py --concurrency ${WORKER_CONCURRENCY:-2} &
     streamlit run app.py --server.port=8501 --server.address=0.0.0.0
 else
     echo "Database initialization failed!"
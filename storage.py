@@ -0,0 +1,307 @@
+"""Report storage lifecycle: quotas, retention, compression and garbage collection.
+
+Usage:
+    python storage.py [--reports-dir /var/lib/estateai/reports]
+
+New reports go to monthly subdirectories of REPORTS_DIR (see
+reports.reports_subdir) so directory scans and backups stay fast.
+Identical reports are hard-linked or shared between runs (see
+reports.reuse_reports), so a file is only deleted once no past report or
+job refers to it; reusable artifacts never keep a file alive. Per-user
+quotas charge every file a user's reports refer to, shared or not.
+
+Reports are deliverables, so retention and quotas are off unless
+REPORT_RETENTION_DAYS, STORAGE_QUOTA_MB or a user's storage_quota_mb is
+set; every deleted file is logged.
+
+Runs whose reports are rendered on demand keep their results and
+thumbnails (see results.py) until their reports are removed or the
+retention period ends; their report rows are kept even though the files do
+not exist yet.
+
+Workers run run_storage_maintenance() in the background every
+STORAGE_GC_INTERVAL_SECONDS; this script runs a single pass.
+"""
+import os
+import re
+import sys
+import gzip
+import time
+import shutil
+import logging
+import argparse
+import threading
+from database import (init_db, get_reports, delete_reports, get_referenced_report_paths, replace_report_path,
+                      delete_report_artifacts, delete_old_run_items, get_storage_quota, get_report_usernames,
+                      prune_stage_spans, get_result_run, get_result_run_ids, get_old_result_runs,
+                      delete_result_runs)
+from reports import REPORTS_DIR
+from results import RESULTS_DIR, remove_result_images
+from profiling import prune_profiles
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Default per-user quota, 0 for none; users.storage_quota_mb overrides it
+STORAGE_QUOTA_MB = int(os.getenv('STORAGE_QUOTA_MB', '0'))
+# Reports older than this are deleted; 0 keeps them forever
+REPORT_RETENTION_DAYS = int(os.getenv('REPORT_RETENTION_DAYS', '0'))
+# Reports older than this are gzip-compressed; 0 disables compression
+REPORT_COMPRESS_AFTER_DAYS = int(os.getenv('REPORT_COMPRESS_AFTER_DAYS', '0'))
+STORAGE_GC_INTERVAL = float(os.getenv('STORAGE_GC_INTERVAL_SECONDS', '3600'))
+# Unreferenced files younger than this may belong to a run that is still rendering
+ORPHAN_GRACE_SECONDS = 24 * 3600
+
+REPORT_EXTENSIONS = ('.pdf', '.xlsx', '.pdf.gz', '.xlsx.gz')
+# Only monthly subdirectories are swept for orphans; batch output and older reports live elsewhere
+MONTH_DIR_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+def resolve_report_path(path):
+    """Where a stored report path is now; rows from older deployments may point elsewhere"""
+    if os.path.exists(path):
+        return path
+    moved = os.path.join(REPORTS_DIR, os.path.basename(path))
+    # Reports of lazily rendered runs do not exist until first requested
+    return moved if os.path.exists(moved) else path
+
+def open_report(path):
+    """Open a report for reading, decompressing it if it was compressed"""
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+def report_file_name(path):
+    """Download name of a report, without the compression suffix"""
+    name = os.path.basename(path)
+    return name[:-3] if name.endswith('.gz') else name
+
+def report_size(path):
+    """Uncompressed size of a report in bytes"""
+    if not path.endswith('.gz'):
+        return os.path.getsize(path)
+    # The gzip trailer ends with the uncompressed size modulo 2**32
+    with open(path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), 'little')
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def user_quota_bytes(username):
+    """A user's quota in bytes; 0 means no quota"""
+    quota_mb = get_storage_quota(username)
+    return (STORAGE_QUOTA_MB if quota_mb is None else quota_mb) * 1024 * 1024
+
+def user_storage_bytes(username):
+    """Bytes on disk of the files a user's past reports refer to"""
+    return sum(file_size(path) for path in {resolve_report_path(row[2]) for row in get_reports(username)})
+
+def forget_result_runs(run_ids):
+    """Delete the stored results of runs, so their reports can no longer be rendered"""
+    runs = [run for run in map(get_result_run, run_ids) if run]
+    for run in runs:
+        remove_result_images(run['image_dir'])
+    if runs:
+        delete_result_runs([run['run_id'] for run in runs])
+    return len(runs)
+
+def remove_reports(rows):
+    """Delete report rows and any of their files nothing else refers to, returning bytes freed"""
+    if not rows or not delete_reports([row[0] for row in rows]):
+        return 0
+    remaining = {row[4] for row in get_reports()}
+    forget_result_runs({row[4] for row in rows if row[4]} - remaining)
+    referenced = {resolve_report_path(path) for path in get_referenced_report_paths()}
+    freed = 0
+    removed = []
+    for path in {resolve_report_path(row[2]) for row in rows} - referenced:
+        size = file_size(path)
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        logger.info(f"Deleted report {path} ({size} bytes)")
+        # Hard links share the blocks, so only the last link actually frees them
+        freed += size
+        removed.append(path)
+    delete_report_artifacts(removed)
+    return freed
+
+def run_key(row):
+    """Run a report row belongs to; rows saved before run IDs were recorded use the timestamped base name"""
+    if row[4]:
+        return row[4]
+    return "_".join(report_file_name(row[2]).split('.')[0].split('_')[:3])
+
+def run_groups(rows):
+    """Group report rows into runs, oldest first"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(run_key(row), []).append(row)
+    return sorted(groups.values(), key=lambda group: min(row[3] for row in group))
+
+def enforce_quota(username):
+    """Remove a user's oldest reports until they fit their quota; the newest run is always kept"""
+    quota = user_quota_bytes(username)
+    if quota <= 0:
+        return 0
+    rows = get_reports(username)
+    sizes = {row[2]: file_size(resolve_report_path(row[2])) for row in rows}
+    used = sum(sizes.values())
+    if used <= quota:
+        return 0
+
+    freed = 0
+    with span('storage_quota'):
+        for group in run_groups(rows)[:-1]:
+            if used <= quota:
+                break
+            others = {row[2] for row in rows if row not in group}
+            used -= sum(sizes[path] for path in {row[2] for row in group} - others)
+            rows = [row for row in rows if row not in group]
+            freed += remove_reports(group)
+    logger.info(f"Storage quota of {username}: freed {freed} bytes, {used} of {quota} bytes in use")
+    return freed
+
+def apply_retention(days=REPORT_RETENTION_DAYS):
+    """Delete reports older than days, returning bytes freed"""
+    if days <= 0:
+        return 0
+    with span('storage_retention'):
+        freed = remove_reports(get_reports(older_than_days=days))
+        forget_result_runs([run_id for run_id, _ in get_old_result_runs(days)])
+        return freed
+
+def compress_report(path):
+    """gzip one report in place, returning the compressed path or None"""
+    compressed = f"{path}.gz"
+    try:
+        with open(path, 'rb') as source, gzip.open(f"{compressed}.tmp", 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(f"{compressed}.tmp", compressed)
+    except OSError as e:
+        logger.warning(f"Could not compress {path}: {str(e)}")
+        return None
+    if not replace_report_path(path, compressed):
+        os.remove(compressed)
+        return None
+    os.remove(path)
+    return compressed
+
+def compress_old_reports(days=REPORT_COMPRESS_AFTER_DAYS):
+    """gzip reports older than days, returning bytes saved.
+
+    Reports rendered with downsampled images gain little; this is mainly for
+    older reports that embed full-size photos.
+    """
+    if days <= 0:
+        return 0
+    saved = 0
+    with span('storage_compress'):
+        for path in {row[2] for row in get_reports(older_than_days=days)}:
+            if path.endswith('.gz') or not os.path.exists(path):
+                continue
+            size = file_size(path)
+            compressed = compress_report(path)
+            if compressed:
+                saved += size - file_size(compressed)
+    return saved
+
+def month_dirs(root):
+    if not os.path.isdir(root):
+        return []
+    return [entry.path for entry in os.scandir(root) if entry.is_dir() and MONTH_DIR_PATTERN.match(entry.name)]
+
+def collect_result_orphans(pending, cutoff, results_dir=RESULTS_DIR):
+    """Remove thumbnail directories of runs that never finished, returning how many"""
+    removed = 0
+    for month_dir in month_dirs(results_dir):
+        with os.scandir(month_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir() and entry.name not in pending and entry.stat().st_mtime < cutoff:
+                        remove_result_images(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        try:
+            os.rmdir(month_dir)
+        except OSError:
+            pass
+    return removed
+
+def collect_garbage(reports_dir=REPORTS_DIR):
+    """Remove report rows whose files are gone and report files nothing refers to"""
+    stats = {'rows': 0, 'files': 0, 'bytes': 0}
+    with span('storage_gc'):
+        # Reports of runs rendered on demand do not exist until requested
+        pending = get_result_run_ids()
+        missing = [row for row in get_reports()
+                   if row[4] not in pending and not os.path.exists(resolve_report_path(row[2]))]
+        if missing and delete_reports([row[0] for row in missing]):
+            stats['rows'] = len(missing)
+
+        referenced = {resolve_report_path(path) for path in get_referenced_report_paths()}
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        removed = []
+        for month_dir in month_dirs(reports_dir):
+            with os.scandir(month_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(REPORT_EXTENSIONS) or entry.path in referenced:
+                        continue
+                    try:
+                        info = entry.stat()
+                        if info.st_mtime < cutoff:
+                            os.remove(entry.path)
+                            logger.info(f"Deleted unreferenced report {entry.path} ({info.st_size} bytes)")
+                            removed.append(entry.path)
+                            stats['files'] += 1
+                            stats['bytes'] += info.st_size
+                    except OSError:
+                        pass
+            try:
+                os.rmdir(month_dir)  # only succeeds once the month is empty
+            except OSError:
+                pass
+        delete_report_artifacts(removed)
+        stats['result_dirs'] = collect_result_orphans(pending, cutoff)
+    return stats
+
+def run_storage_maintenance(reports_dir=REPORTS_DIR):
+    """One pass of retention, compression, quotas and garbage collection"""
+    summary = {'retention_bytes': apply_retention(), 'compressed_bytes': compress_old_reports()}
+    summary['quota_bytes'] = sum(enforce_quota(username) for username in get_report_usernames())
+    if REPORT_RETENTION_DAYS > 0:
+        summary['run_items'] = delete_old_run_items(REPORT_RETENTION_DAYS)
+    summary['orphans'] = collect_garbage(reports_dir)
+    summary['spans'] = prune_stage_spans()
+    summary['profiles'] = prune_profiles()
+    logger.info(f"Storage maintenance: {summary}")
+    return summary
+
+def start_storage_gc(stop, interval=STORAGE_GC_INTERVAL, reports_dir=REPORTS_DIR):
+    """Run storage maintenance every interval seconds on a daemon thread until stop is set"""
+    def loop():
+        while not stop.wait(interval):
+            try:
+                run_storage_maintenance(reports_dir)
+            except Exception as e:
+                logger.error(f"Storage maintenance failed: {str(e)}")
+
+    thread = threading.Thread(target=loop, name="storage-gc", daemon=True)
+    thread.start()
+    return thread
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EstateGenius AI report storage maintenance")
+    parser.add_argument("--reports-dir", default=REPORTS_DIR, help="Directory reports are written to")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    print(run_storage_maintenance(args.reports_dir))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,477 @@
+"""Local stand-ins for Google Drive, searchapi.io Google Lens and the Anthropic
+messages API, for offline benchmarks and load tests.
+
+Usage:
+    python stubs.py [--port 8600] [--latency-scale 1.0] [--error-rate 0.0] [--throttle-rate 0.0]
+
+Point the pipeline at it with:
+    DRIVE_BASE_URL=http://127.0.0.1:8600
+    SEARCH_API_URL=http://127.0.0.1:8600/api/v1/search
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8600
+
+Folder IDs of the form "<name>-<count>" (e.g. "bench-250") list <count> images.
+"""
+import sys
+import json
+import time
+import zlib
+import random
+import logging
+import argparse
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from PIL import Image, ImageDraw, ImageFilter
+
+logger = logging.getLogger(__name__)
+
+# Median seconds and log-normal sigma per service, loosely based on production timings
+DEFAULT_LATENCY = {
+    'drive_listing': (0.4, 0.3),
+    'download': (0.25, 0.5),
+    'lens': (1.8, 0.4),
+    'llm': (6.0, 0.35),
+}
+
+MARKETPLACES = ["eBay", "Etsy", "Amazon.com", "Walmart", "Macy's", "Worthpoint", "LiveAuctioneers"]
+STUB_ITEMS = ["Hummel Figurine", "Pyrex Mixing Bowl", "Royal Doulton Plate",
+              "Fenton Glass Vase", "Lladro Figurine", "Cast Iron Skillet"]
+
+# LLM latency multiplier for model names containing the key
+MODEL_SPEED = {'haiku': 0.35}
+# Shortest prompt prefix the API caches, by model name key; other models cache from 1024 tokens
+CACHE_MIN_TOKENS = {'haiku': 2048}
+# Cached prefixes expire after this many seconds without a hit, like the API's ephemeral cache
+CACHE_TTL_SECONDS = 300
+# Share of the prefill time cached tokens still take
+CACHED_PREFILL_SHARE = 0.1
+
+def default_config():
+    """Stub behaviour; every service key can be overridden independently"""
+    return {
+        'latency': dict(DEFAULT_LATENCY),
+        'latency_scale': 1.0,
+        'error_rate': {name: 0.0 for name in DEFAULT_LATENCY},
+        'throttle_rate': {name: 0.0 for name in DEFAULT_LATENCY},
+        'image_size': (1600, 1200),
+        'image_variants': 8,
+        'lens_matches': 15,
+        # Share of images whose Lens matches disagree on what the item is
+        'ambiguous_rate': 0.3,
+        # Share of Drive files that are lot cards, blurred or near-black shots
+        'bad_image_rate': 0.0,
+        # Consecutive Drive files showing the same item from different angles
+        'views_per_item': 1,
+        'llm_output_words': 180,
+        # Prompt processing time before the first token; cached prompt tokens take a fraction of it
+        'llm_prefill_seconds_per_1k': 0.15,
+        # Shortest cacheable prompt prefix; None uses the per-model minimum of the real API
+        'cache_min_tokens': None,
+        'seed': None,
+    }
+
+def make_jpeg(width, height, seed):
+    """Noisy gradient JPEG so encoded sizes resemble real photos"""
+    rng = random.Random(seed)
+    base = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 30)
+    img = Image.merge('RGB', (base, noise, Image.eval(base, lambda v: (v + rng.randint(0, 255)) % 256)))
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def make_item_views(width, height, seed, views):
+    """JPEGs of one random still life, each view slightly rotated and shifted"""
+    rng = random.Random(seed)
+    scene = Image.new('RGB', (width, height), tuple(rng.randint(0, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(scene)
+    for _ in range(6):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        w, h = rng.randint(width // 8, width // 2), rng.randint(height // 8, height // 2)
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape((x - w // 2, y - h // 2, x + w // 2, y + h // 2), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    noise = Image.effect_noise((width, height), 30).convert('RGB')
+    scene = Image.blend(scene, noise, 0.15)
+    payloads = []
+    for view in range(views):
+        dx, dy = rng.randint(-width // 40, width // 40), rng.randint(-height // 40, height // 40)
+        shot = scene.rotate(rng.uniform(-4, 4) if view else 0, translate=(dx, dy) if view else None,
+                            fillcolor=scene.getpixel((0, 0)))
+        buffer = BytesIO()
+        shot.save(buffer, format='JPEG', quality=90)
+        payloads.append(buffer.getvalue())
+    return payloads
+
+def make_bad_jpegs(width, height):
+    """A lot-number card, a badly blurred shot and a near-black frame"""
+    card = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(card)
+    for line in range(4):
+        draw.text((width // 4, height // 4 + line * height // 10), f"LOT {1000 + line}", fill='black')
+    blurred = Image.open(BytesIO(make_jpeg(width, height, 0))).filter(ImageFilter.GaussianBlur(width / 60))
+    dark = Image.effect_noise((width, height), 8).point(lambda v: v // 12).convert('RGB')
+    payloads = []
+    for img in (card, blurred, dark):
+        buffer = BytesIO()
+        img.save(buffer, format='JPEG', quality=90)
+        payloads.append(buffer.getvalue())
+    return payloads
+
+class StubState:
+    """Shared config and pre-rendered payloads for the handler"""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config['seed'])
+        self.rng_lock = threading.Lock()
+        width, height = config['image_size']
+        self.images = [make_jpeg(width, height, seed) for seed in range(config['image_variants'])]
+        self.bad_images = make_bad_jpegs(width, height) if config['bad_image_rate'] else []
+        # Items photographed from several angles, views_per_item photos each
+        self.item_views = []
+        if config['views_per_item'] > 1:
+            self.item_views = [make_item_views(width, height, seed, config['views_per_item'])
+                               for seed in range(config['image_variants'])]
+        self.counters = {}
+        self.counters_lock = threading.Lock()
+        self.prompt_cache = {}
+        self.prompt_cache_lock = threading.Lock()
+
+    def random(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def latency(self, service):
+        median, sigma = self.config['latency'][service]
+        with self.rng_lock:
+            value = self.rng.lognormvariate(0, sigma) * median
+        return value * self.config['latency_scale']
+
+    def count(self, key):
+        with self.counters_lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def cache_lookup(self, key):
+        """'read' if a prefix is cached (refreshing it), otherwise caches it and returns 'write'"""
+        now = time.monotonic()
+        with self.prompt_cache_lock:
+            hit = self.prompt_cache.get(key, 0) > now
+            self.prompt_cache[key] = now + CACHE_TTL_SECONDS
+        return 'read' if hit else 'write'
+
+    def fault(self, service):
+        """Return 429, 500 or None for a request to this service"""
+        roll = self.random()
+        if roll < self.config['throttle_rate'].get(service, 0.0):
+            return 429
+        if roll < self.config['throttle_rate'].get(service, 0.0) + self.config['error_rate'].get(service, 0.0):
+            return 500
+        return None
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "EstateAIStub/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_body(self, status, body, content_type, extra_headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload, extra_headers=None):
+        self.send_body(status, json.dumps(payload).encode('utf-8'), "application/json", extra_headers)
+
+    def simulate(self, service, scale=1.0):
+        """Sleep for the service latency and return an injected fault status, if any"""
+        self.state.count(f"{service}_requests")
+        time.sleep(self.state.latency(service) * scale)
+        status = self.state.fault(service)
+        if status:
+            self.state.count(f"{service}_{status}")
+        return status
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.startswith("/drive/folders/"):
+            self.drive_listing(url.path.rsplit('/', 1)[-1])
+        elif url.path == "/uc":
+            self.drive_download(query.get('id', [''])[0])
+        elif url.path == "/api/v1/search":
+            self.lens_search(query)
+        else:
+            self.send_json(404, {'error': "Not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if urlparse(self.path).path == "/v1/messages":
+            self.anthropic_messages(body)
+        else:
+            self.send_json(404, {'error': "Not found"})
+
+    def drive_listing(self, folder_id):
+        status = self.simulate('drive_listing')
+        if status:
+            self.send_body(status, b"<html>error</html>", "text/html")
+            return
+
+        try:
+            count = int(folder_id.rsplit('-', 1)[-1])
+        except ValueError:
+            count = 25
+        # Real folder pages repeat each link several times; the pipeline dedupes them
+        links = "".join(
+            f'<a href="https://drive.google.com/file/d/{folder_id}_{idx:05d}/view">'
+            f'https://drive.google.com/file/d/{folder_id}_{idx:05d}</a>\n' * 2
+            for idx in range(count)
+        )
+        self.send_body(200, f"<html><body>{links}</body></html>".encode('utf-8'), "text/html")
+
+    def drive_download(self, file_id):
+        status = self.simulate('download')
+        if status:
+            self.send_body(status, b"error", "text/plain")
+            return
+        key = zlib.crc32(file_id.encode('utf-8'))
+        folder_id, _, index = file_id.rpartition('_')
+        if self.state.bad_images and (key % 1000) / 1000 < self.state.config['bad_image_rate']:
+            image = self.state.bad_images[key % len(self.state.bad_images)]
+        elif self.state.item_views and index.isdigit():
+            item, view = divmod(int(index), self.state.config['views_per_item'])
+            views = self.state.item_views[zlib.crc32(f"{folder_id}:{item}".encode('utf-8')) % len(self.state.item_views)]
+            image = views[view]
+        else:
+            image = self.state.images[key % len(self.state.images)]
+        self.send_body(200, image, "image/jpeg")
+
+    def lens_search(self, query):
+        status = self.simulate('lens')
+        if status:
+            self.send_json(status, {'error': "Rate limit exceeded" if status == 429 else "Internal error"})
+            return
+
+        seed = zlib.crc32(query.get('url', [''])[0].encode('utf-8'))
+        rng = random.Random(seed)
+        item = rng.choice(STUB_ITEMS)
+        ambiguous = rng.random() < self.state.config['ambiguous_rate']
+        matches = []
+        for position in range(1, self.state.config['lens_matches'] + 1):
+            if ambiguous:
+                item = rng.choice(STUB_ITEMS)
+            source = rng.choice(MARKETPLACES)
+            price = round(rng.lognormvariate(3.2, 0.6), 2)
+            matches.append({
+                'position': position,
+                'title': f"Vintage {item} #{rng.randint(100, 999)}",
+                'link': f"https://example.com/{source.lower()}/{seed % 100000}/{position}",
+                'source': source,
+                'price': {'value': f"${price:,.2f}", 'extracted_value': price, 'currency': "$"},
+                'thumbnail': f"https://example.com/thumb/{position}.jpg",
+            })
+        self.send_json(200, {'search_metadata': {'status': "Success"}, 'visual_matches': matches})
+
+    def prompt_usage(self, request):
+        """Input token usage of a messages request, emulating prompt caching.
+
+        Tokens are estimated at four characters each. The prefix up to the
+        last block marked with cache_control is cached when it is long
+        enough for the model.
+        """
+        model = request.get('model', "stub")
+        system = request.get('system') or []
+        blocks = [{'type': "text", 'text': system}] if isinstance(system, str) else list(system)
+        prefix_end = max((idx + 1 for idx, block in enumerate(blocks) if block.get('cache_control')), default=0)
+        prefix = json.dumps([request.get('tools'), blocks[:prefix_end]])
+        total = max(1, len(json.dumps([request.get('tools'), blocks, request.get('messages')])) // 4)
+
+        usage = {'input_tokens': total, 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+        minimum = self.state.config['cache_min_tokens']
+        if minimum is None:
+            minimum = next((tokens for key, tokens in CACHE_MIN_TOKENS.items() if key in model), 1024)
+        prefix_tokens = len(prefix) // 4
+        if prefix_end and prefix_tokens >= minimum:
+            outcome = self.state.cache_lookup(f"{model}:{zlib.crc32(prefix.encode('utf-8'))}")
+            usage['input_tokens'] = total - prefix_tokens
+            usage[f"cache_{'read' if outcome == 'read' else 'creation'}_input_tokens"] = prefix_tokens
+        return usage
+
+    def anthropic_messages(self, body):
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            self.send_json(400, {'type': "error", 'error': {'type': "invalid_request_error", 'message': "Bad JSON"}})
+            return
+
+        model = request.get('model', "stub")
+        speed = next((scale for key, scale in MODEL_SPEED.items() if key in model), 1.0)
+        usage = self.prompt_usage(request)
+        # Prompt processing delays the first token; generation takes the usual LLM latency
+        prefill_tokens = (usage['input_tokens'] + usage['cache_creation_input_tokens']
+                          + usage['cache_read_input_tokens'] * CACHED_PREFILL_SHARE)
+        time.sleep(prefill_tokens / 1000 * self.state.config['llm_prefill_seconds_per_1k']
+                   * speed * self.state.config['latency_scale'])
+        streaming = bool(request.get('stream'))
+        status = self.simulate('llm', 0.0 if streaming else speed)
+        if status:
+            error_type = "rate_limit_error" if status == 429 else "api_error"
+            self.send_json(status, {'type': "error", 'error': {'type': error_type, 'message': "Stubbed failure"}},
+                           {'retry-after': "0"} if status == 429 else None)
+            return
+
+        # Output is cut off at max_tokens like the real API
+        words = min(self.state.config['llm_output_words'], int(request.get('max_tokens', 1024) / 1.3))
+        text = "- Name: Stubbed item\n- Opinion: " + " ".join(["lorem"] * words)
+        usage['output_tokens'] = int(words * 1.3)
+        message = {
+            'id': f"msg_stub_{int(self.state.random() * 1e12)}",
+            'type': "message",
+            'role': "assistant",
+            'model': model,
+            'content': [{'type': "text", 'text': text}],
+            'stop_reason': "end_turn",
+            'stop_sequence': None,
+            'usage': usage,
+        }
+        if streaming:
+            self.stream_message(message, self.state.latency('llm') * speed)
+        else:
+            self.send_json(200, message)
+
+    def stream_message(self, message, duration, chunks=10):
+        """Send a message as server-sent events, spreading its text over duration seconds"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name, payload):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(dict(payload, type=name))}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        text = message['content'][0]['text']
+        event('message_start', {'message': dict(message, content=[], stop_reason=None,
+                                                usage=dict(message['usage'], output_tokens=1))})
+        event('content_block_start', {'index': 0, 'content_block': {'type': "text", 'text': ""}})
+        step = -(-len(text) // chunks)
+        for start in range(0, len(text), step):
+            if start:
+                time.sleep(duration / chunks)
+            event('content_block_delta', {'index': 0, 'delta': {'type': "text_delta", 'text': text[start:start + step]}})
+        event('content_block_stop', {'index': 0})
+        event('message_delta', {'delta': {'stop_reason': "end_turn", 'stop_sequence': None},
+                                'usage': {'output_tokens': message['usage']['output_tokens']}})
+        event('message_stop', {})
+
+class StubServer:
+    """Run the stub services on a background thread"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = StubState(config or default_config())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def counters(self):
+        return dict(self.httpd.state.counters)
+
+    def environment(self):
+        """Environment variables that route the pipeline to this server"""
+        return {
+            'DRIVE_BASE_URL': self.base_url,
+            'SEARCH_API_URL': f"{self.base_url}/api/v1/search",
+            'ANTHROPIC_BASE_URL': self.base_url,
+            'ANTHROPIC_API_KEY': "stub-key",
+            'SEARCH_API_KEY': "stub-key",
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def add_stub_arguments(parser):
+    """Command-line options shared by the stub server, benchmark and load test"""
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Multiply every stub latency (e.g. 0.05 for quick runs)")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=MEDIAN[,SIGMA]",
+                        help=f"Override a service latency; services: {', '.join(DEFAULT_LATENCY)}")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--image-size", default="1600x1200", help="Stub image dimensions, WIDTHxHEIGHT")
+    parser.add_argument("--lens-matches", type=int, default=15, help="Visual matches per Lens response")
+    parser.add_argument("--bad-image-rate", type=float, default=0.0,
+                        help="Fraction of Drive files that are lot cards, blurred or near-black shots")
+    parser.add_argument("--views-per-item", type=int, default=1,
+                        help="Consecutive Drive files showing one item from different angles")
+    parser.add_argument("--cache-min-tokens", type=int, default=None,
+                        help="Shortest cacheable prompt prefix (default: the real API's per-model minimum)")
+    parser.add_argument("--llm-output-words", type=int, default=180, help="Words per stubbed analysis")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+
+def config_from_args(args):
+    """Build a stub config from add_stub_arguments options"""
+    config = default_config()
+    config['latency_scale'] = args.latency_scale
+    for override in args.latency:
+        service, _, values = override.partition('=')
+        if service not in DEFAULT_LATENCY:
+            raise ValueError(f"Unknown service '{service}'")
+        median, _, sigma = values.partition(',')
+        config['latency'][service] = (float(median), float(sigma) if sigma else DEFAULT_LATENCY[service][1])
+    config['error_rate'] = {name: args.error_rate for name in DEFAULT_LATENCY}
+    config['throttle_rate'] = {name: args.throttle_rate for name in DEFAULT_LATENCY}
+    width, _, height = args.image_size.lower().partition('x')
+    config['image_size'] = (int(width), int(height))
+    config['lens_matches'] = args.lens_matches
+    config['llm_output_words'] = args.llm_output_words
+    config['cache_min_tokens'] = args.cache_min_tokens
+    config['bad_image_rate'] = args.bad_image_rate
+    config['views_per_item'] = args.views_per_item
+    config['seed'] = args.seed
+    return config
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stubs for Drive, searchapi and Anthropic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = StubServer(config_from_args(args), args.host, args.port)
+    for name, value in server.environment().items():
+        print(f"{name}={value}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import time
+import queue
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from progress import publish_stage
+
+logger = logging.getLogger(__name__)
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+# Run ID and username attached to every span recorded inside run_context()
+_run_context = contextvars.ContextVar('run_context', default={})
+_usage_ledger = contextvars.ContextVar('usage_ledger', default=None)
+# Profiling session of the enclosing run, if it is being profiled (see profiling.py)
+_profile_session = contextvars.ContextVar('profile_session', default=None)
+
+def add_span_listener(listener):
+    """Register a callable that receives every finished span dict"""
+    with _listeners_lock:
+        _listeners.append(listener)
+
+def remove_span_listener(listener):
+    """Unregister a span listener"""
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+# Span outcomes that are not failures: cache hits and misses, images the quality gate
+# rejects or cannot read, and prefetches cancelled because the user moved on
+NORMAL_OUTCOMES = ('ok', 'hit', 'miss', 'rejected', 'unreadable', 'cancelled')
+
+def span_failed(outcome):
+    return outcome not in NORMAL_OUTCOMES
+
+@contextmanager
+def span(stage, **attrs):
+    """Time a pipeline stage and pass the finished span to the listeners.
+
+    The yielded dict can be updated inside the block, e.g. with 'bytes' or
+    'outcome'. An exception escaping the block marks the span as an error;
+    outcomes outside NORMAL_OUTCOMES count as errors in the summaries.
+    """
+    record = {'stage': stage, 'outcome': 'ok', **_run_context.get(), **attrs}
+    publish_stage(stage)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        record['outcome'] = 'error'
+        raise
+    finally:
+        record['duration'] = time.perf_counter() - start
+        record['ended_at'] = time.time()
+        with _listeners_lock:
+            listeners = list(_listeners)
+        for listener in listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                logger.error(f"Span listener failed: {str(e)}")
+
+class UsageLedger:
+    """Thread-safe per-item API usage counters for one run"""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def add(self, item_id, **fields):
+        """Add numeric fields to the item's counters; other values overwrite"""
+        with self.lock:
+            entry = self.items.setdefault(item_id, {'item_id': item_id})
+            for name, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    entry[name] = entry.get(name, 0) + value
+                else:
+                    entry[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return [dict(entry) for entry in self.items.values()]
+
+    def totals(self):
+        """Sum of every numeric counter across items"""
+        totals = {}
+        for entry in self.snapshot():
+            for name, value in entry.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[name] = totals.get(name, 0) + value
+        return totals
+
+@contextmanager
+def run_context(run_id, username=None):
+    """Tag spans recorded in this block (and in tasks submitted with submit_with_context).
+
+    Yields the run's UsageLedger, which collects record_usage() calls.
+    """
+    ledger = UsageLedger()
+    token = _run_context.set({'run_id': run_id, 'username': username})
+    ledger_token = _usage_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _usage_ledger.reset(ledger_token)
+        _run_context.reset(token)
+
+def current_run():
+    """The run_id/username of the enclosing run_context, or an empty dict"""
+    return dict(_run_context.get())
+
+def record_usage(item_id, **fields):
+    """Add API usage for an item to the current run's ledger, if any"""
+    ledger = _usage_ledger.get()
+    if ledger is not None:
+        ledger.add(item_id, **fields)
+
+@contextmanager
+def profile_context(session):
+    """Profile tasks submitted with submit_with_context in this block with session"""
+    token = _profile_session.set(session)
+    try:
+        yield session
+    finally:
+        _profile_session.reset(token)
+
+def current_profile():
+    return _profile_session.get()
+
+def run_task(fn, *args, **kwargs):
+    session = _profile_session.get()
+    if session is None:
+        return fn(*args, **kwargs)
+    return session.run_task(fn, *args, **kwargs)
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """executor.submit that carries the current run context (and profiling) into the worker thread"""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, run_task, fn, *args, **kwargs)
+
+class SpanWriter:
+    """Buffer finished spans and hand them to write_batch from a background thread.
+
+    Spans are written in batches so pipeline threads never wait on the database.
+    When the buffer is full new spans are dropped rather than blocking.
+    """
+
+    def __init__(self, write_batch, flush_interval=2.0, batch_size=200, max_pending=10000):
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name="span-writer", daemon=True)
+
+    def __call__(self, record):
+        try:
+            self.pending.put_nowait(dict(record))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        self.thread.start()
+        add_span_listener(self)
+        return self
+
+    def close(self, timeout=10.0):
+        """Stop listening and write whatever is still buffered"""
+        remove_span_listener(self)
+        self.pending.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        closing = False
+        while not closing:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.pending.get(timeout=max(0.0, deadline - time.monotonic()) if batch else None)
+                except queue.Empty:
+                    break
+                if record is None:
+                    closing = True
+                    break
+                batch.append(record)
+            if not batch:
+                continue
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} spans: {str(e)}")
+
+def start_span_writer(write_batch, **kwargs):
+    """Persist every span from now on through write_batch (e.g. database.save_spans)"""
+    return SpanWriter(write_batch, **kwargs).start()
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (pct in 0-100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def summarize_spans(spans):
+    """Per-stage count, error count and p50/p95 duration for a list of span dicts"""
+    stages = {}
+    for record in spans:
+        stages.setdefault(record['stage'], []).append(record)
+
+    summary = {}
+    for stage, records in stages.items():
+        durations = [record['duration'] for record in records]
+        summary[stage] = {
+            'count': len(records),
+            'errors': sum(1 for record in records if span_failed(record['outcome'])),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'total': sum(durations),
+        }
+    return summary
@@ -0,0 +1,42 @@
+"""Shared setup: every test gets an empty database and storage directories.
+
+Modules read their paths and service endpoints from the environment on
+import, so the variables are set here before any of them is imported. The
+pipeline talks to one stub server (see stubs.py) for the whole session.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import pytest
+
+ROOT = tempfile.mkdtemp(prefix="estateai_tests_")
+DIRS = {
+    'REPORTS_DIR': os.path.join(ROOT, "reports"),
+    'RESULTS_DIR': os.path.join(ROOT, "results"),
+    'IMAGE_CACHE_DIR': os.path.join(ROOT, "image_cache"),
+    'PROFILES_DIR': os.path.join(ROOT, "profiles"),
+}
+os.environ.update(DIRS, DATABASE_PATH=os.path.join(ROOT, "estateai.db"), MAX_IMAGES_PER_RUN="6")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubServer, default_config  # noqa: E402
+
+STUB_CONFIG = default_config()
+STUB_CONFIG.update(latency_scale=0.01, image_size=(320, 240), seed=1)
+STUB_SERVER = StubServer(STUB_CONFIG)
+STUB_SERVER.start()
+os.environ.update(STUB_SERVER.environment())
+
+from database import DATABASE_NAME, init_db  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DATABASE_NAME + suffix):
+            os.remove(DATABASE_NAME + suffix)
+    for path in DIRS.values():
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    init_db()
+    yield
@@ -0,0 +1,38 @@
+"""Test data helpers shared by the test modules"""
+import os
+import time
+import sqlite3
+from database import DATABASE_NAME, save_report, update_storage_quota
+from reports import REPORTS_DIR
+
+def write_report(name, size=1024, month="2024-01"):
+    path = os.path.join(REPORTS_DIR, month, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b"x" * size)
+    return path
+
+def add_report(username, name, run_id, days_old=0, size=1024):
+    path = write_report(name, size)
+    save_report(username, path, run_id)
+    with sqlite3.connect(DATABASE_NAME) as conn:
+        conn.execute("UPDATE reports SET created_at = datetime('now', ?) WHERE report_path = ?",
+                     (f'-{days_old} days', path))
+    return path
+
+def add_user(username, quota_mb=None, max_images=100):
+    with sqlite3.connect(DATABASE_NAME) as conn:
+        user_id = conn.execute('''INSERT INTO users (username, email, password_hash, max_images)
+                                  VALUES (?, ?, 'x', ?)''',
+                               (username, f"{username}@example.com", max_images)).lastrowid
+    if quota_mb is not None:
+        update_storage_quota(user_id, quota_mb)
+    return user_id
+
+def age_file(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+def query(sql, params=()):
+    with sqlite3.connect(DATABASE_NAME) as conn:
+        return conn.execute(sql, params).fetchall()
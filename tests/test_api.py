@@ -0,0 +1,28 @@
+import base64
+import bcrypt
+from api import authenticate
+from helpers import query
+
+def set_password(username, password):
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(4)).decode('utf-8')
+    query('''INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)
+             ON CONFLICT(username) DO UPDATE SET password_hash = excluded.password_hash''',
+          (username, f"{username}@example.com", password_hash))
+
+def basic_auth(username, password):
+    return "Basic " + base64.b64encode(f"{username}:{password}".encode('utf-8')).decode('ascii')
+
+def test_password_change_ends_cached_logins():
+    set_password("alice", "old secret")
+    assert authenticate(basic_auth("alice", "old secret")) == "alice"
+
+    set_password("alice", "new secret")
+    assert authenticate(basic_auth("alice", "old secret")) is None
+    assert authenticate(basic_auth("alice", "new secret")) == "alice"
+
+def test_deleted_user_cannot_log_in():
+    set_password("alice", "secret")
+    assert authenticate(basic_auth("alice", "secret")) == "alice"
+
+    query("DELETE FROM users WHERE username = ?", ("alice",))
+    assert authenticate(basic_auth("alice", "secret")) is None
@@ -0,0 +1,21 @@
+from appraisals import find_prior_appraisal, lens_titles
+from database import save_appraisal
+from telemetry import run_context
+
+LENS_RESULTS = [{'title': f"Blue willow porcelain teapot #{idx}"} for idx in range(5)]
+
+def prior_for(username, image):
+    with run_context("run-2", username):
+        return find_prior_appraisal(image, LENS_RESULTS)
+
+def test_the_same_file_is_only_reused_for_its_owner():
+    save_appraisal("run-1", "alice", "file-1", "Teapot", "", "A teapot", "model")
+
+    assert prior_for("alice", {'id': "file-1"})['analysis'] == "A teapot"
+    assert prior_for("bob", {'id': "file-1"}) is None
+
+def test_matching_titles_are_only_reused_for_their_owner():
+    save_appraisal("run-1", "alice", "file-1", "Teapot", lens_titles(LENS_RESULTS), "A teapot", "model")
+
+    assert prior_for("alice", {'id': "file-2"})['analysis'] == "A teapot"
+    assert prior_for("bob", {'id': "file-2"}) is None
@@ -0,0 +1,25 @@
+import io
+import zipfile
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+from export import export_archive, export_size, user_runs
+from helpers import add_report
+
+def test_export_size_counts_selected_runs_only():
+    add_report("alice", "a.pdf", "run-1", days_old=2, size=1000)
+    add_report("alice", "a.xlsx", "run-1", days_old=2, size=500)
+    add_report("alice", "b.pdf", "run-2", days_old=1, size=4000)
+
+    assert export_size("alice", ["run-1"]) == 1500
+    assert export_size("alice", ["run-1", "run-2"]) == 5500
+    assert export_size("bob", ["run-1"]) == 0
+
+def test_export_archive_holds_the_selected_reports():
+    add_report("alice", "a.pdf", "run-1", days_old=2)
+    add_report("alice", "b.pdf", "run-2", days_old=1)
+
+    # What st.download_button does with the data its callable returns
+    archive, _ = convert_data_to_bytes_and_infer_mime(export_archive("alice", ["run-2"]), TypeError("unsupported type"))
+    names = zipfile.ZipFile(io.BytesIO(archive)).namelist()
+
+    assert [name.split('/')[-1] for name in names] == ["b.pdf"]
+    assert [key for key, _, _ in user_runs("alice")] == ["run-2", "run-1"]
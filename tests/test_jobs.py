@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import create_job, get_job, get_user_limits, claim_job
+from jobs import execute_job
+from pipeline import DRIVE_BASE_URL, MAX_IMAGES_PER_RUN
+from helpers import add_user, query
+
+class LostLease:
+    """A worker.Lease that was already taken over"""
+
+    def __init__(self):
+        self.lost = threading.Event()
+        self.lost.set()
+
+class LeaseLostAfter:
+    """A worker.Lease that is lost after its first checks checks"""
+
+    def __init__(self, checks):
+        self.lost = self
+        self.checks = checks
+
+    def is_set(self):
+        self.checks -= 1
+        return self.checks < 0
+
+def submit(job_id, folder, username="alice", mode="basic"):
+    create_job(job_id, username, f"{DRIVE_BASE_URL}/drive/folders/{folder}", mode)
+    return job_id
+
+def test_only_processed_images_are_charged():
+    add_user("alice")
+    job_id = submit("job-truncated", f"big-{MAX_IMAGES_PER_RUN + 4}")
+
+    assert execute_job(job_id)
+    assert get_job(job_id)['total_images'] == MAX_IMAGES_PER_RUN
+    assert get_user_limits("alice")[0] == MAX_IMAGES_PER_RUN
+
+def test_limit_check_ignores_images_beyond_the_run_cap():
+    add_user("alice", max_images=MAX_IMAGES_PER_RUN)
+    job_id = submit("job-at-limit", f"big-{MAX_IMAGES_PER_RUN + 4}")
+
+    assert execute_job(job_id)
+    assert get_job(job_id)['status'] == 'complete'
+
+def usage_rows(job_id):
+    return (query('SELECT COUNT(*) FROM usage_runs WHERE run_id = ?', (job_id,))[0][0],
+            query('SELECT COUNT(*) FROM usage_items WHERE run_id = ?', (job_id,))[0][0])
+
+def test_lost_lease_records_no_usage():
+    add_user("alice")
+    job_id = submit("job-lost", "lost-3", mode="analysis")
+    claim_job("worker-a", 60)
+
+    assert not execute_job(job_id, LostLease())
+    assert usage_rows(job_id) == (0, 0)
+    # The status belongs to the next worker
+    assert get_job(job_id)['status'] == 'running'
+
+def test_lease_lost_during_a_chunk_stores_no_results():
+    add_user("alice")
+    job_id = submit("job-lost-midway", "midway-3")
+    claim_job("worker-a", 60)
+
+    # Lost while the only chunk was being processed
+    assert not execute_job(job_id, LeaseLostAfter(1))
+    assert query('SELECT COUNT(*) FROM run_items WHERE run_id = ?', (job_id,)) == [(0,)]
+
+def test_retried_job_replaces_its_usage():
+    add_user("alice")
+    job_id = submit("job-retried", "retried-3", mode="analysis")
+
+    assert execute_job(job_id)
+    assert usage_rows(job_id) == (1, 3)
+    assert execute_job(job_id)
+    assert usage_rows(job_id) == (1, 3)
+
+def test_concurrent_workers_claim_each_job_once():
+    add_user("alice")
+    add_user("bob")
+    job_ids = [submit(f"job-{idx}", f"claim-{idx}", username=("alice", "bob")[idx % 2]) for idx in range(12)]
+
+    def drain(worker_id):
+        claimed = []
+        while True:
+            job_id = claim_job(worker_id, 60)
+            if not job_id:
+                return claimed
+            claimed.append(job_id)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        claims = [job_id for claimed in executor.map(drain, [f"worker-{idx}" for idx in range(6)])
+                  for job_id in claimed]
+
+    assert sorted(claims) == sorted(job_ids)
+
+def test_expired_leases_are_reclaimed_then_abandoned():
+    add_user("alice")
+    job_id = submit("job-expiring", "expiring-1")
+
+    for attempt in range(3):
+        assert claim_job(f"worker-{attempt}", -1) == job_id
+    assert claim_job("worker-3", 60, max_attempts=3) is None
+    job = get_job(job_id)
+    assert job['status'] == 'failed' and "3 attempts" in job['error']
@@ -0,0 +1,24 @@
+import pytest
+import pipeline
+from pipeline import DRIVE_BASE_URL, process_image
+
+def make_lot(lot_id, views=3):
+    return {'id': lot_id, 'name': lot_id, 'views': [
+        {'id': f"{lot_id}_{idx:05d}", 'url': f"{DRIVE_BASE_URL}/uc?id={lot_id}_{idx:05d}", 'name': f"view_{idx}.jpg"}
+        for idx in range(views)]}
+
+def test_lot_views_are_removed_when_analysis_fails(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("analysis failed")
+    monkeypatch.setattr(pipeline, 'analyze_image', fail)
+
+    with pytest.raises(RuntimeError):
+        process_image(make_lot("lot-failing"), "analysis", str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+def test_lot_views_are_removed_without_a_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'analyze_image', lambda image, img_path, *args: (None, img_path))
+
+    result, img_path = process_image(make_lot("lot-empty"), "analysis", str(tmp_path))
+    assert result is None
+    assert list(tmp_path.iterdir()) == [tmp_path / img_path.rsplit('/', 1)[-1]]
@@ -0,0 +1,41 @@
+import os
+import openpyxl
+from PIL import Image
+from prices import price_records
+from reports import REPORTS_DIR, write_reports
+
+def photo(tmp_path, name, color=(120, 80, 40)):
+    path = str(tmp_path / name)
+    Image.new('RGB', (64, 48), color).save(path, 'JPEG')
+    return path
+
+def result(item_id, image_path, analysis="- Name: Teapot"):
+    return {'item_id': item_id, 'name': f"{item_id}.jpg", 'temp_image_path': image_path, 'analysis': analysis,
+            'prices': price_records([{'source': "eBay", 'price': {'value': "$12.00", 'extracted_value': 12.0}}])}
+
+def test_missing_thumbnail_keeps_the_row(tmp_path):
+    results = [result("a", photo(tmp_path, "a.jpg")), result("b", None, "- Name: Vase")]
+
+    pdf_path, xlsx_path = write_reports(results, "missing", REPORTS_DIR)
+
+    assert os.path.exists(pdf_path)
+    sheet = openpyxl.load_workbook(xlsx_path).active
+    analyses = [cell.value for cell in sheet['B'] if cell.value and str(cell.value).startswith("- Name")]
+    assert [text.splitlines()[0] for text in analyses] == ["- Name: Teapot", "- Name: Vase"]
+    assert len(sheet._images) == 1
+
+def test_identical_reports_are_linked(tmp_path):
+    results = [result("a", photo(tmp_path, "a.jpg"))]
+
+    first = write_reports(results, "first", REPORTS_DIR)
+    second = write_reports(results, "second", REPORTS_DIR)
+
+    for old, new in zip(first, second):
+        assert old != new
+        assert os.path.samefile(old, new)
+
+def test_changed_photo_is_rendered_again(tmp_path):
+    first = write_reports([result("a", photo(tmp_path, "a.jpg"))], "first", REPORTS_DIR)
+    second = write_reports([result("a", photo(tmp_path, "b.jpg", (10, 200, 10)))], "second", REPORTS_DIR)
+
+    assert not os.path.samefile(first[0], second[0])
@@ -0,0 +1,72 @@
+import os
+import storage
+from database import save_report, get_reports
+from helpers import add_report, add_user, age_file, write_report
+
+def test_reports_are_kept_by_default():
+    add_user("alice")
+    old = add_report("alice", "old.pdf", "run-1", days_old=3650, size=4 * 1024 * 1024)
+    add_report("alice", "new.pdf", "run-2", size=4 * 1024 * 1024)
+
+    assert storage.REPORT_RETENTION_DAYS == 0 and storage.STORAGE_QUOTA_MB == 0
+    assert storage.apply_retention() == 0
+    assert storage.enforce_quota("alice") == 0
+    assert os.path.exists(old)
+    assert len(get_reports("alice")) == 2
+
+def test_retention_removes_old_reports_only():
+    old = add_report("alice", "old.pdf", "run-1", days_old=40)
+    new = add_report("alice", "new.pdf", "run-2", days_old=1)
+
+    assert storage.apply_retention(days=30) == 1024
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+    assert [row[2] for row in get_reports()] == [new]
+
+def test_retention_keeps_files_other_reports_share():
+    shared = add_report("alice", "shared.pdf", "run-1", days_old=40)
+    save_report("bob", shared, "run-2")
+
+    assert storage.apply_retention(days=30) == 0
+    assert os.path.exists(shared)
+    assert [row[1] for row in get_reports()] == ["bob"]
+
+def test_quota_removes_oldest_runs_and_keeps_newest():
+    add_user("alice", quota_mb=1)
+    megabyte = 1024 * 1024
+    oldest = add_report("alice", "a.pdf", "run-1", days_old=3, size=megabyte // 2)
+    middle = add_report("alice", "b.pdf", "run-2", days_old=2, size=megabyte // 2)
+    newest = add_report("alice", "c.pdf", "run-3", days_old=1, size=megabyte // 2)
+
+    assert storage.enforce_quota("alice") == megabyte // 2
+    assert not os.path.exists(oldest)
+    assert os.path.exists(middle) and os.path.exists(newest)
+
+def test_quota_never_removes_the_newest_run():
+    add_user("alice", quota_mb=1)
+    newest = add_report("alice", "big.pdf", "run-1", size=2 * 1024 * 1024)
+
+    assert storage.enforce_quota("alice") == 0
+    assert os.path.exists(newest)
+
+def test_garbage_collection_removes_old_orphans_only():
+    referenced = add_report("alice", "kept.pdf", "run-1")
+    old_orphan = write_report("old_orphan.pdf")
+    young_orphan = write_report("young_orphan.xlsx")
+    other_file = write_report("notes.txt")
+    for path in (referenced, old_orphan, other_file):
+        age_file(path, storage.ORPHAN_GRACE_SECONDS + 60)
+
+    stats = storage.collect_garbage()
+
+    assert stats['files'] == 1 and stats['bytes'] == 1024
+    assert not os.path.exists(old_orphan)
+    assert all(os.path.exists(path) for path in (referenced, young_orphan, other_file))
+
+def test_garbage_collection_forgets_reports_whose_files_are_gone():
+    gone = add_report("alice", "gone.pdf", "run-1")
+    kept = add_report("alice", "kept.pdf", "run-2")
+    os.remove(gone)
+
+    assert storage.collect_garbage()['rows'] == 1
+    assert [row[2] for row in get_reports()] == [kept]
@@ -0,0 +1,15 @@
+from telemetry import span, summarize_spans, add_span_listener, remove_span_listener
+
+def test_only_failures_count_as_errors():
+    spans = []
+    add_span_listener(spans.append)
+    try:
+        for outcome in ('ok', 'hit', 'miss', 'rejected', 'cancelled', 'http_500', 'error'):
+            with span('image_cache') as record:
+                record['outcome'] = outcome
+    finally:
+        remove_span_listener(spans.append)
+
+    summary = summarize_spans(spans)['image_cache']
+    assert summary['count'] == 7
+    assert summary['errors'] == 2
@@ -0,0 +1,64 @@
+import random
+import pytest
+import visual_index
+from database import save_appraisal
+from pipeline import DRIVE_BASE_URL, process_image
+from telemetry import run_context
+from visual_index import MultiIndexHash, VisualIndex, find_visual_match
+from helpers import query
+
+@pytest.fixture(autouse=True)
+def fresh_index():
+    visual_index._index = None
+    yield
+    visual_index._index = None
+
+def test_multi_index_finds_what_a_full_scan_finds():
+    rng = random.Random(7)
+    hashes = MultiIndexHash(3)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    for key, value in enumerate(values):
+        hashes.add(value, key)
+
+    for value in values[:50] + [value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for value in values[50:100]]:
+        expected = sorted((bin(other ^ value).count('1'), key) for key, other in enumerate(values)
+                          if bin(other ^ value).count('1') <= 3)
+        assert sorted(hashes.search(value)) == expected
+
+def test_lookups_only_see_the_users_own_appraisals():
+    index = VisualIndex(30, max_distance=3)
+    index.refreshed_at = float('inf')
+    index.add(0xabcdef, 1, "alice")
+
+    assert index.search(0xabcdef ^ 0b11, "alice") == [(2, 1)]
+    assert index.search(0xabcdef, "bob") == []
+
+def test_stored_appraisals_are_matched_for_their_owner_only():
+    save_appraisal("run-1", "alice", "item-1", "Teapot", "Vintage teapot", "A teapot", "model",
+                   f"{0x1234:016x}", "[{\"title\": \"Vintage teapot\"}]")
+
+    match = find_visual_match(0x1234 ^ 1, "alice")
+    assert match['distance'] == 1 and match['lens_results'] == [{'title': "Vintage teapot"}]
+    assert find_visual_match(0x1234, "bob") is None
+
+def appraise(image, username, work_dir):
+    with run_context("run-2", username):
+        result, _ = process_image(image, "analysis", str(work_dir), reuse_prior=True)
+    return result
+
+def test_reuse_stores_no_new_appraisal(tmp_path):
+    image = {'id': "reuse-1_00000", 'url': f"{DRIVE_BASE_URL}/uc?id=reuse-1_00000", 'name': "image.jpg"}
+    save_appraisal("run-1", "alice", image['id'], image['name'], "Vintage teapot", "A teapot", "model")
+
+    by_title = appraise(image, "alice", tmp_path)
+    assert by_title['analysis'] == "A teapot" and by_title['reuse_match'].startswith("listing titles")
+    # The photo was attached to the reused appraisal rather than stored again
+    assert query('SELECT COUNT(*), COUNT(image_hash) FROM appraisals') == [(1, 1)]
+
+    by_photo = appraise(image, "alice", tmp_path)
+    assert by_photo['analysis'] == "A teapot" and by_photo['reuse_match'] == "photo, 0 of 64 bits differ"
+
+    # Another user's photo is neither matched against nor attached to alice's appraisal
+    for_bob = appraise(image, "bob", tmp_path)
+    assert for_bob['analysis'] != "A teapot" and 'reuse_match' not in for_bob
+    assert query('SELECT username, COUNT(image_hash) FROM appraisals GROUP BY username') == [("alice", 1), ("bob", 1)]
@@ -0,0 +1,23 @@
+import time
+from database import create_job, claim_job, update_job
+from worker import Lease
+from helpers import query
+
+def hold_lease(job_id, worker_id, after_claim):
+    with Lease(job_id, worker_id, lease_seconds=0.03) as lease:
+        after_claim()
+        time.sleep(0.1)
+    return lease.lost.is_set()
+
+def test_a_finished_job_does_not_lose_its_lease():
+    create_job("job-1", "alice", "folder", "basic")
+    claim_job("worker-a", 60)
+
+    assert not hold_lease("job-1", "worker-a", lambda: update_job("job-1", status='complete'))
+    assert query('SELECT lease_owner FROM jobs') == [(None,)]
+
+def test_a_job_taken_over_loses_its_lease():
+    create_job("job-1", "alice", "folder", "basic")
+    claim_job("worker-a", 60)
+
+    assert hold_lease("job-1", "worker-a", lambda: query("UPDATE jobs SET lease_owner = 'worker-b'"))
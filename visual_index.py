@@ -0,0 +1,166 @@
+"""In-memory index of the image hashes of past appraisals.
+
+Estates often hold items appraised before (the same dinner set, a common
+figurine), and those items should not pay for Lens and the LLM again. Every
+stored appraisal keeps the hash of its image (see quality.image_hash) and
+its Lens matches. The hashes are held in memory (see MultiIndexHash),
+loaded from SQLite when a process starts; processes pick up appraisals
+saved by other processes every VISUAL_INDEX_REFRESH_SECONDS.
+
+Multi-index hashing is used rather than a BK-tree: hashes of unrelated
+photos all sit about 32 bits apart, which leaves a BK-tree little to prune.
+
+pipeline.analyze_image looks up each downloaded image before calling Lens.
+Lookups only see the appraisals of the user running the item. An appraisal
+within VISUAL_REUSE_DISTANCE bits is reused together with its Lens matches
+and the result says so in 'reuse_match'.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from database import get_appraisal_hashes, get_appraisal
+from appraisals import REUSE_MAX_AGE_DAYS
+from quality import image_hash
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Hash bits an image may differ from a past appraisal's image and still reuse it. Re-shot photos of
+# one item differ by up to about 16 and unrelated photos by about 32, so this only matches re-uploads
+# and near-identical shots
+VISUAL_REUSE_DISTANCE = int(os.getenv('VISUAL_REUSE_DISTANCE', '3'))
+VISUAL_INDEX_REFRESH_SECONDS = 30
+
+class MultiIndexHash:
+    """Multi-index hashing of 64-bit hashes for Hamming-distance lookups.
+
+    The bits are split into max_distance + 1 chunks, each with its own table
+    from chunk value to entries. Two hashes within max_distance bits agree
+    exactly on at least one chunk, so a search only compares the entries
+    sharing a chunk with the query.
+    """
+
+    def __init__(self, max_distance):
+        count = max(1, max_distance + 1)
+        widths = [64 // count + (idx < 64 % count) for idx in range(count)]
+        shifts = [sum(widths[idx + 1:]) for idx in range(count)]
+        self.max_distance = max_distance
+        self.chunks = [(shift, (1 << width) - 1) for shift, width in zip(shifts, widths)]
+        self.tables = [{} for _ in self.chunks]
+        self.values = []
+        self.keys = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, key):
+        entry = len(self.values)
+        self.values.append(value)
+        self.keys.append(key)
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            table.setdefault((value >> shift) & mask, []).append(entry)
+
+    def search(self, value, max_distance=None):
+        """(distance, key) of every entry within max_distance bits of value, closest and newest first"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = set()
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            candidates.update(table.get((value >> shift) & mask, ()))
+        found = []
+        for entry in candidates:
+            distance = bin(self.values[entry] ^ value).count('1')
+            if distance <= max_distance:
+                found.append((distance, self.keys[entry]))
+        found.sort(key=lambda match: (match[0], -match[1]))
+        return found
+
+class VisualIndex:
+    """Hashes of recent appraisals per user, keyed by appraisal_id"""
+
+    def __init__(self, max_age_days, max_distance=VISUAL_REUSE_DISTANCE):
+        self.max_age_days = max_age_days
+        self.max_distance = max_distance
+        self.users = {}
+        self.ids = set()
+        # Highest appraisal_id read from the database; ids added locally don't count
+        # as other processes may have saved lower ones in the meantime
+        self.last_id = 0
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Add appraisals saved since the last refresh, at most every VISUAL_INDEX_REFRESH_SECONDS"""
+        with self.lock:
+            if not force and self.refreshed_at and time.monotonic() - self.refreshed_at < VISUAL_INDEX_REFRESH_SECONDS:
+                return
+            self.refreshed_at = time.monotonic()
+            rows = get_appraisal_hashes(self.max_age_days, self.last_id)
+            for appraisal_id, username, value in rows:
+                self.add_locked(int(value, 16), appraisal_id, username)
+                self.last_id = max(self.last_id, appraisal_id)
+        if rows:
+            logger.info(f"Visual index: added {len(rows)} appraisals, {len(self.ids)} in total")
+
+    def add_locked(self, value, appraisal_id, username):
+        if appraisal_id not in self.ids:
+            if username not in self.users:
+                self.users[username] = MultiIndexHash(self.max_distance)
+            self.users[username].add(value, appraisal_id)
+            self.ids.add(appraisal_id)
+
+    def add(self, value, appraisal_id, username):
+        with self.lock:
+            self.add_locked(value, appraisal_id, username)
+
+    def search(self, value, username):
+        """(distance, appraisal_id) of username's appraisals close to value, closest first"""
+        self.refresh()
+        with self.lock:
+            hashes = self.users.get(username)
+            return hashes.search(value) if hashes else []
+
+_index = None
+_index_lock = threading.Lock()
+
+def visual_index():
+    """This process's index, loaded from the database on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VisualIndex(REUSE_MAX_AGE_DAYS)
+    return _index
+
+def load_visual_index():
+    """Load the hashes of recent appraisals; called when a server process starts"""
+    index = visual_index()
+    index.refresh(force=True)
+    return index
+
+def add_to_visual_index(value, appraisal_id, username):
+    """Make an appraisal this process just saved visible to its next lookups"""
+    visual_index().add(value, appraisal_id, username)
+
+def lookup_hash(path):
+    """Hash of a downloaded image for the index, or None if it cannot be read"""
+    try:
+        return image_hash(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not hash image {path}: {str(e)}")
+        return None
+
+def find_visual_match(value, username):
+    """username's closest recent appraisal within VISUAL_REUSE_DISTANCE bits of an image hash, or None.
+
+    The appraisal dict has 'lens_results' decoded and 'distance' set.
+    """
+    with span('visual_lookup') as lookup_span:
+        index = visual_index()
+        for distance, appraisal_id in index.search(value, username):
+            appraisal = get_appraisal(appraisal_id, index.max_age_days)
+            if appraisal and appraisal['lens_results']:
+                lookup_span['outcome'] = 'hit'
+                return dict(appraisal, lens_results=json.loads(appraisal['lens_results']), distance=distance)
+        lookup_span['outcome'] = 'miss'
+        return None
@@ -0,0 +1,126 @@
+"""Standalone job worker.
+
+Usage:
+    python worker.py [--concurrency 1] [--lease-seconds 60] [--poll-interval 2] [--once]
+
+Workers claim queued jobs (see api.py) from the shared jobs table under a
+lease that a heartbeat thread keeps renewing. Any number of workers can run
+next to the app against the same database. If a worker dies, its lease
+expires and another worker picks the job up again from the start.
+Workers also run report storage maintenance (see storage.py) in the background.
+"""
+import os
+import sys
+import uuid
+import socket
+import signal
+import logging
+import argparse
+import threading
+from database import init_db, get_job, claim_job, renew_lease, release_job, save_spans
+from jobs import execute_job
+from telemetry import start_span_writer
+from storage import start_storage_gc
+from visual_index import load_visual_index
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = float(os.getenv('WORKER_LEASE_SECONDS', '60'))
+POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '2'))
+# Claims of a job before it is given up on (each crash or lost lease uses one)
+MAX_ATTEMPTS = int(os.getenv('WORKER_MAX_ATTEMPTS', '3'))
+
+class Lease:
+    """Keep a worker's lease on a job alive from a background thread.
+
+    lost is set when a renewal finds the lease taken over, e.g. after the
+    worker was paused for longer than the lease. A job the worker has
+    already finished ends the heartbeat without losing the lease.
+    """
+
+    def __init__(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.heartbeat, name=f"lease-{job_id[:8]}", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        release_job(self.job_id, self.worker_id)
+
+    def heartbeat(self):
+        # Renew well before expiry so one slow database write doesn't cost the lease
+        while not self.stopped.wait(self.lease_seconds / 3):
+            if not renew_lease(self.job_id, self.worker_id, self.lease_seconds):
+                job = get_job(self.job_id)
+                if job and job['lease_owner'] == self.worker_id and job['status'] != 'running':
+                    return
+                logger.warning(f"Lease on job {self.job_id} lost by {self.worker_id}")
+                self.lost.set()
+                return
+
+def new_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def work(worker_id, stop, lease_seconds=LEASE_SECONDS, poll_interval=POLL_INTERVAL, once=False):
+    """Claim and run jobs until stop is set (or, with once, until the queue is empty)"""
+    while not stop.is_set():
+        job_id = claim_job(worker_id, lease_seconds, MAX_ATTEMPTS)
+        if not job_id:
+            if once:
+                return
+            stop.wait(poll_interval)
+            continue
+
+        logger.info(f"{worker_id} claimed job {job_id}")
+        with Lease(job_id, worker_id, lease_seconds) as lease:
+            try:
+                execute_job(job_id, lease)
+            except Exception as e:
+                # execute_job records job failures itself; this only guards the loop
+                logger.error(f"{worker_id} job {job_id} crashed: {str(e)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EstateGenius AI job worker")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv('WORKER_CONCURRENCY', '1')),
+                        help="Jobs this process runs at the same time")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS,
+                        help="How long a claimed job stays leased without a heartbeat")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help="Seconds to wait before polling an empty queue again")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    span_writer = start_span_writer(save_spans)
+    load_visual_index()
+
+    # Finish running jobs on SIGTERM/SIGINT instead of leaving them to lease expiry
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    # Storage maintenance is idempotent, so it is safe for every worker process to run it
+    start_storage_gc(stop)
+
+    threads = [threading.Thread(target=work, name=f"worker-{idx}",
+                                args=(new_worker_id(), stop, args.lease_seconds, args.poll_interval, args.once))
+               for idx in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Started {len(threads)} worker thread(s)")
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+    span_writer.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())